@@ -0,0 +1,79 @@
+""" Collate time and allocations per batch of `collater`, which allocates
+new batch tensors for every batch, against `BatchCollater`, which reuses
+shared memory buffers, in process and behind DataLoader workers (where
+every new tensor also means new shared memory to map):
+
+    python -m benchmarks.bench_collate --batch_size 8 --height 1024 --width 1024
+"""
+import argparse
+import time
+
+import numpy as np
+import torch
+from torch.utils.data import DataLoader, Dataset
+
+from retinanet.dataloader import BatchCollater, collater
+from benchmarks.common import report, timeit
+
+
+class RandomSamples(Dataset):
+    """ `Resizer` samples of random images of one size """
+
+    def __init__(self, num_samples, height, width, dtype, num_annotations):
+        random = np.random.RandomState(0)
+        self.num_samples = num_samples
+        self.image = torch.from_numpy(random.randint(0, 256, (height, width, 3)).astype(dtype))
+        self.annot = torch.from_numpy(random.rand(num_annotations, 4).astype(np.float32))
+
+    def __len__(self):
+        return self.num_samples
+
+    def __getitem__(self, idx):
+        return {'img': self.image, 'annot': self.annot, 'scale': 1, 'size': tuple(self.image.shape[:2])}
+
+
+def collate_batches(collate_fn, samples, num_batches):
+    for _ in range(num_batches):
+        collate_fn(samples)
+
+
+def load_batches(loader):
+    start = time.perf_counter()
+    for _ in loader:
+        pass
+    return time.perf_counter() - start
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description='Time batch collation.')
+    parser.add_argument('--batch_size', type=int, default=8)
+    parser.add_argument('--height', type=int, default=608)
+    parser.add_argument('--width', type=int, default=1024)
+    parser.add_argument('--dtype', choices=['uint8', 'float32'], default='float32')
+    parser.add_argument('--num_annotations', type=int, default=50)
+    parser.add_argument('--batches', type=int, default=50)
+    parser.add_argument('--workers', type=int, default=3)
+    parser = parser.parse_args(args)
+
+    dataset = RandomSamples(parser.batch_size * parser.batches, parser.height, parser.width,
+                            parser.dtype, parser.num_annotations)
+    samples = [dataset[i] for i in range(parser.batch_size)]
+    buffered = BatchCollater()
+
+    print('{} batches of {} {}x{} {} images'.format(
+        parser.batches, parser.batch_size, parser.height, parser.width, parser.dtype))
+    report('collater, per batch', timeit(collate_batches, collater, samples, parser.batches) / parser.batches)
+    print('{:<40} | {:9.2f}'.format('collater, allocations per batch', 2.0))
+    report('BatchCollater, per batch', timeit(collate_batches, buffered, samples, parser.batches) / parser.batches)
+    print('{:<40} | {:9.2f}'.format('BatchCollater, allocations per batch',
+                                   buffered.buffers.allocations / (5 * parser.batches)))
+
+    for name, collate_fn in (('collater', collater), ('BatchCollater', BatchCollater())):
+        loader = DataLoader(dataset, batch_size=parser.batch_size, num_workers=parser.workers,
+                            collate_fn=collate_fn)
+        report('{} + {} workers, per batch'.format(name, parser.workers),
+               load_batches(loader) / parser.batches)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+""" Accuracy parity and throughput of the channels_last / bfloat16 CPU
+inference mode, folded BatchNorms and fused heads against plain float32, on
+the CSV validation split:
+
+    python -m benchmarks.bench_cpu_inference --model_path csv_retinanet_99.pt \
+        --csv_val annotations/validation.csv --csv_classes annotations/labels.csv --images_dir images
+"""
+import argparse
+import copy
+import sys
+
+from benchmarks.common import add_csv_arguments, load_csv_dataset, load_model, mean_average_precision, \
+    throughput
+
+
+def fold_bn(model):
+    return model.fold_batchnorm()
+
+
+def fuse_heads(model):
+    return model.fuse_heads()
+
+
+def channels_last(model):
+    return model.set_cpu_inference_mode(channels_last=True)
+
+
+def channels_last_bf16(model):
+    return model.set_cpu_inference_mode(channels_last=True, bfloat16=True)
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(
+        description='Compare CPU inference modes against float32.')
+    add_csv_arguments(parser)
+    parser.add_argument('--num_images', help='Images used for the throughput measure',
+                        type=int, default=20)
+    parser.add_argument('--tolerance', help='Largest accepted mAP drop',
+                        type=float, default=0.01)
+    parser = parser.parse_args(args)
+
+    dataset = load_csv_dataset(parser)
+    reference = load_model(parser.model_path)
+
+    modes = [('float32', []),
+             ('folded bn', [fold_bn]),
+             ('fused heads', [fuse_heads]),
+             ('channels_last', [channels_last]),
+             ('channels_last + folded bn', [fold_bn, channels_last]),
+             ('channels_last + folded bn + fused heads', [fold_bn, fuse_heads, channels_last]),
+             ('channels_last + bfloat16', [channels_last_bf16])]
+
+    results = []
+    for name, steps in modes:
+        model = reference
+        if steps:
+            model = copy.deepcopy(reference)
+            for step in steps:
+                model = step(model)
+        results.append((name,
+                        mean_average_precision(dataset, model, parser.batch_size),
+                        throughput(dataset, model, parser.batch_size, parser.num_images)))
+
+    reference_map = results[0][1]
+    passed = True
+    print('\n{:<40} | {:>8} | {:>10} | {:>8}'.format('mode', 'mAP', 'mAP delta', 'img/s'))
+    for name, mean_ap, images_per_second in results:
+        passed &= reference_map - mean_ap <= parser.tolerance
+        print('{:<40} | {:8.4f} | {:+10.4f} | {:8.2f}'.format(
+            name, mean_ap, mean_ap - reference_map, images_per_second))
+
+    print('parity: {}'.format('PASS' if passed else 'FAIL'))
+    return 0 if passed else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
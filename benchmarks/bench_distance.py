@@ -0,0 +1,95 @@
+""" Peak memory and time of anchor/annotation distance reductions.
+
+Compares the former tiled distance matrices with the chunked kernels of
+`retinanet.geometry`:
+
+    python -m benchmarks.bench_distance --height 1024 --width 1024 --annotations 300
+"""
+import argparse
+
+import numpy as np
+import torch
+
+from retinanet.anchor_utils import anchors_for_shape
+from retinanet.geometry import nearest
+from retinanet.settings import ANGLE_SPLIT, NUM_VARIABLES, POSITION_WEIGHT
+from benchmarks.common import peak_memory, report, timeit
+
+
+def _tiled_distance_torch(a, b):
+    # reference: the distance computation that `losses.calc_distance` used
+    def distance(ax, bx):
+        at = torch.tile(ax, (bx.shape[0], 1)).transpose(-1, 0)
+        bt = torch.tile(bx, (ax.shape[0], 1))
+        return torch.abs(at - bt)
+
+    dalpha = distance(a[:, 2], b[:, 2])
+    dx = distance(a[:, 0], b[:, 0])
+    dy = distance(a[:, 1], b[:, 1])
+    return POSITION_WEIGHT * torch.sqrt(dx * dx + dy * dy) + dalpha
+
+
+def _tiled_distance_numpy(a, b):
+    # reference: the distance computation that `csv_eval.compute_distance` used
+    def distance(ax, bx):
+        at = np.transpose([ax] * bx.shape[0])
+        bt = np.tile(bx, (ax.shape[0], 1))
+        return np.abs(at - bt)
+
+    dalpha = distance(a[:, 2], b[:, 2])
+    dx = distance(a[:, 0], b[:, 0])
+    dy = distance(a[:, 1], b[:, 1])
+    return POSITION_WEIGHT * np.sqrt(dx * dx + dy * dy) + dalpha
+
+
+def _inputs(height, width, num_annotations, backend):
+    anchors = anchors_for_shape((height, width), angle_split=ANGLE_SPLIT,
+                                num_variables=NUM_VARIABLES, stride=8).astype(np.float32)
+    rng = np.random.RandomState(0)
+    annotations = np.stack([rng.uniform(0, width, num_annotations),
+                            rng.uniform(0, height, num_annotations),
+                            rng.uniform(0, 360, num_annotations)], axis=1).astype(np.float32)
+    if backend == 'torch':
+        return torch.from_numpy(anchors), torch.from_numpy(annotations)
+    return anchors, annotations
+
+
+def run_tiled(height, width, num_annotations, backend):
+    a, b = _inputs(height, width, num_annotations, backend)
+    if backend == 'torch':
+        return torch.min(_tiled_distance_torch(a, b), dim=1)
+    distance = _tiled_distance_numpy(a, b)
+    return distance.min(axis=1), distance.argmin(axis=1)
+
+
+def run_chunked(height, width, num_annotations, backend, memory_budget):
+    a, b = _inputs(height, width, num_annotations, backend)
+    return nearest(a, b, position_weight=POSITION_WEIGHT, memory_budget=memory_budget)
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(
+        description='Benchmark anchor to annotation distance reductions.')
+    parser.add_argument('--height', type=int, default=1024)
+    parser.add_argument('--width', type=int, default=1024)
+    parser.add_argument('--annotations', type=int, default=300)
+    parser.add_argument('--memory_budget', type=int, default=64,
+                        help='chunk memory budget in MB')
+    parser = parser.parse_args(args)
+
+    budget = parser.memory_budget * 2 ** 20
+    shape = (parser.height, parser.width, parser.annotations)
+
+    for backend in ('numpy', 'torch'):
+        base_inputs = peak_memory(_inputs, *shape, backend)
+        tiled = peak_memory(run_tiled, *shape, backend)
+        chunked = peak_memory(run_chunked, *shape, backend, budget)
+
+        report('{} tiled'.format(backend),
+               timeit(run_tiled, *shape, backend, repeat=1), tiled - base_inputs)
+        report('{} chunked'.format(backend),
+               timeit(run_chunked, *shape, backend, budget, repeat=1), chunked - base_inputs)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+""" Memory and time of one focal loss forward/backward step on CPU.
+
+Compares the former probability-space loss (sigmoid in the head, clamp,
+two logs and dense alpha/focal/bce/target tensors) with the fused
+logit-space `losses.sigmoid_focal_loss`:
+
+    python -m benchmarks.bench_focal_loss --height 1024 --width 1024
+"""
+import argparse
+
+import numpy as np
+import torch
+
+from retinanet.losses import sigmoid_focal_loss
+from retinanet.settings import ANGLE_SPLIT, STRIDE
+from benchmarks.common import peak_memory, report, timeit
+
+
+def _inputs(height, width, num_classes, num_positives):
+    num_anchors = (height // STRIDE) * (width // STRIDE) * ANGLE_SPLIT
+    generator = torch.Generator().manual_seed(0)
+    logits = torch.randn((1, num_anchors, num_classes), generator=generator) - 4
+    logits.requires_grad_(True)
+
+    anchor_order = torch.randperm(num_anchors, generator=generator)
+    positive_anchor = anchor_order[:num_positives]
+    ignored_anchor = anchor_order[num_positives:2 * num_positives]
+    positive_label = torch.randint(num_classes, (num_positives,), generator=generator)
+    return logits, positive_anchor, ignored_anchor, positive_label
+
+
+def run_dense(height, width, num_classes, num_positives, alpha=0.25, gamma=2.0):
+    # reference: the loss as computed before, on sigmoid probabilities
+    logits, positive_anchor, ignored_anchor, positive_label = _inputs(
+        height, width, num_classes, num_positives)
+
+    classification = torch.clamp(torch.sigmoid(logits), 1e-4, 1.0 - 1e-4)
+    targets = torch.zeros_like(classification)
+    targets[0, ignored_anchor, :] = -1
+    targets[0, positive_anchor, positive_label] = 1
+
+    alpha_factor = torch.ones(targets.shape) * alpha
+    alpha_factor = torch.where(
+        torch.eq(targets, 1.), alpha_factor, 1. - alpha_factor)
+    focal_weight = torch.where(
+        torch.eq(targets, 1.), 1. - classification, classification)
+    focal_weight = alpha_factor * torch.pow(focal_weight, gamma)
+    bce = -(targets * torch.log(classification) +
+            (1.0 - targets) * torch.log(1.0 - classification))
+    cls_loss = focal_weight * bce
+    cls_loss = torch.where(
+        torch.ne(targets, -1.0), cls_loss, torch.zeros(cls_loss.shape))
+    loss = cls_loss.sum() / max(num_positives, 1)
+    loss.backward()
+    return float(loss)
+
+
+def run_fused(height, width, num_classes, num_positives, alpha=0.25, gamma=2.0):
+    logits, positive_anchor, ignored_anchor, positive_label = _inputs(
+        height, width, num_classes, num_positives)
+
+    keep = torch.ones(logits.shape[:2], dtype=torch.bool)
+    keep[0, ignored_anchor] = False
+    positive_batch = torch.zeros_like(positive_anchor)
+
+    loss = sigmoid_focal_loss(logits, keep, positive_batch, positive_anchor,
+                              positive_label, alpha=alpha, gamma=gamma)
+    loss = loss.sum() / max(num_positives, 1)
+    loss.backward()
+    return float(loss)
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(
+        description='Benchmark the focal loss on CPU.')
+    parser.add_argument('--height', type=int, default=1024)
+    parser.add_argument('--width', type=int, default=1024)
+    parser.add_argument('--classes', type=int, default=1)
+    parser.add_argument('--positives', type=int, default=2000)
+    parser = parser.parse_args(args)
+
+    torch.set_num_threads(1)
+    shape = (parser.height, parser.width, parser.classes, parser.positives)
+
+    dense, fused = run_dense(*shape), run_fused(*shape)
+    print('loss dense: {:.6f} | fused: {:.6f}'.format(dense, fused))
+    assert np.isclose(dense, fused, rtol=1e-4)
+
+    base = peak_memory(_inputs, *shape)
+    dense_time, fused_time = timeit(run_dense, *shape), timeit(run_fused, *shape)
+    dense_memory = peak_memory(run_dense, *shape) - base
+    fused_memory = peak_memory(run_fused, *shape) - base
+
+    report('dense probability loss', dense_time, dense_memory)
+    report('fused logit loss', fused_time, fused_memory)
+    report('saved per step', dense_time - fused_time, dense_memory - fused_memory)
+
+
+if __name__ == '__main__':
+    main()
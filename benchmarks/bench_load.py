@@ -0,0 +1,114 @@
+""" Local load test of the micro-batching inference server.
+
+Starts the server in this process on a free loopback port, once per
+--max_batch_size value, and fires --requests requests from --concurrency
+client threads at it. Reports throughput and latency percentiles:
+
+    python -m benchmarks.bench_load --model_path csv_retinanet_99.pt --image images/0001.jpg
+
+Without --model_path the server is measured against a model that detects
+nothing, which isolates the HTTP and batching overhead. --url targets a
+server that is already running instead.
+"""
+import argparse
+import threading
+import time
+import urllib.request
+
+import cv2
+import numpy as np
+import torch
+
+from benchmarks.common import load_model
+from retinanet.serving import InferenceServer, MicroBatcher
+
+
+class _NullModel(object):
+    quantized = False
+
+    def __call__(self, inputs):
+        img_batch = inputs[0]
+        return [[torch.zeros((0,)), torch.zeros((0,), dtype=torch.long), torch.zeros((0, 3))]
+                for _ in range(img_batch.shape[0])]
+
+
+def _client(url, body, count, latencies, errors):
+    for _ in range(count):
+        request = urllib.request.Request(url, data=body, headers={'Content-Type': 'application/octet-stream'})
+        start = time.perf_counter()
+        try:
+            with urllib.request.urlopen(request) as response:
+                response.read()
+            latencies.append(time.perf_counter() - start)
+        except Exception:
+            errors.append(1)
+
+
+def load(url, body, requests, concurrency):
+    """ (requests per second, latencies in seconds, errors) of `requests`
+    requests sent by `concurrency` threads.
+    """
+    latencies, errors = [], []
+    per_client = [requests // concurrency + (i < requests % concurrency) for i in range(concurrency)]
+    clients = [threading.Thread(target=_client, args=(url, body, count, latencies, errors))
+               for count in per_client]
+    start = time.perf_counter()
+    for client in clients:
+        client.start()
+    for client in clients:
+        client.join()
+    return len(latencies) / (time.perf_counter() - start), np.array(latencies), len(errors)
+
+
+def report(name, throughput, latencies, errors):
+    latencies = latencies * 1000 if latencies.size else np.array([float('nan')])
+    print('{:<24} | {:8.2f} | {:8.2f} | {:8.2f} | {:8.2f} | {:6d}'.format(
+        name, throughput, *np.percentile(latencies, [50, 95, 99]), errors))
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description='Load test the local inference server.')
+    parser.add_argument('--model_path', help='Path to a model saved by train.py')
+    parser.add_argument('--image', help='Image sent by every request, random noise by default')
+    parser.add_argument('--size', help='rows,cols of the random image', type=str, default='480,640')
+    parser.add_argument('--url', help='URL of a running server, e.g. http://127.0.0.1:8080/detect')
+    parser.add_argument('--requests', help='Number of requests per run', type=int, default=200)
+    parser.add_argument('--concurrency', help='Number of client threads', type=int, default=16)
+    parser.add_argument('--max_batch_size', help='Batch sizes to compare', type=int, nargs='+', default=[1, 8])
+    parser.add_argument('--max_wait_ms', help='Batching deadline', type=float, default=10.0)
+    parser = parser.parse_args(args)
+
+    if parser.image:
+        body = open(parser.image, 'rb').read()
+    else:
+        rows, cols = map(int, parser.size.split(','))
+        image = np.random.RandomState(0).randint(0, 256, (rows, cols, 3), dtype=np.uint8)
+        body = cv2.imencode('.jpg', image)[1].tobytes()
+
+    print('{:<24} | {:>8} | {:>8} | {:>8} | {:>8} | {:>6}'.format(
+        'server', 'req/s', 'p50 ms', 'p95 ms', 'p99 ms', 'errors'))
+
+    if parser.url:
+        report(parser.url, *load(parser.url, body, parser.requests, parser.concurrency))
+        return
+
+    model = load_model(parser.model_path) if parser.model_path else _NullModel()
+    for max_batch_size in parser.max_batch_size:
+        batcher = MicroBatcher(model, max_batch_size=max_batch_size, max_wait=parser.max_wait_ms / 1000)
+        server = InferenceServer(batcher, port=0)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        try:
+            url = 'http://{}:{}/detect'.format(*server.server_address)
+            # warm up
+            load(url, body, parser.concurrency, parser.concurrency)
+            report('max_batch_size={}'.format(max_batch_size),
+                   *load(url, body, parser.requests, parser.concurrency))
+        finally:
+            server.shutdown()
+            server.server_close()
+            batcher.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,47 @@
+""" mAP and latency of an int8 model made by quantize.py against the float32
+model it was made from, on the CSV validation split:
+
+    python -m benchmarks.bench_quantization --model_path csv_retinanet_99.pt \
+        --quantized_path model_int8.pt --csv_val annotations/validation.csv \
+        --csv_classes annotations/labels.csv --images_dir images
+"""
+import argparse
+
+import torch
+
+from benchmarks.common import add_csv_arguments, load_csv_dataset, load_model, mean_average_precision, \
+    throughput
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(
+        description='Compare an int8 model against its float32 model.')
+    add_csv_arguments(parser)
+    parser.add_argument('--quantized_path', help='Path to a model saved by quantize.py')
+    parser.add_argument('--num_images', help='Images used for the latency measure',
+                        type=int, default=20)
+    parser.add_argument('--threads', help='CPU threads, 0 for the torch default',
+                        type=int, default=0)
+    parser = parser.parse_args(args)
+
+    if parser.threads:
+        torch.set_num_threads(parser.threads)
+
+    dataset = load_csv_dataset(parser)
+
+    results = []
+    for name, path in (('float32', parser.model_path), ('int8', parser.quantized_path)):
+        model = load_model(path)
+        results.append((name,
+                        mean_average_precision(dataset, model, parser.batch_size),
+                        throughput(dataset, model, parser.batch_size, parser.num_images)))
+
+    reference_map = results[0][1]
+    print('\n{:<8} | {:>8} | {:>10} | {:>12}'.format('model', 'mAP', 'mAP delta', 'ms / image'))
+    for name, mean_ap, images_per_second in results:
+        print('{:<8} | {:8.4f} | {:+10.4f} | {:12.2f}'.format(
+            name, mean_ap, mean_ap - reference_map, 1000 / images_per_second))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+""" Time per training step of the former loop, which reads the losses back on
+every iteration (`bool(loss == 0)`, `float(loss)`), against the sync-free
+`training.train_step` with `training.LossLog` readbacks every --log_interval
+steps. The gap is largest on GPUs, where every readback drains the queue:
+
+    python -m benchmarks.bench_train_step --steps 50 --batch_size 2
+"""
+import argparse
+import contextlib
+import io
+import time
+
+import torch
+import torch.optim as optim
+
+from retinanet import model
+from retinanet.device import DeviceContext
+from retinanet.training import LossLog, train_step
+from benchmarks.common import report
+
+
+def _batch(context, batch_size, height, width, num_annotations, num_classes):
+    generator = torch.Generator().manual_seed(0)
+    img = torch.randn((batch_size, 3, height, width), generator=generator)
+    annot = torch.rand((batch_size, num_annotations, 4), generator=generator)
+    annot[..., 0] *= width
+    annot[..., 1] *= height
+    annot[..., 2] *= 360
+    annot[..., 3] = torch.randint(num_classes, (batch_size, num_annotations), generator=generator).float()
+    return context.training_inputs({'img': img, 'annot': annot})
+
+
+def legacy_step(retinanet, optimizer, inputs, loss_hist):
+    # the former loop body of train.py
+    optimizer.zero_grad()
+    classification_loss, regression_loss = retinanet(inputs)
+    classification_loss = classification_loss.mean()
+    regression_loss = regression_loss.mean()
+    loss = classification_loss + regression_loss
+    if bool(loss == 0):
+        return
+    loss.backward()
+    torch.nn.utils.clip_grad_norm_(retinanet.parameters(), 0.1)
+    optimizer.step()
+    loss_hist.append(float(loss))
+    print(float(classification_loss), float(regression_loss))
+
+
+def run(context, steps, inputs, sync_free, log_interval):
+    retinanet = context.place(model.resnet50(num_classes=2))
+    retinanet.train()
+    retinanet.freeze_bn()
+    optimizer = optim.Adam(retinanet.parameters(), lr=1e-5)
+    loss_log, loss_hist = LossLog(interval=log_interval), []
+
+    def step():
+        if sync_free:
+            loss_log.append(0, 0, *train_step(retinanet, optimizer, inputs))
+        else:
+            legacy_step(retinanet, optimizer, inputs, loss_hist)
+
+    # the logs are not part of the measure
+    with contextlib.redirect_stdout(io.StringIO()):
+        step()
+        context.synchronize()
+        start = time.perf_counter()
+        for _ in range(steps):
+            step()
+        loss_log.flush()
+        context.synchronize()
+    return (time.perf_counter() - start) / steps
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description='Time the training step.')
+    parser.add_argument('--device', help='Device, cuda when available by default')
+    parser.add_argument('--steps', type=int, default=20)
+    parser.add_argument('--batch_size', type=int, default=2)
+    parser.add_argument('--height', type=int, default=512)
+    parser.add_argument('--width', type=int, default=512)
+    parser.add_argument('--num_annotations', type=int, default=20)
+    parser.add_argument('--log_interval', type=int, default=20)
+    parser = parser.parse_args(args)
+
+    context = DeviceContext(parser.device)
+    inputs = _batch(context, parser.batch_size, parser.height, parser.width, parser.num_annotations, 2)
+    print('{} steps on {}'.format(parser.steps, context.device))
+    report('legacy step (readback every step)',
+           run(context, parser.steps, inputs, False, parser.log_interval))
+    report('sync-free step (readback every {})'.format(parser.log_interval),
+           run(context, parser.steps, inputs, True, parser.log_interval))
+
+
+if __name__ == '__main__':
+    main()
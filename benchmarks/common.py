@@ -0,0 +1,102 @@
+import multiprocessing
+import resource
+import time
+
+import torch
+
+
+def timeit(fn, *args, repeat=5, **kwargs):
+    """ Best wall time of `repeat` calls of fn(*args, **kwargs), in seconds.
+    """
+    best = float('inf')
+    for _ in range(repeat):
+        st = time.perf_counter()
+        fn(*args, **kwargs)
+        best = min(best, time.perf_counter() - st)
+    return best
+
+
+def _peak_memory_worker(queue, fn, args, kwargs):
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    fn(*args, **kwargs)
+    after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on linux
+    queue.put((after - before) * 1024)
+
+
+def peak_memory(fn, *args, **kwargs):
+    """ Peak resident memory growth, in bytes, of fn(*args, **kwargs).
+
+    The call runs in a fresh process so that earlier allocations of this
+    process do not hide it. `fn` must be a module level function.
+    """
+    ctx = multiprocessing.get_context('spawn')
+    queue = ctx.Queue()
+    process = ctx.Process(target=_peak_memory_worker,
+                          args=(queue, fn, args, kwargs))
+    process.start()
+    result = queue.get()
+    process.join()
+    return result
+
+
+def report(name, seconds=None, memory=None):
+    line = '{:<40}'.format(name)
+    if seconds is not None:
+        line += ' | {:9.2f} ms'.format(seconds * 1000)
+    if memory is not None:
+        line += ' | {:9.1f} MB'.format(memory / 2 ** 20)
+    print(line)
+
+
+def add_csv_arguments(parser):
+    parser.add_argument('--model_path', help='Path to a model saved by train.py')
+    parser.add_argument('--csv_val', help='Path to file containing validation annotations')
+    parser.add_argument('--csv_classes', help='Path to file containing class list')
+    parser.add_argument('--images_dir', help='image files direction', type=str)
+    parser.add_argument('--ext', help='image file extention', type=str, default='.jpg')
+    parser.add_argument('--batch_size', help='Number of images per forward pass', type=int, default=1)
+
+
+def load_csv_dataset(parser):
+    from torchvision import transforms
+    from retinanet.dataloader import CSVDataset, Normalizer, Resizer
+
+    return CSVDataset(train_file=parser.csv_val, class_list=parser.csv_classes,
+                      transform=transforms.Compose([Normalizer(), Resizer()]),
+                      images_dir=parser.images_dir, image_extension=parser.ext)
+
+
+def load_model(path):
+    """ A model saved by train.py, unwrapped from DataParallel, on the CPU. """
+    model = torch.load(path, map_location='cpu')
+    model = getattr(model, 'module', model)
+    model.training = False
+    model.eval()
+    return model
+
+
+def mean_average_precision(dataset, model, batch_size=1):
+    from retinanet import csv_eval
+
+    average_precisions = csv_eval.evaluate(dataset, model, batch_size=batch_size)
+    return sum(ap for ap, _ in average_precisions.values()) / max(len(average_precisions), 1)
+
+
+def throughput(dataset, model, batch_size=1, num_images=20, repeat=3):
+    """ Images per second of the forward pass, decode included, over the
+    first num_images images of the dataset (loaded beforehand).
+    """
+    from retinanet.dataloader import collater
+
+    num_images = min(num_images, len(dataset))
+    batches = [collater([dataset[i] for i in range(start, min(start + batch_size, num_images))])
+               for start in range(0, num_images, batch_size)]
+
+    def run():
+        with torch.no_grad():
+            for batch in batches:
+                model((batch['img'].float(), batch['sizes']))
+
+    run()
+    return num_images / timeit(run, repeat=repeat)
@@ -5,6 +5,7 @@ from torchvision import transforms
 from retinanet import model
 from retinanet.dataloader import CocoDataset, Resizer, Normalizer
 from retinanet import coco_eval
+from retinanet.device import DeviceContext
 
 assert torch.__version__.split('.')[0] == '1'
 
@@ -25,18 +26,9 @@ def main(args=None):
     # Create the model
     retinanet = model.resnet50(num_classes=dataset_val.num_classes(), pretrained=True)
 
-    use_gpu = True
-
-    if use_gpu:
-        if torch.cuda.is_available():
-            retinanet = retinanet.cuda()
-
-    if torch.cuda.is_available():
-        retinanet.load_state_dict(torch.load(parser.model_path))
-        retinanet = torch.nn.DataParallel(retinanet).cuda()
-    else:
-        retinanet.load_state_dict(torch.load(parser.model_path))
-        retinanet = torch.nn.DataParallel(retinanet)
+    context = DeviceContext()
+    retinanet.load_state_dict(torch.load(parser.model_path, map_location=context.device))
+    retinanet = torch.nn.DataParallel(context.place(retinanet))
 
     retinanet.training = False
     retinanet.eval()
@@ -5,6 +5,7 @@ from torchvision import transforms
 from retinanet import model
 from retinanet.dataloader import CSVDataset, Resizer, Normalizer
 from retinanet import csv_eval
+from retinanet.device import DeviceContext
 
 assert torch.__version__.split('.')[0] == '1'
 
@@ -27,18 +28,8 @@ def main(args=None):
     #retinanet = model.resnet50(num_classes=dataset_val.num_classes(), pretrained=True)
     retinanet=torch.load(parser.model_path)
 
-    use_gpu = True
-
-    if use_gpu:
-        if torch.cuda.is_available():
-            retinanet = retinanet.cuda()
-
-    if torch.cuda.is_available():
-        #retinanet.load_state_dict(torch.load(parser.model_path))
-        retinanet = torch.nn.DataParallel(retinanet).cuda()
-    else:
-        retinanet.load_state_dict(torch.load(parser.model_path))
-        retinanet = torch.nn.DataParallel(retinanet)
+    # quantized models run on the CPU only
+    retinanet = torch.nn.DataParallel(DeviceContext.for_model(retinanet).place(retinanet))
 
     retinanet.training = False
     retinanet.eval()
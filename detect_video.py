@@ -0,0 +1,51 @@
+import argparse
+
+import torch
+
+from retinanet.device import DeviceContext
+from retinanet.streaming import VideoPipeline, VideoWriterSink, format_report
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description='Run a trained RetinaNet network over a video file or camera.')
+
+    parser.add_argument('--source', help='Video file path or camera index', type=str)
+    parser.add_argument('--model_path', help='Path to model', type=str)
+    parser.add_argument('--output', help='Optional path of a video with the detections drawn on it', type=str)
+    parser.add_argument('--batch_size', help='Maximum frames per forward pass', type=int, default=4)
+    parser.add_argument('--queue_size', help='Capacity of the frame and result queues', type=int, default=8)
+    parser.add_argument('--no_drop', help='Wait for inference instead of dropping frames (video files)',
+                        action='store_true')
+    parser.add_argument('--score_threshold', help='Minimum score of the written detections',
+                        type=float, default=0.5)
+    parser.add_argument('--max_frames', help='Number of frames to process', type=int, default=None)
+    parser.add_argument('--fps', help='Frame rate of the output video', type=float, default=25.0)
+    parser = parser.parse_args(args)
+
+    source = int(parser.source) if parser.source.isdigit() else parser.source
+
+    model = torch.load(parser.model_path, map_location='cpu')
+    model = getattr(model, 'module', model)
+    # quantized models run on the CPU only
+    model = DeviceContext.for_model(model).place(model)
+    model.training = False
+    model.eval()
+
+    sink = VideoWriterSink(parser.output, fps=parser.fps) if parser.output else None
+    pipeline = VideoPipeline(model, source, batch_size=parser.batch_size, queue_size=parser.queue_size,
+                             drop_frames=not parser.no_drop, sink=sink,
+                             score_threshold=parser.score_threshold, max_frames=parser.max_frames)
+    try:
+        report = pipeline.run()
+    except KeyboardInterrupt:
+        report = pipeline.report()
+    finally:
+        if sink is not None:
+            sink.close()
+
+    print(format_report(report))
+    return report
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,38 @@
+import argparse
+import torch
+from torchvision import transforms
+
+from retinanet.dataloader import CSVDataset, Resizer, Normalizer
+from retinanet.quantization import calibration_batches, quantize
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description='Post-training int8 quantization of a trained RetinaNet network.')
+
+    parser.add_argument('--model_path', help='Path to a model saved by train.py', type=str)
+    parser.add_argument('--csv_calibration', help='Path to CSV annotations of the calibration images')
+    parser.add_argument('--csv_classes', help='Path to file containing class list')
+    parser.add_argument('--images_dir', help='image files direction', type=str)
+    parser.add_argument('--ext', help='image file extention', type=str, default='.jpg')
+    parser.add_argument('--num_images', help='Number of calibration images', type=int, default=100)
+    parser.add_argument('--batch_size', help='Number of images per calibration batch', type=int, default=1)
+    parser.add_argument('--backend', help='Quantized engine, fbgemm (x86) or qnnpack (ARM)',
+                        type=str, default='fbgemm')
+    parser.add_argument('--output', help='Path of the quantized model', type=str, default='model_int8.pt')
+    parser = parser.parse_args(args)
+
+    dataset = CSVDataset(train_file=parser.csv_calibration, class_list=parser.csv_classes,
+                         transform=transforms.Compose([Normalizer(), Resizer()]),
+                         images_dir=parser.images_dir, image_extension=parser.ext)
+
+    retinanet = torch.load(parser.model_path, map_location='cpu')
+
+    quantized = quantize(retinanet,
+                         calibration_batches(dataset, parser.num_images, parser.batch_size),
+                         backend=parser.backend)
+    torch.save(quantized, parser.output)
+    print('Saved the quantized model to {}'.format(parser.output))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,4 +1,5 @@
 import numpy as np
+import torch
 
 
 def generate_anchors(angle_split, num_variables):
@@ -60,3 +61,32 @@ def shift(shape, stride, anchors):
                    shifts.reshape((1, K, 3)).transpose((1, 0, 2)))
     all_anchors = all_anchors.reshape((K * A, 3))
     return all_anchors
+
+
+def shift_torch(shape, stride, angle_split, device=None, dtype=torch.float32):
+    """ Torch equivalent of `shift(shape, stride, generate_anchors(...))`.
+
+    Builds the grid directly on `device`, in the same (row, col, angle) order
+    as the NumPy version.
+
+    Args
+        shape      : Shape to shift the anchors over.
+        stride     : Stride to shift the anchors with over the shape.
+        angle_split: Number of angle anchors at each location.
+    """
+    shift_x = (torch.arange(0, shape[1] // stride, device=device,
+                            dtype=dtype) + 0.5) * stride
+    shift_y = (torch.arange(0, shape[0] // stride, device=device,
+                            dtype=dtype) + 0.5) * stride
+    # angles are computed in float64 like `generate_anchors`, then cast
+    angles = (torch.arange(0, angle_split, device=device,
+                           dtype=torch.float64) * (360 / angle_split)).to(dtype)
+
+    K = shift_x.shape[0] * shift_y.shape[0]
+    A = angles.shape[0]
+    all_anchors = torch.empty((shift_y.shape[0], shift_x.shape[0], A, 3),
+                              device=device, dtype=dtype)
+    all_anchors[..., 0] = shift_x.view(1, -1, 1)
+    all_anchors[..., 1] = shift_y.view(-1, 1, 1)
+    all_anchors[..., 2] = angles.view(1, 1, -1)
+    return all_anchors.view(K * A, 3)
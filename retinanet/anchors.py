@@ -1,28 +1,76 @@
+import collections
+
 import torch
-import numpy as np
 import torch.nn as nn
-from .settings import ANGLE_SPLIT, NUM_VARIABLES, STRIDE
+from .settings import ANGLE_SPLIT, STRIDE
 from .anchor_utils import *
+from .device import DeviceContext
+
+
+class AnchorCache(object):
+    """ Bounded LRU cache of anchor grids.
+
+    Grids only depend on the padded image shape, so they are built once per
+    (rows, cols, stride, angle_split, device, dtype) key with torch ops on the
+    target device and reused afterwards. Cached tensors are shared between
+    callers and must be treated as read-only.
+    """
+
+    def __init__(self, maxsize=16):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._grids = collections.OrderedDict()
+
+    def __len__(self):
+        return len(self._grids)
+
+    def get(self, image_shape, stride, angle_split, device, dtype):
+        key = (int(image_shape[0]), int(image_shape[1]),
+               stride, angle_split, torch.device(device), dtype)
+
+        grid = self._grids.get(key)
+        if grid is not None:
+            self.hits += 1
+            self._grids.move_to_end(key)
+            return grid
+
+        self.misses += 1
+        grid = shift_torch(key[:2], stride, angle_split,
+                           device=key[4], dtype=dtype).unsqueeze(0)
+        self._grids[key] = grid
+        if len(self._grids) > self.maxsize:
+            self._grids.popitem(last=False)
+        return grid
+
+    def __getstate__(self):
+        # grids are rebuilt on demand, keep them out of pickled checkpoints
+        state = self.__dict__.copy()
+        state['_grids'] = collections.OrderedDict()
+        return state
+
+    def clear(self):
+        self._grids.clear()
+        self.hits = 0
+        self.misses = 0
 
 
 class Anchors(nn.Module):
-    def __init__(self):
+    def __init__(self, cache_size=16):
         super(Anchors, self).__init__()
+        self.cache = AnchorCache(maxsize=cache_size)
 
-    def forward(self, image):
+    def __setstate__(self, state):
+        super(Anchors, self).__setstate__(state)
+        # models pickled before the cache existed
+        if 'cache' not in self.__dict__:
+            self.cache = AnchorCache()
 
-        image_shape = image.shape[2:]
-        # compute anchors over all pyramid levels
-        all_anchors = np.zeros((0, NUM_VARIABLES)).astype(np.float32)
+    def forward(self, image, dtype=torch.float32):
 
-        anchors = generate_anchors(
-            angle_split=ANGLE_SPLIT, num_variables=NUM_VARIABLES)
-        shifted_anchors = shift(image_shape, STRIDE, anchors)
-        all_anchors = np.append(all_anchors, shifted_anchors, axis=0)
+        image_shape = image.shape[2:]
 
-        all_anchors = np.expand_dims(all_anchors, axis=0)
+        device = image.device if torch.is_tensor(image) else DeviceContext().device
 
-        if torch.cuda.is_available():
-            return torch.from_numpy(all_anchors.astype(np.float32)).cuda()
-        else:
-            return torch.from_numpy(all_anchors.astype(np.float32))
+        # (1, rows/stride * cols/stride * ANGLE_SPLIT, NUM_VARIABLES)
+        return self.cache.get(image_shape, STRIDE, ANGLE_SPLIT, device, dtype)
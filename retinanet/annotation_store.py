@@ -0,0 +1,89 @@
+""" Columnar storage of the point annotations of a dataset.
+
+All annotations live in one float32 (N, NUM_VARIABLES + 1) array of
+(x, y, alpha, label) rows, grouped by image; `offsets[i]:offsets[i + 1]`
+are the rows of image i. Reading the annotations of an image is a slice of
+that array, and a few arrays instead of one object per point keep the
+memory of DataLoader workers shared with the main process.
+"""
+import numpy as np
+
+from .settings import NUM_VARIABLES
+
+
+class AnnotationStore(object):
+    """ Annotations of a list of images, appended to in batches of rows. """
+
+    def __init__(self, num_columns=NUM_VARIABLES + 1):
+        self.names = []
+        self.offsets = np.zeros(1, dtype=np.int64)
+        self._index = {}
+        self._values = np.zeros((0, num_columns), dtype=np.float32)
+        self._size = 0
+
+    def __len__(self):
+        return len(self.names)
+
+    def __getitem__(self, image_index):
+        """ Read-only (K, NUM_VARIABLES + 1) view of the rows of an image. """
+        rows = self.values[self.offsets[image_index]:self.offsets[image_index + 1]]
+        rows.flags.writeable = False
+        return rows
+
+    @property
+    def values(self):
+        """ All rows, grouped by image. """
+        return self._values[:self._size]
+
+    def index(self, name):
+        return self._index[name]
+
+    def num_annotations(self, image_index=None):
+        """ Number of rows of an image, or of every image as an array. """
+        counts = np.diff(self.offsets)
+        return counts if image_index is None else int(counts[image_index])
+
+    def append(self, names, row_names, rows):
+        """ Add images and rows.
+
+        Args
+            names    : Names of the images, in order; names already stored are
+                       skipped. Images without rows only need to be here.
+            row_names: Image name of each row.
+            rows     : (M, NUM_VARIABLES + 1) annotations.
+        """
+        for name in names:
+            if name not in self._index:
+                self._index[name] = len(self.names)
+                self.names.append(name)
+
+        rows = np.asarray(rows, dtype=np.float32).reshape(-1, self._values.shape[1])
+        row_images = np.fromiter((self._index[name] for name in row_names), dtype=np.int64,
+                                 count=len(row_names))
+        order = np.argsort(row_images, kind='stable')
+        row_images, rows = row_images[order], rows[order]
+
+        counts = np.diff(self.offsets)
+        last = np.flatnonzero(counts)[-1] if self._size else -1
+        if not row_images.size or row_images[0] >= last:
+            # the common case, rows of the last or of new images: append
+            self._reserve(self._size + rows.shape[0])
+            self._values[self._size:self._size + rows.shape[0]] = rows
+            self._size += rows.shape[0]
+        else:
+            # rows of earlier images: merge, keeping the order within images
+            old_images = np.repeat(np.arange(counts.size), counts)
+            merged = np.argsort(np.concatenate([old_images, row_images]), kind='stable')
+            self._values = np.concatenate([self.values, rows])[merged]
+            self._size = self._values.shape[0]
+
+        counts = np.concatenate([counts, np.zeros(len(self.names) - counts.size, dtype=np.int64)])
+        counts += np.bincount(row_images, minlength=len(self.names))
+        self.offsets = np.concatenate([[0], np.cumsum(counts)])
+
+    def _reserve(self, size):
+        if size <= self._values.shape[0]:
+            return
+        values = np.zeros((max(size, 2 * self._values.shape[0]), self._values.shape[1]), dtype=np.float32)
+        values[:self._size] = self.values
+        self._values = values
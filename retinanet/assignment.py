@@ -0,0 +1,136 @@
+""" Spatial-hash anchor to annotation assignment.
+
+Anchors only become positive or ignored when they are closer than
+`max_distance` to an annotation. Under `position_weight * dxy + dalpha`
+this means the annotation lies within `max_distance / position_weight`
+pixels, so annotations are bucketed into square cells of that size and each
+anchor is only compared with the annotations in its 3 x 3 neighbouring
+cells. The cost is O(anchors + annotations) instead of
+O(anchors x annotations).
+"""
+import torch
+
+from .geometry import MEMORY_BUDGET, _chunk_rows, weighted_distance
+from .settings import MAX_ANOT_ANCHOR_POSITION_DISTANCE, POSITION_WEIGHT
+
+# anchors farther than this from every annotation are negatives
+MAX_ASSIGN_DISTANCE = 13 * MAX_ANOT_ANCHOR_POSITION_DISTANCE
+
+# widen the cells slightly so that float rounding of the distance can never
+# push a pair below `max_distance` while the cells are not neighbours
+_CELL_MARGIN = 1.001
+
+_NEIGHBOURS = [(dy, dx) for dy in (-1, 0, 1) for dx in (-1, 0, 1)]
+
+
+def _cell(coordinates, origin, cell_size):
+    # one empty cell of margin on every side keeps neighbour keys in range
+    return torch.floor((coordinates - origin) / cell_size).long() + 1
+
+
+def assign(
+    anchors,
+    annotations,
+    valid=None,
+    max_distance=MAX_ASSIGN_DISTANCE,
+    position_weight=POSITION_WEIGHT,
+    angle_weight=1.0,
+    memory_budget=MEMORY_BUDGET
+):
+    """ Nearest annotation for every anchor, looked up through a spatial hash.
+
+    For every anchor whose nearest annotation is closer than `max_distance`,
+    distance_min and distance_argmin are bit-identical to
+    `geometry.nearest` (ties resolve to the lowest annotation index). For
+    the remaining anchors distance_min is only guaranteed to be
+    >= max_distance (inf when no annotation is in a neighbouring cell).
+
+    Parameters
+    ----------
+    anchors: (N, 3) tensor of (x, y, alpha)
+    annotations: (K, 3) or (B, K, 3) tensor of (x, y, alpha)
+    valid: optional bool mask of shape annotations.shape[:-1]
+    Returns
+    -------
+    distance_min, distance_argmin: (N) or (B, N)
+    """
+    batched = annotations.dim() == 3
+    if not batched:
+        annotations = annotations.unsqueeze(0)
+        valid = None if valid is None else valid.unsqueeze(0)
+    batch_size, num_annotations = annotations.shape[:2]
+    num_anchors = anchors.shape[0]
+    device = anchors.device
+
+    distance_min = torch.full((batch_size, num_anchors), float('inf'),
+                              dtype=anchors.dtype, device=device)
+    distance_argmin = torch.zeros((batch_size, num_anchors),
+                                  dtype=torch.long, device=device)
+
+    if valid is None:
+        valid = torch.ones((batch_size, num_annotations),
+                           dtype=torch.bool, device=device)
+    point_batch, point_index = valid.nonzero(as_tuple=True)
+    if point_batch.shape[0] == 0 or num_anchors == 0:
+        return (distance_min, distance_argmin) if batched else (distance_min[0], distance_argmin[0])
+    points = annotations[point_batch, point_index, :3].to(anchors.dtype)
+
+    # bucket the annotations
+    cell_size = max_distance / position_weight * _CELL_MARGIN
+    origin_x = torch.min(anchors[:, 0].min(), points[:, 0].min())
+    origin_y = torch.min(anchors[:, 1].min(), points[:, 1].min())
+
+    anchor_col = _cell(anchors[:, 0], origin_x, cell_size)
+    anchor_row = _cell(anchors[:, 1], origin_y, cell_size)
+    point_col = _cell(points[:, 0], origin_x, cell_size)
+    point_row = _cell(points[:, 1], origin_y, cell_size)
+
+    num_cols = int(torch.max(anchor_col.max(), point_col.max())) + 2
+    num_rows = int(torch.max(anchor_row.max(), point_row.max())) + 2
+    num_cells = num_cols * num_rows
+
+    point_keys = point_batch * num_cells + point_row * num_cols + point_col
+    sorted_keys, order = torch.sort(point_keys)
+    max_per_cell = int(torch.unique_consecutive(
+        sorted_keys, return_counts=True)[1].max())
+
+    # (N, 9) keys of the neighbouring cells of every anchor
+    neighbour_keys = torch.stack([
+        (anchor_row + dy) * num_cols + (anchor_col + dx) for dy, dx in _NEIGHBOURS], dim=1)
+    batch_offsets = torch.arange(batch_size, device=device).view(-1, 1, 1) * num_cells
+    slots = torch.arange(max_per_cell, device=device)
+
+    rows = _chunk_rows(batch_size * len(_NEIGHBOURS) * max_per_cell, 8, memory_budget)
+    for start in range(0, num_anchors, rows):
+        stop = start + rows
+        keys = neighbour_keys[start:stop].unsqueeze(0) + batch_offsets  # (B, n, 9)
+        first = torch.searchsorted(sorted_keys, keys)
+        last = torch.searchsorted(sorted_keys, keys, right=True)
+
+        # (B, n, 9 * max_per_cell) candidate annotations of every anchor
+        candidates = first.unsqueeze(-1) + slots
+        in_cell = candidates < last.unsqueeze(-1)
+        candidates = order[candidates.clamp(max=order.shape[0] - 1)]
+        candidates = candidates.flatten(start_dim=2)
+        in_cell = in_cell.flatten(start_dim=2)
+
+        distance = weighted_distance(
+            anchors[start:stop].unsqueeze(0).unsqueeze(2), points[candidates],
+            position_weight, angle_weight)
+        distance.masked_fill_(~in_cell, float('inf'))
+
+        chunk_min = distance.min(dim=2)[0]
+        # lowest annotation index among the minima, like a full argmin
+        candidate_index = torch.where(
+            distance == chunk_min.unsqueeze(-1), point_index[candidates],
+            torch.full_like(candidates, num_annotations))
+        chunk_argmin = candidate_index.min(dim=2)[0]
+
+        found = torch.isfinite(chunk_min)
+        distance_min[:, start:stop] = chunk_min
+        distance_argmin[:, start:stop] = torch.where(
+            found, chunk_argmin, torch.zeros_like(chunk_argmin))
+
+    if not batched:
+        return distance_min[0], distance_argmin[0]
+    return distance_min, distance_argmin
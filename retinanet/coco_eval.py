@@ -2,10 +2,13 @@ from pycocotools.cocoeval import COCOeval
 import json
 import torch
 
+from .device import DeviceContext
+
 
 def evaluate_coco(dataset, model, threshold=0.05):
     
     model.eval()
+    device = DeviceContext.of(model).device
     
     with torch.no_grad():
 
@@ -18,10 +21,7 @@ def evaluate_coco(dataset, model, threshold=0.05):
             scale = data['scale']
 
             # run network
-            if torch.cuda.is_available():
-                scores, labels, boxes = model(data['img'].permute(2, 0, 1).cuda().float().unsqueeze(dim=0))
-            else:
-                scores, labels, boxes = model(data['img'].permute(2, 0, 1).float().unsqueeze(dim=0))
+            scores, labels, boxes = model(data['img'].permute(2, 0, 1).to(device).float().unsqueeze(dim=0))
             scores = scores.cpu()
             labels = labels.cpu()
             boxes  = boxes.cpu()
@@ -5,31 +5,13 @@ import json
 import os
 import matplotlib.pyplot as plt
 import torch
+from .dataloader import collater
+from .geometry import pairwise_distance
+from .device import DeviceContext
+from .tiling import tiled_detect
 from .settings import MAX_ANOT_ANCHOR_ANGLE_DISTANCE, MAX_ANOT_ANCHOR_POSITION_DISTANCE, NUM_VARIABLES
 
 
-def __prepare(a, b):
-    # extend as cols
-    repetitions = b.shape[0]
-    at = np.transpose([a] * repetitions)
-    # extend as rows
-    repetitions = a.shape[0]
-    bt = np.tile(b, (repetitions, 1))
-    return at, bt
-
-
-def __distance(ax, bx):
-    """ 
-    ax: (N) ndarray of float
-    bx: (K) ndarray of float
-    Returns
-    -------
-    (N, K) ndarray of distance between all x in ax, bx
-    """
-    ax, bx = __prepare(ax, bx)
-    return np.abs(ax - bx)
-
-
 def compute_distance(a, b):
     """
     Parameters
@@ -40,21 +22,7 @@ def compute_distance(a, b):
     -------
     distances: (N, K) ndarray of distance between center_alpha and query_center_alpha
     """
-    ax = a[:, 0]
-    bx = b[:, 0]
-
-    ay = a[:, 1]
-    by = b[:, 1]
-
-    aa = a[:, 2]
-    ba = b[:, 2]
-
-    dalpha = __distance(ax=aa, bx=ba)
-    dx = __distance(ax=ax, bx=bx)
-    dy = __distance(ax=ay, bx=by)
-    dxy = np.sqrt(dx*dx + dy*dy)
-
-    return dxy, dalpha
+    return pairwise_distance(a, b)
 
 
 def _compute_ap(recall, precision):
@@ -84,7 +52,8 @@ def _compute_ap(recall, precision):
     return ap
 
 
-def _get_detections(dataset, retinanet, score_threshold=0.05, max_detections=100, save_path=None):
+def _get_detections(dataset, retinanet, score_threshold=0.05, max_detections=100, save_path=None, batch_size=1,
+                    tile_size=None, tile_overlap=64):
     """ Get the detections from the retinanet using the generator.
     The result is a list of lists such that the size is:
         all_detections[num_images][num_classes] = detections[num_detections, 4 + num_classes]
@@ -94,6 +63,9 @@ def _get_detections(dataset, retinanet, score_threshold=0.05, max_detections=100
         score_threshold : The score confidence threshold to use.
         max_detections  : The maximum number of detections to use per image.
         save_path       : The path to save the images with visualized detections to.
+        batch_size      : The number of images per forward pass, or of tiles with tile_size.
+        tile_size       : Run every image tile by tile, see `tiling.tiled_detect`.
+        tile_overlap    : The overlap of neighbouring tiles.
     # Returns
         A list of lists containing the detections for each image in the generator.
     """
@@ -101,53 +73,47 @@ def _get_detections(dataset, retinanet, score_threshold=0.05, max_detections=100
         dataset.num_classes())] for j in range(len(dataset))]
 
     retinanet.eval()
+    # per-image results can not be gathered by DataParallel
+    model = getattr(retinanet, 'module', retinanet)
+    device = DeviceContext.of(model).device
+
+    # the model thresholds, sorts and limits the detections itself
+    options = {'score_threshold': model.score_threshold, 'max_detections': model.max_detections}
+    model.set_inference_options(score_threshold=score_threshold, max_detections=max_detections)
+    try:
+        with torch.no_grad():
+
+            for start in range(0, len(dataset), batch_size):
+                batch_indices = range(start, min(start + batch_size, len(dataset)))
+                data = collater([dataset[index] for index in batch_indices])
+
+                # run network
+                if tile_size:
+                    detections = [tiled_detect(model, img, size, tile_size=tile_size, overlap=tile_overlap,
+                                               batch_size=batch_size, device=device)
+                                  for img, size in zip(data['img'], data['sizes'])]
+                else:
+                    detections = model((data['img'].to(device).float(), data['sizes']))
+
+                for index, scale, (scores, labels, boxes) in zip(batch_indices, data['scale'], detections):
+                    scores = scores.cpu().numpy()
+                    labels = labels.cpu().numpy()
+                    boxes = boxes.cpu().numpy()
+
+                    # correct boxes for image scale
+                    boxes /= scale
+
+                    # detections are sorted by decreasing score
+                    image_detections = np.concatenate([boxes, np.expand_dims(
+                        scores, axis=1), np.expand_dims(labels, axis=1)], axis=1)
+
+                    # copy detections to all_detections
+                    for label in range(dataset.num_classes()):
+                        all_detections[index][label] = image_detections[image_detections[:, -1] == label, :-1]
 
-    with torch.no_grad():
-
-        for index in range(len(dataset)):
-            data = dataset[index]
-            scale = data['scale']
-
-            # run network
-            if torch.cuda.is_available():
-                scores, labels, boxes = retinanet(data['img'].permute(
-                    2, 0, 1).cuda().float().unsqueeze(dim=0))
-            else:
-                scores, labels, boxes = retinanet(
-                    data['img'].permute(2, 0, 1).float().unsqueeze(dim=0))
-            scores = scores.cpu().numpy()
-            labels = labels.cpu().numpy()
-            boxes = boxes.cpu().numpy()
-
-            # correct boxes for image scale
-            boxes /= scale
-
-            # select indices which have a score above the threshold
-            indices = np.where(scores > score_threshold)[0]
-            if indices.shape[0] > 0:
-                # select those scores
-                scores = scores[indices]
-
-                # find the order with which to sort the scores
-                scores_sort = np.argsort(-scores)[:max_detections]
-
-                # select detections
-                image_boxes = boxes[indices[scores_sort], :]
-                image_scores = scores[scores_sort]
-                image_labels = labels[indices[scores_sort]]
-                image_detections = np.concatenate([image_boxes, np.expand_dims(
-                    image_scores, axis=1), np.expand_dims(image_labels, axis=1)], axis=1)
-
-                # copy detections to all_detections
-                for label in range(dataset.num_classes()):
-                    all_detections[index][label] = image_detections[image_detections[:, -1] == label, :-1]
-            else:
-                # copy detections to all_detections
-                for label in range(dataset.num_classes()):
-                    all_detections[index][label] = np.zeros(
-                        (0, NUM_VARIABLES+1))
-
-            print('{}/{}'.format(index + 1, len(dataset)), end='\r')
+                    print('{}/{}'.format(index + 1, len(dataset)), end='\r')
+    finally:
+        model.set_inference_options(**options)
 
     return all_detections
 
@@ -185,7 +151,10 @@ def evaluate(
     Ad_threshold=MAX_ANOT_ANCHOR_ANGLE_DISTANCE,
     score_threshold=0.05,
     max_detections=100,
-    save_path=None
+    save_path=None,
+    batch_size=1,
+    tile_size=None,
+    tile_overlap=64
 ):
     """ Evaluate a given dataset using a given retinanet.
     # Arguments
@@ -195,6 +164,9 @@ def evaluate(
         score_threshold : The score confidence threshold to use for detections.
         max_detections  : The maximum number of detections to use per image.
         save_path       : The path to save precision recall curve of each label.
+        batch_size      : The number of images per forward pass, or of tiles with tile_size.
+        tile_size       : Run every image tile by tile, see `tiling.tiled_detect`.
+        tile_overlap    : The overlap of neighbouring tiles.
     # Returns
         A dict mapping class names to mAP scores.
     """
@@ -202,7 +174,8 @@ def evaluate(
     # gather all detections and annotations
 
     all_detections = _get_detections(
-        generator, retinanet, score_threshold=score_threshold, max_detections=max_detections, save_path=save_path)
+        generator, retinanet, score_threshold=score_threshold, max_detections=max_detections, save_path=save_path,
+        batch_size=batch_size, tile_size=tile_size, tile_overlap=tile_overlap)
     all_annotations = _get_annotations(generator)
 
     average_precisions = {}
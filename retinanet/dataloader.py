@@ -4,7 +4,9 @@ import os
 import torch
 import numpy as np
 import random
+import collections
 import csv
+import io
 
 from torch.utils.data import Dataset, DataLoader
 from torchvision import transforms, utils
@@ -18,13 +20,25 @@ import skimage.color
 import skimage
 import cv2 as cv
 
-from PIL import Image
-from .settings import NUM_VARIABLES
+from .image_cache import cached_image
+from .image_index import ImageIndex
+from .anchors import AnchorCache
+from .annotation_store import AnnotationStore
+from .assignment import assign
+from .geometry import threshold_masks
+from .utils import IMAGE_MEAN, IMAGE_STD
+from .settings import ANGLE_SPLIT, MAX_ANOT_ANCHOR_POSITION_DISTANCE, NUM_VARIABLES, POSITION_WEIGHT, STRIDE
 
 
 class CocoDataset(Dataset):
     """Coco dataset."""
 
+    # optional `image_cache.ImageCache` of the decoded images
+    image_cache = None
+    # load_image returns uint8 images, for transforms without `Normalizer`
+    # and batches normalized by `utils.normalize_batch`
+    uint8_images = False
+
     def __init__(self, root_dir, set_name='train2017', transform=None):
         """
         Args:
@@ -73,15 +87,23 @@ class CocoDataset(Dataset):
 
         return sample
 
-    def load_image(self, image_index):
+    def image_path(self, image_index):
         image_info = self.coco.loadImgs(self.image_ids[image_index])[0]
-        path = os.path.join(self.root_dir, 'images',
+        return os.path.join(self.root_dir, 'images',
                             self.set_name, image_info['file_name'])
-        img = skimage.io.imread(path)
+
+    def decode_image(self, image_index):
+        img = skimage.io.imread(self.image_path(image_index))
 
         if len(img.shape) == 2:
             img = skimage.color.gray2rgb(img)
 
+        return img
+
+    def load_image(self, image_index):
+        img = cached_image(self, image_index)
+        if self.uint8_images:
+            return img
         return img.astype(np.float32)/255.0
 
     def load_annotations(self, image_index):
@@ -119,6 +141,10 @@ class CocoDataset(Dataset):
     def label_to_coco_label(self, label):
         return self.coco_labels[label]
 
+    def image_size(self, image_index):
+        image = self.coco.loadImgs(self.image_ids[image_index])[0]
+        return image['height'], image['width']
+
     def image_aspect_ratio(self, image_index):
         image = self.coco.loadImgs(self.image_ids[image_index])[0]
         return float(image['width']) / float(image['height'])
@@ -127,9 +153,20 @@ class CocoDataset(Dataset):
         return 80
 
 
+def _parse_int(value):
+    # annotations are whole pixels and degrees
+    return int(float(value))
+
+
 class CSVDataset(Dataset):
     """CSV dataset."""
 
+    # optional `image_cache.ImageCache` of the decoded images
+    image_cache = None
+    # load_image returns uint8 images, for transforms without `Normalizer`
+    # and batches normalized by `utils.normalize_batch`
+    uint8_images = False
+
     def __init__(self, train_file, class_list, images_dir, image_extension=".jpg", transform=None):
         """
         Args:
@@ -156,14 +193,44 @@ class CSVDataset(Dataset):
             self.labels[value] = key
 
         # csv with img_path, ctr_x, ctr_y, alpha, class_name
+        self.annotations = AnnotationStore()
+        self._csv_offset = 0
+        self._csv_lines = 0
+        self.update_annotations(complete_lines=False)
+
+        # `image_index.ImageIndex` of the images, built on first use
+        self.image_index = None
+
+    @property
+    def image_names(self):
+        return self.annotations.names
+
+    def update_annotations(self, complete_lines=True):
+        """
+        Parse the rows appended to the annotations file since it was last
+        read, without reading the earlier rows again. By default a last row
+        without a line ending, which may still be being written, is left
+        for the next update.
+        Returns the number of parsed rows.
+        """
+        with open(self.train_file, 'rb') as file:
+            file.seek(self._csv_offset)
+            data = file.read()
+        if complete_lines:
+            data = data[:data.rfind(b'\n') + 1]
+
         try:
-            with self._open_for_csv(self.train_file) as file:
-                self.image_data = self._read_annotations(
-                    csv.reader(file, delimiter=','), self.classes)
+            names, row_names, rows, num_lines = self._read_annotations(
+                csv.reader(io.StringIO(data.decode('utf-8'), newline=''), delimiter=','),
+                self.classes, first_line=self._csv_lines + 1)
         except ValueError as e:
             raise(ValueError(
                 'invalid CSV annotations file: {}: {}'.format(self.train_file, e)))
-        self.image_names = list(self.image_data.keys())
+
+        self.annotations.append(names, row_names, rows)
+        self._csv_offset += len(data)
+        self._csv_lines += num_lines
+        return num_lines
 
     def _parse(self, value, function, fmt):
         """
@@ -221,14 +288,23 @@ class CSVDataset(Dataset):
 
         return sample
 
-    def load_image(self, image_index):
-        img = cv.imread(self.image_names[image_index])
+    def image_path(self, image_index):
+        return self.image_names[image_index]
+
+    def decode_image(self, image_index):
+        img = cv.imread(self.image_path(image_index))
 
         if len(img.shape) == 2:
             img = cv.cvtColor(img, cv.COLOR_GRAY2RGB)
         else:
             img = cv.cvtColor(img, cv.COLOR_BGR2RGB)
 
+        return img
+
+    def load_image(self, image_index):
+        img = cached_image(self, image_index)
+        if self.uint8_images:
+            return img
         return img.astype(np.float32)/255.0
 
 # def load_image(self, image_index):
@@ -240,43 +316,20 @@ class CSVDataset(Dataset):
 #         return img.astype(np.float32)/255.0
 
     def load_annotations(self, image_index):
-        # get ground truth annotations
-        annotation_list = self.image_data[self.image_names[image_index]]
-        annotations = np.zeros((0, NUM_VARIABLES+1))
-
-        # some images appear to miss annotations (like image with id 257034)
-        if len(annotation_list) == 0:
-            return annotations
-
-        # parse annotations
-        for idx, a in enumerate(annotation_list):
-            # some annotations have basically no width / height, skip them
-            ctr_x = a['x']
-            ctr_y = a['y']
-            alpha = a['alpha']
-
-            # if (x2-x1) < 1 or (y2-y1) < 1:
-            #     continue
-
-            annotation = np.zeros((1, NUM_VARIABLES+1))
-
-            annotation[0, 0] = ctr_x
-            annotation[0, 1] = ctr_y
-            annotation[0, 2] = alpha
-
-            annotation[0, 3] = self.name_to_label(a['class'])
-            annotations = np.append(annotations, annotation, axis=0)
-
-        return annotations
-
-    def _read_annotations(self, csv_reader, classes):
-        result = {}
-        for line, row in enumerate(csv_reader):
-            line += 1
+        # read-only (K, NUM_VARIABLES + 1) view of the annotation store
+        return self.annotations[image_index]
 
+    def _read_annotations(self, csv_reader, classes, first_line=1):
+        """
+        Returns the image files in order, the image file and the
+        (ctr_x, ctr_y, alpha, label) values of every annotation, and the
+        number of rows read.
+        """
+        names, row_names, rows = {}, [], []
+        line = first_line - 1
+        for line, row in enumerate(csv_reader, first_line):
             try:
                 img_id, ctr_x, ctr_y, alpha, class_name = row[:5]
-                truth_status = "ground_truth"
             except ValueError:
                 raise ValueError(
                     'line {}: format should be \'img_file,ctr_x,ctr_y,alpha,class_name\' or \'img_file,,,,,\''.format(
@@ -284,41 +337,27 @@ class CSVDataset(Dataset):
                 )
 
             img_file = os.path.join(self.img_dir, img_id + self.ext)
-            if img_file not in result:
-                result[img_file] = []
+            names[img_file] = None
 
             # If a row contains only an image path, it's an image without annotations.
             if (ctr_x, ctr_y, alpha, class_name) == ('', '', '', ''):
                 continue
 
             ctr_x = self._parse(
-                float(ctr_x), int, 'line {}: malformed ctr_x: {{}}'.format(line))
+                ctr_x, _parse_int, 'line {}: malformed ctr_x: {{}}'.format(line))
             ctr_y = self._parse(
-                float(ctr_y), int, 'line {}: malformed ctr_y: {{}}'.format(line))
+                ctr_y, _parse_int, 'line {}: malformed ctr_y: {{}}'.format(line))
             alpha = self._parse(
-                float(alpha), int, 'line {}: malformed alpha: {{}}'.format(line))
-
-            if truth_status == "ground_truth":
-                is_ground_truth = True
-            elif truth_status == "predicted":
-                is_ground_truth = False
-            else:
-                raise AssertionError(
-                    "truth_status field can be 'ground_truth' or 'predicted' ")
-            # # Check that the bounding box is valid.
-            # if x2 <= x1:
-            #     raise ValueError('line {}: x2 ({}) must be higher than x1 ({})'.format(line, x2, x1))
-            # if y2 <= y1:
-            #     raise ValueError('line {}: y2 ({}) must be higher than y1 ({})'.format(line, y2, y1))
+                alpha, _parse_int, 'line {}: malformed alpha: {{}}'.format(line))
 
             # check if the current class name is correctly present
             if class_name not in classes:
                 raise ValueError('line {}: unknown class name: \'{}\' (classes: {})'.format(
                     line, class_name, classes))
 
-            result[img_file].append(
-                {'x': ctr_x, 'y': ctr_y, 'alpha': alpha, 'class': class_name, 'ground_truth': is_ground_truth})
-        return result
+            row_names.append(img_file)
+            rows.append((ctr_x, ctr_y, alpha, classes[class_name]))
+        return list(names), row_names, rows, line - first_line + 1
 
     def name_to_label(self, name):
         return self.classes[name]
@@ -329,14 +368,34 @@ class CSVDataset(Dataset):
     def num_classes(self):
         return max(self.classes.values()) + 1
 
+    def load_image_index(self, workers=16):
+        """
+        Build, or revalidate, the index of the image sizes saved next to
+        the annotations file, as `<train_file>.images.json`.
+        """
+        self.image_index = ImageIndex.build(
+            self.train_file + '.images.json', self.image_names,
+            self.annotations.num_annotations(), workers=workers)
+        return self.image_index
+
+    def image_size(self, image_index):
+        if self.image_index is None:
+            self.load_image_index()
+        return self.image_index.size(self.image_names[image_index])
+
     def image_aspect_ratio(self, image_index):
-        image = Image.open(self.image_names[image_index])
-        return float(image.width) / float(image.height)
+        rows, cols = self.image_size(image_index)
+        return float(cols) / float(rows)
 
 
-def collater(data):
+def collater(data, shapes=None, buffers=None):
+    """ Batch samples, padded to the largest image or, with `shapes`, to the
+    smallest of these (rows, cols) shapes that fits all the images. The
+    images are written channels first into a contiguous (B, 3, H, W) batch,
+    taken from `buffers` (a `BatchBuffers`) when given.
+    """
 
-    imgs = [s['img'] for s in data]
+    imgs = [torch.as_tensor(s['img']) for s in data]
     annots = [s['annot'] for s in data]
     scales = [s['scale'] for s in data]
 
@@ -346,31 +405,147 @@ def collater(data):
 
     max_width = np.array(widths).max()
     max_height = np.array(heights).max()
-
-    padded_imgs = torch.zeros(batch_size, max_width, max_height, 3)
+    if shapes is not None:
+        fitting = [shape for shape in shapes if shape[0] >= max_width and shape[1] >= max_height]
+        if fitting:
+            max_width, max_height = min(fitting, key=lambda shape: shape[0] * shape[1])
+
+    shape = (batch_size, 3, int(max_width), int(max_height))
+    if buffers is None:
+        padded_imgs = torch.zeros(shape, dtype=imgs[0].dtype)
+    else:
+        padded_imgs = buffers.images(shape, imgs[0].dtype)
 
     for i in range(batch_size):
-        img = imgs[i]
-        padded_imgs[i, :int(img.shape[0]), :int(img.shape[1]), :] = img
+        rows, cols = widths[i], heights[i]
+        # HWC -> CHW
+        padded_imgs[i, :, :rows, :cols] = imgs[i].permute(2, 0, 1)
+        if buffers is not None:
+            # reused buffers still hold the previous batch
+            padded_imgs[i, :, rows:, :] = 0
+            padded_imgs[i, :, :rows, cols:] = 0
+
+    max_num_annots = max(max(annot.shape[0] for annot in annots), 1)
+    shape = (batch_size, max_num_annots, NUM_VARIABLES+1)
+    if buffers is None:
+        annot_padded = torch.full(shape, -1, dtype=torch.float32)
+    else:
+        annot_padded = buffers.annotations(shape).fill_(-1)
 
-    max_num_annots = max(annot.shape[0] for annot in annots)
+    for idx, annot in enumerate(annots):
+        if annot.shape[0] > 0:
+            annot_padded[idx, :annot.shape[0], :] = torch.as_tensor(annot)
 
-    if max_num_annots > 0:
+    # (rows, cols) of every image before any padding
+    sizes = torch.tensor([s.get('size', s['img'].shape[:2]) for s in data],
+                         dtype=torch.int64)
 
-        annot_padded = torch.ones(
-            (len(annots), max_num_annots, NUM_VARIABLES+1)) * -1
+    batch = {'img': padded_imgs, 'annot': annot_padded, 'scale': scales, 'sizes': sizes}
 
-        if max_num_annots > 0:
-            for idx, annot in enumerate(annots):
-                # print(annot.shape)
-                if annot.shape[0] > 0:
-                    annot_padded[idx, :annot.shape[0], :] = annot
-    else:
-        annot_padded = torch.ones((len(annots), 1, NUM_VARIABLES+1)) * -1
+    if 'positive' in data[0]:
+        batch['anchor_targets'] = _collate_anchor_targets(data, max_height)
 
-    padded_imgs = padded_imgs.permute(0, 3, 1, 2)
+    return batch
 
-    return {'img': padded_imgs, 'annot': annot_padded, 'scale': scales}
+
+class BatchBuffers(object):
+    """ Rings of reusable shared memory tensors for `collater`.
+
+    Tensors in shared memory reach the main process from DataLoader workers
+    without a copy, and reusing them saves allocating (and mapping) new
+    shared memory for every batch. There is one ring of `ring_size` image
+    batches per batch shape and dtype, for the `max_shapes` most recent
+    shapes, and one ring of annotation buffers that grow as needed.
+
+    A tensor is written again `ring_size` batches of its shape later, so
+    consumers must be done with a batch by then. The DataLoader has at most
+    `prefetch_factor` (2 by default) batches of a worker in flight; the
+    default leaves one more for the batch in use and one for the pin memory
+    thread.
+    """
+
+    def __init__(self, ring_size=4, max_shapes=16):
+        self.ring_size = ring_size
+        self.max_shapes = max_shapes
+        # number of tensors allocated, for benchmarks
+        self.allocations = 0
+        self._images = collections.OrderedDict()
+        self._annotations = [torch.zeros(0)] * ring_size
+        self._batches = 0
+
+    def _allocate(self, shape, dtype):
+        self.allocations += 1
+        return torch.empty(shape, dtype=dtype).share_memory_()
+
+    def images(self, shape, dtype=torch.float32):
+        """ A (B, 3, H, W) tensor of the ring of `shape`. """
+        key = (tuple(shape), dtype)
+        ring = self._images.pop(key, None)
+        if ring is None:
+            ring = [[], 0]
+            if len(self._images) >= self.max_shapes:
+                # the least recently used shape
+                self._images.popitem(last=False)
+        self._images[key] = ring
+
+        tensors, position = ring
+        if position == len(tensors):
+            tensors.append(self._allocate(shape, dtype))
+        ring[1] = (position + 1) % self.ring_size
+        return tensors[position]
+
+    def annotations(self, shape):
+        """ A float32 tensor of `shape`, a view of the next annotation
+        buffer.
+        """
+        slot = self._batches % self.ring_size
+        self._batches += 1
+        size = int(np.prod(shape))
+        if self._annotations[slot].numel() < size:
+            self._annotations[slot] = self._allocate(
+                (max(size, 2 * self._annotations[slot].numel()),), torch.float32)
+        return self._annotations[slot][:size].view(shape)
+
+
+class BatchCollater(object):
+    """ `collater` into the reusable shared memory tensors of a
+    `BatchBuffers`. Every DataLoader worker gets its own copy, with its own
+    buffers.
+    """
+
+    def __init__(self, shapes=None, ring_size=4, max_shapes=16):
+        self.shapes = shapes
+        self.buffers = BatchBuffers(ring_size, max_shapes)
+
+    def __call__(self, data):
+        return collater(data, shapes=self.shapes, buffers=self.buffers)
+
+
+def _pad_indices(indices):
+    max_num = max(max(index.shape[0] for index in indices), 1)
+    padded = torch.full((len(indices), max_num), -1, dtype=torch.int32)
+    for idx, index in enumerate(indices):
+        padded[idx, :index.shape[0]] = index
+    return padded
+
+
+def _collate_anchor_targets(data, batch_cols):
+    """ Batch the sparse targets of `AnchorTargets`, padded with -1.
+
+    Anchor indices are moved from each image's own anchor grid to the grid
+    of the padded batch, which only differs in the number of columns.
+    """
+    batch_row_length = (batch_cols // STRIDE) * ANGLE_SPLIT
+    positive, ignore = [], []
+    for s in data:
+        row_length = (int(s['img'].shape[1]) // STRIDE) * ANGLE_SPLIT
+        for indices, out in ((s['positive'], positive), (s['ignore'], ignore)):
+            indices = indices.long()
+            out.append((indices // row_length) * batch_row_length + indices % row_length)
+
+    return (_pad_indices(positive),
+            _pad_indices([s['assigned'] for s in data]),
+            _pad_indices(ignore))
 
 
 class Resizer(object):
@@ -396,21 +571,72 @@ class Resizer(object):
         #     scale = max_side / largest_side
         scale = 1
 
+        # uint8 images (without `Normalizer`) stay uint8
+        dtype = np.uint8 if image.dtype == np.uint8 else np.float32
+
         # resize the image with the computed scale
-        image = skimage.transform.resize(
-            image, (int(round(rows*scale)), int(round((cols*scale)))))
+        if scale != 1 or dtype != np.uint8:
+            image = skimage.transform.resize(
+                image, (int(round(rows*scale)), int(round((cols*scale)))), preserve_range=True)
+            if dtype == np.uint8:
+                image = np.round(image)
         rows, cols, cns = image.shape
 
-        pad_w = 32 - rows % 32
-        pad_h = 32 - cols % 32
+        # pad to the next multiple of 32, not beyond
+        pad_w = -rows % 32
+        pad_h = -cols % 32
 
         new_image = np.zeros(
-            (rows + pad_w, cols + pad_h, cns)).astype(np.float32)
-        new_image[:rows, :cols, :] = image.astype(np.float32)
+            (rows + pad_w, cols + pad_h, cns), dtype=dtype)
+        new_image[:rows, :cols, :] = image
 
+        # datasets may return read-only views of their annotations
+        annots = annots.copy()
         annots[:, :NUM_VARIABLES] *= scale
 
-        return {'img': torch.from_numpy(new_image), 'annot': torch.from_numpy(annots), 'scale': scale}
+        return {'img': torch.from_numpy(new_image), 'annot': torch.from_numpy(annots), 'scale': scale,
+                'size': (rows, cols)}
+
+
+class AnchorTargets(object):
+    """ Assign anchors to annotations in the DataLoader worker.
+
+    Must follow `Resizer`. Adds the sparse targets that `FocalLoss` would
+    otherwise compute on the training process, on the anchor grid of the
+    padded image:
+        positive: (P) int32 indices of the positive anchors
+        assigned: (P) int32 index of the annotation assigned to each of them
+        ignore  : (I) int32 indices of the ignored anchors
+    All other anchors are negatives. `collater` batches them into
+    `anchor_targets`. In a batch of differently sized images, anchors that
+    only exist in the padding added by `collater` are negatives.
+    """
+
+    def __init__(self):
+        self.anchors = AnchorCache(maxsize=4)
+
+    def __call__(self, sample):
+        image, annots = sample['img'], sample['annot']
+
+        anchors = self.anchors.get(
+            image.shape[:2], STRIDE, ANGLE_SPLIT, 'cpu', torch.float32)[0]
+        distance_min, distance_argmin = assign(
+            anchors, annots[:, :NUM_VARIABLES].float(),
+            max_distance=13 * MAX_ANOT_ANCHOR_POSITION_DISTANCE,
+            position_weight=POSITION_WEIGHT)
+
+        positive_indices, negative_indices = threshold_masks(
+            distance_min,
+            11 * MAX_ANOT_ANCHOR_POSITION_DISTANCE,
+            13 * MAX_ANOT_ANCHOR_POSITION_DISTANCE)
+        positive = positive_indices.nonzero(as_tuple=True)[0]
+
+        sample = dict(sample)
+        sample['positive'] = positive.int()
+        sample['assigned'] = distance_argmin[positive].int()
+        sample['ignore'] = (~(positive_indices | negative_indices)).nonzero(
+            as_tuple=True)[0].int()
+        return sample
 
 
 class Augmenter(object):
@@ -426,8 +652,8 @@ class Augmenter(object):
 
             rows, cols, channels = image.shape
 
-            x = annots[:, 0].copy()
-            annots[:, 0] = cols - x
+            annots = annots.copy()
+            annots[:, 0] = cols - annots[:, 0]
 
             sample = {'img': image, 'annot': annots}
 
@@ -439,8 +665,8 @@ class Normalizer(object):
     """
 
     def __init__(self):
-        self.mean = np.array([[[0.485, 0.456, 0.406]]])
-        self.std = np.array([[[0.229, 0.224, 0.225]]])
+        self.mean = np.array([[IMAGE_MEAN]])
+        self.std = np.array([[IMAGE_STD]])
 
     def __call__(self, sample):
         image, annots = sample['img'], sample['annot']
@@ -450,11 +676,11 @@ class Normalizer(object):
 class UnNormalizer(object):
     def __init__(self, mean=None, std=None):
         if mean == None:
-            self.mean = [0.485, 0.456, 0.406]
+            self.mean = list(IMAGE_MEAN)
         else:
             self.mean = mean
         if std == None:
-            self.std = [0.229, 0.224, 0.225]
+            self.std = list(IMAGE_STD)
         else:
             self.std = std
 
@@ -496,3 +722,86 @@ class AspectRatioBasedSampler(Sampler):
 
         # divide into groups, one group = one batch
         return [[order[x % len(order)] for x in range(i, i + self.batch_size)] for i in range(0, len(order), self.batch_size)]
+
+
+
+def padded_shape(rows, cols):
+    """ (rows, cols) padded to the next multiples of 32, as by `Resizer`. """
+    return -(-rows // 32) * 32, -(-cols // 32) * 32
+
+
+def _bucket_bounds(lengths, max_buckets):
+    """ At most `max_buckets` values such that padding every length to the
+    smallest value not below it adds the fewest pixels.
+    """
+    values, counts = np.unique(lengths, return_counts=True)
+    if len(values) <= max_buckets:
+        return values
+
+    num = np.concatenate([[0], np.cumsum(counts)])
+    total = np.concatenate([[0], np.cumsum(counts * values)])
+
+    def cost(i, j):
+        # padding of values[i..j] to values[j]
+        return values[j] * (num[j + 1] - num[i]) - (total[j + 1] - total[i])
+
+    # best[j]: (padding, bounds) of values[..j] in the buckets so far
+    best = [(cost(0, j), [j]) for j in range(len(values))]
+    for _ in range(max_buckets - 1):
+        best = [min(((best[i - 1][0] + cost(i, j), best[i - 1][1] + [j]) for i in range(1, j + 1)),
+                    key=lambda option: option[0], default=best[j]) for j in range(len(values))]
+    return values[best[-1][1]]
+
+
+class SizeBucketSampler(Sampler):
+    """ Batches of images of one padded shape.
+
+    Every image goes to the smallest of a few padded (rows, cols) shapes
+    that fits it, with at most `max_sizes` different rows and cols.
+    Batches only hold images of one shape; `collater` pads them to it with
+    `shapes=sampler.shapes`. `padding_waste` is the fraction of the pixels
+    of the batches of the last epoch that are padding.
+    """
+
+    def __init__(self, data_source, batch_size, drop_last, max_sizes=4):
+        self.data_source = data_source
+        self.batch_size = batch_size
+        self.drop_last = drop_last
+
+        sizes = np.array([data_source.image_size(i) for i in range(len(data_source))],
+                         dtype=np.int64).reshape(-1, 2)
+        padded = np.array([padded_shape(rows, cols) for rows, cols in sizes], dtype=np.int64).reshape(-1, 2)
+        row_bounds = _bucket_bounds(padded[:, 0], max_sizes)
+        col_bounds = _bucket_bounds(padded[:, 1], max_sizes)
+        shapes = np.stack([row_bounds[np.searchsorted(row_bounds, padded[:, 0])],
+                           col_bounds[np.searchsorted(col_bounds, padded[:, 1])]], axis=1)
+
+        self.image_pixels = sizes.prod(axis=1)
+        self.buckets = collections.OrderedDict()
+        for index, shape in enumerate(map(tuple, shapes.tolist())):
+            self.buckets.setdefault(shape, []).append(index)
+        self.shapes = list(self.buckets)
+        self.padding_waste = float('nan')
+
+    def __iter__(self):
+        batches = []
+        for shape, indices in self.buckets.items():
+            indices = list(indices)
+            random.shuffle(indices)
+            for i in range(0, len(indices), self.batch_size):
+                batch = indices[i:i + self.batch_size]
+                if len(batch) == self.batch_size or not self.drop_last:
+                    batches.append((shape, batch))
+        random.shuffle(batches)
+
+        image_pixels = padded_pixels = 0
+        for shape, batch in batches:
+            image_pixels += int(self.image_pixels[batch].sum())
+            padded_pixels += shape[0] * shape[1] * len(batch)
+            yield batch
+        self.padding_waste = 1 - image_pixels / padded_pixels if padded_pixels else float('nan')
+
+    def __len__(self):
+        if self.drop_last:
+            return sum(len(indices) // self.batch_size for indices in self.buckets.values())
+        return sum((len(indices) + self.batch_size - 1) // self.batch_size for indices in self.buckets.values())
@@ -0,0 +1,90 @@
+""" The device and dtype tensors are allocated with.
+
+Code that creates tensors takes its device from a `DeviceContext`, or from a
+tensor it already has, instead of checking `torch.cuda.is_available()` and
+moving CPU tensors over. The context of a model is the device and dtype of
+its weights; quantized models always run on the CPU.
+"""
+import torch
+import torch.nn as nn
+
+from .utils import normalize_batch
+
+
+class DeviceContext(object):
+    """ Device and floating point dtype of a model and of its inputs.
+
+    device defaults to cuda when it is available and to the CPU otherwise.
+    """
+
+    def __init__(self, device=None, dtype=torch.float32):
+        if device is None:
+            device = 'cuda' if torch.cuda.is_available() else 'cpu'
+        self.device = torch.device(device)
+        self.dtype = dtype
+
+    def __repr__(self):
+        return 'DeviceContext(device={}, dtype={})'.format(self.device, self.dtype)
+
+    @classmethod
+    def of(cls, model):
+        """ The context `model` runs in: the device and dtype of its first
+        floating point weight, the CPU for quantized models and the default
+        device for models without weights.
+        """
+        model = getattr(model, 'module', model)
+        if not isinstance(model, nn.Module):
+            return cls()
+        if getattr(model, 'quantized', False):
+            return cls('cpu')
+        for tensor in list(model.parameters()) + list(model.buffers()):
+            if tensor.is_floating_point():
+                return cls(tensor.device, tensor.dtype)
+        return cls()
+
+    @classmethod
+    def for_model(cls, model):
+        """ The default context, or the CPU for quantized models, which can
+        not run anywhere else.
+        """
+        if getattr(getattr(model, 'module', model), 'quantized', False):
+            return cls('cpu')
+        return cls()
+
+    @property
+    def is_cuda(self):
+        return self.device.type == 'cuda'
+
+    def place(self, model):
+        """ Move `model` to this context, in place, and return it. """
+        return model.to(device=self.device)
+
+    def tensor(self, data, dtype=None):
+        """ `data` as a tensor on this device, of this dtype by default. """
+        return torch.as_tensor(data, dtype=self.dtype if dtype is None else dtype, device=self.device)
+
+    def to(self, tensor, dtype=None):
+        """ `tensor` on this device, without blocking the host when it is
+        pinned; floating point tensors are also cast to `dtype`.
+        """
+        if dtype is None and tensor.is_floating_point():
+            dtype = self.dtype
+        return tensor.to(device=self.device, dtype=dtype, non_blocking=True)
+
+    def training_inputs(self, data):
+        """ The model inputs of a `collater` batch: images as floats and the
+        annotations (and anchor targets, when present) on this device.
+        uint8 images are normalized here, after the copy.
+        """
+        img = self.to(data['img'])
+        if img.dtype == torch.uint8:
+            img = normalize_batch(img, self.to(data['sizes'])).to(self.dtype)
+        inputs = [img, self.to(data['annot'])]
+        if 'anchor_targets' in data:
+            inputs.append([self.to(targets) for targets in data['anchor_targets']])
+        return inputs
+
+    def synchronize(self):
+        """ Wait for the device; only needed to time asynchronous work. """
+        if self.is_cuda:
+            torch.cuda.synchronize(self.device)
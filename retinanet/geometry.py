@@ -0,0 +1,141 @@
+""" Anchor / annotation distance kernels shared by the loss, eval and tools.
+
+Distances between (x, y, alpha) points are computed by broadcasting instead
+of tiling, and anchors are processed in chunks so that the temporaries never
+exceed `memory_budget` bytes. Only the reductions the callers need (min,
+argmin and threshold masks) are returned.
+
+Both NumPy arrays and torch tensors are accepted; the backend is chosen from
+the type of the inputs.
+"""
+import numpy as np
+import torch
+
+# bytes of temporaries allowed per chunk
+MEMORY_BUDGET = 64 * 1024 * 1024
+
+# number of (rows x cols) sized temporaries alive while a chunk is reduced
+_NUM_TEMPORARIES = 3
+
+
+def _chunk_rows(num_cols, itemsize, memory_budget):
+    return max(1, int(memory_budget // (max(num_cols, 1) * itemsize * _NUM_TEMPORARIES)))
+
+
+def pairwise_distance(a, b):
+    """
+    Parameters
+    ----------
+    a: (N, 3) ndarray or tensor of (x, y, alpha)
+    b: (K, 3) ndarray or tensor of (x, y, alpha)
+    Returns
+    -------
+    dxy, dalpha: (N, K) position and angle distances between all a, b
+    """
+    if torch.is_tensor(a):
+        dx = a[:, 0].unsqueeze(1) - b[:, 0].unsqueeze(0)
+        dy = a[:, 1].unsqueeze(1) - b[:, 1].unsqueeze(0)
+        dalpha = torch.abs(a[:, 2].unsqueeze(1) - b[:, 2].unsqueeze(0))
+        return torch.sqrt(dx * dx + dy * dy), dalpha
+
+    dx = a[:, 0, np.newaxis] - b[np.newaxis, :, 0]
+    dy = a[:, 1, np.newaxis] - b[np.newaxis, :, 1]
+    dalpha = np.abs(a[:, 2, np.newaxis] - b[np.newaxis, :, 2])
+    return np.sqrt(dx * dx + dy * dy), dalpha
+
+
+def weighted_distance(a, b, position_weight=1.0, angle_weight=1.0):
+    """ Elementwise `position_weight * dxy + angle_weight * dalpha`.
+
+    a and b are broadcastable (..., 3) ndarrays or tensors of (x, y, alpha).
+    Every caller goes through here so that the same pair always gets the
+    same bits, whichever kernel computed it.
+    """
+    dx = a[..., 0] - b[..., 0]
+    dy = a[..., 1] - b[..., 1]
+    dalpha = a[..., 2] - b[..., 2]
+
+    if torch.is_tensor(dx):
+        distance = dx.mul_(dx)
+        distance.add_(dy.mul_(dy))
+        distance.sqrt_()
+        dalpha.abs_()
+    else:
+        distance = np.multiply(dx, dx, out=dx)
+        distance += np.multiply(dy, dy, out=dy)
+        np.sqrt(distance, out=distance)
+        np.abs(dalpha, out=dalpha)
+
+    distance *= position_weight
+    if angle_weight != 1:
+        dalpha *= angle_weight
+    distance += dalpha
+    return distance
+
+
+def nearest(a, b, valid=None, position_weight=1.0, angle_weight=1.0, memory_budget=MEMORY_BUDGET):
+    """ Nearest b for every a under `position_weight * dxy + angle_weight * dalpha`.
+
+    Parameters
+    ----------
+    a: (N, 3) ndarray or tensor of (x, y, alpha), e.g. anchors
+    b: (K, 3) or (B, K, 3) ndarray or tensor of (x, y, alpha), e.g. annotations
+    valid: optional bool mask of shape b.shape[:-1]; invalid b are never selected
+    memory_budget: bytes of temporaries allowed per chunk of a
+    Returns
+    -------
+    distance_min, distance_argmin: (N) or (B, N); distance_min is inf where
+        there is no valid b
+    """
+    batched = b.ndim == 3
+    if not batched:
+        b = b[None]
+        valid = None if valid is None else valid[None]
+    batch_size, num_b = b.shape[:2]
+    num_a = a.shape[0]
+
+    if torch.is_tensor(a):
+        distance_min = torch.full((batch_size, num_a), float('inf'),
+                                  dtype=a.dtype, device=a.device)
+        distance_argmin = torch.zeros((batch_size, num_a),
+                                      dtype=torch.long, device=a.device)
+        itemsize = a.element_size()
+    else:
+        dtype = np.result_type(a, b, np.float32)
+        distance_min = np.full((batch_size, num_a), np.inf, dtype=dtype)
+        distance_argmin = np.zeros((batch_size, num_a), dtype=np.int64)
+        itemsize = dtype.itemsize
+
+    if num_b > 0 and num_a > 0:
+        rows = _chunk_rows(batch_size * num_b, itemsize, memory_budget)
+        for start in range(0, num_a, rows):
+            chunk = a[start:start + rows]
+            # (B, chunk, K)
+            distance = weighted_distance(
+                chunk[None, :, None, :], b[:, None, :, :], position_weight, angle_weight)
+            if torch.is_tensor(a):
+                if valid is not None:
+                    distance.masked_fill_(~valid.unsqueeze(1), float('inf'))
+                chunk_min, chunk_argmin = torch.min(distance, dim=2)
+                distance_min[:, start:start + rows] = chunk_min
+                distance_argmin[:, start:start + rows] = chunk_argmin
+            else:
+                if valid is not None:
+                    distance[~np.broadcast_to(valid[:, np.newaxis, :], distance.shape)] = np.inf
+                distance_argmin[:, start:start + rows] = np.argmin(distance, axis=2)
+                distance_min[:, start:start + rows] = np.min(distance, axis=2)
+
+    if not batched:
+        return distance_min[0], distance_argmin[0]
+    return distance_min, distance_argmin
+
+
+def threshold_masks(distance_min, positive_threshold, negative_threshold):
+    """
+    Returns
+    -------
+    positive: distance_min <= positive_threshold
+    negative: distance_min >= negative_threshold
+    Anchors in neither mask are ignored.
+    """
+    return distance_min <= positive_threshold, distance_min >= negative_threshold
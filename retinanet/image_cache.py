@@ -0,0 +1,159 @@
+""" Cache of decoded images, memory-mapped by the datasets.
+
+`ImageCache.build` decodes every image of a dataset once into one uint8 file
+(`<path>.bin`), the images one after another in their decoded shape, and
+writes an index (`<path>.json`) of the source path, modification time and
+size, offset and shape of each dataset index. Datasets with an
+`image_cache` read images as views of the memory map, so DataLoader workers
+share the OS page cache instead of decoding the same files every epoch.
+
+An entry is only used while its source file keeps the modification time
+and size it was decoded with; the dataset decodes changed files itself, and
+the next `build` decodes them again, appending them to the data file.
+"""
+import json
+import os
+
+import numpy as np
+
+VERSION = 1
+
+
+def _stat(path):
+    stat = os.stat(path)
+    return stat.st_mtime_ns, stat.st_size
+
+
+class ImageCache(object):
+    """ Memory-mapped decoded images of a dataset, by dataset index.
+
+    Args
+        path: Path of the cache, without the .json and .bin extensions.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path + '.json', 'r') as file:
+            index = json.load(file)
+        if index.get('version') != VERSION:
+            raise ValueError('{}.json is not an image cache of version {}'.format(path, VERSION))
+        self.entries = index['entries']
+        self._data = None
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __getstate__(self):
+        # DataLoader workers map the file again instead of receiving a copy
+        state = dict(self.__dict__)
+        state['_data'] = None
+        return state
+
+    @property
+    def data(self):
+        if self._data is None:
+            if os.path.getsize(self.path + '.bin'):
+                self._data = np.memmap(self.path + '.bin', dtype=np.uint8, mode='r')
+            else:
+                self._data = np.zeros(0, dtype=np.uint8)
+        return self._data
+
+    def _view(self, entry):
+        _, _, _, offset, shape = entry
+        return self.data[offset:offset + int(np.prod(shape))].reshape(shape)
+
+    def get(self, image_index, path):
+        """ Read-only view of the decoded image, or None when the index is not
+        cached or `path` changed since it was decoded.
+        """
+        if image_index >= len(self.entries):
+            return None
+        entry = self.entries[image_index]
+        try:
+            if entry[0] != path or tuple(entry[1:3]) != _stat(path):
+                return None
+        except OSError:
+            return None
+        return self._view(entry)
+
+    @classmethod
+    def build(cls, dataset, path, verbose=True, max_garbage=0.5):
+        """ Decode the images of `dataset` that are not cached at `path` yet
+        and return the cache. The dataset must have `image_path` and
+        `decode_image` methods.
+
+        New and changed images are appended to the data file; the cache is
+        only rewritten from scratch when more than `max_garbage` of it would
+        be images that are not used anymore. Nothing is written when every
+        image is up to date.
+        """
+        old_entries = {}
+        if os.path.exists(path + '.json') and os.path.exists(path + '.bin'):
+            old = cls(path)
+            old_entries = {tuple(entry[:3]): entry for entry in old.entries}
+        else:
+            old = None
+
+        keys = []
+        for image_index in range(len(dataset)):
+            image_path = dataset.image_path(image_index)
+            keys.append((image_path,) + _stat(image_path))
+        if old is not None and [tuple(entry[:3]) for entry in old.entries] == keys:
+            return old
+
+        missing = [image_index for image_index, key in enumerate(keys) if key not in old_entries]
+        used = sum(int(np.prod(old_entries[key][4])) for key in set(keys) if key in old_entries)
+        size = os.path.getsize(path + '.bin') if old is not None else 0
+        if old is not None and size - used > max_garbage * size:
+            # mostly unused images: copy the used ones into a new file
+            entries = cls._write(dataset, path + '.bin.tmp', keys, old, old_entries, range(len(keys)),
+                                 'wb', verbose)
+            # the old index must never describe the new data file: without
+            # an index, an interrupted build is simply built again
+            os.remove(path + '.json')
+            os.replace(path + '.bin.tmp', path + '.bin')
+        else:
+            entries = [old_entries.get(key) for key in keys]
+            for image_index, entry in zip(missing, cls._write(
+                    dataset, path + '.bin', keys, old, {}, missing, 'ab', verbose)):
+                entries[image_index] = entry
+
+        with open(path + '.json.tmp', 'w') as file:
+            json.dump({'version': VERSION, 'entries': entries}, file)
+        os.replace(path + '.json.tmp', path + '.json')
+        if verbose:
+            print('Image cache {}: {} images, {} decoded, {:.1f} MB'.format(
+                path, len(entries), len(missing), os.path.getsize(path + '.bin') / 2 ** 20))
+        return cls(path)
+
+    @staticmethod
+    def _write(dataset, data_path, keys, old, old_entries, indices, mode, verbose):
+        """ Write the images of `indices` at the end of `data_path`, copied
+        from `old_entries` or decoded, and return their entries.
+        """
+        entries = []
+        with open(data_path, mode) as file:
+            offset = file.seek(0, os.SEEK_END)
+            for count, image_index in enumerate(indices):
+                key = keys[image_index]
+                if key in old_entries:
+                    image = old._view(old_entries[key])
+                else:
+                    image = np.ascontiguousarray(dataset.decode_image(image_index), dtype=np.uint8)
+                file.write(image.tobytes())
+                entries.append(list(key) + [offset, list(image.shape)])
+                offset += image.size
+                if verbose:
+                    print('{}/{}'.format(count + 1, len(indices)), end='\r')
+        return entries
+
+
+def cached_image(dataset, image_index):
+    """ The uint8 image of a dataset, from its `image_cache` when it is
+    cached and up to date, decoded otherwise.
+    """
+    if dataset.image_cache is not None:
+        image = dataset.image_cache.get(image_index, dataset.image_path(image_index))
+        if image is not None:
+            return image
+    return dataset.decode_image(image_index)
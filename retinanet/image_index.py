@@ -0,0 +1,118 @@
+""" Persistent index of image metadata, for samplers that need image sizes.
+
+For every image the index keeps its width, height, file size, modification
+time and number of annotations. It is read from the image headers, in a
+thread pool, and saved as JSON (next to the annotations file, for
+`CSVDataset`). Later builds only read the headers of the images that are
+new or whose file size or modification time changed.
+"""
+import json
+import os
+import warnings
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image
+
+VERSION = 1
+FIELDS = ('width', 'height', 'bytes', 'mtime', 'annotations')
+
+
+def _read_header(path):
+    stat = os.stat(path)
+    # only opens the file and parses the header, the pixels are not decoded
+    with Image.open(path) as image:
+        width, height = image.size
+    return [width, height, stat.st_size, stat.st_mtime_ns]
+
+
+class ImageIndex(object):
+    """ Metadata of images, by path, see `FIELDS`. """
+
+    def __init__(self, path=None, images=None):
+        self.path = path
+        self.images = {} if images is None else images
+        # number of headers read by the last build
+        self.read = 0
+        # (width, height) of images read on demand, never saved
+        self._unindexed = {}
+
+    def __len__(self):
+        return len(self.images)
+
+    def __contains__(self, image_path):
+        return image_path in self.images
+
+    def size(self, image_path):
+        """ (rows, cols) of an image, read from its header when it is not
+        indexed. Such images are not added to the index.
+        """
+        if image_path in self.images:
+            width, height = self.images[image_path][:2]
+        else:
+            if image_path not in self._unindexed:
+                self._unindexed[image_path] = _read_header(image_path)[:2]
+            width, height = self._unindexed[image_path]
+        return height, width
+
+    def save(self):
+        with open(self.path + '.tmp', 'w') as file:
+            json.dump({'version': VERSION, 'fields': FIELDS, 'images': self.images}, file)
+        os.replace(self.path + '.tmp', self.path)
+
+    @classmethod
+    def load(cls, path):
+        """ The index saved at `path`, empty when there is none or it is of
+        another version.
+        """
+        try:
+            with open(path, 'r') as file:
+                index = json.load(file)
+        except (OSError, ValueError):
+            return cls(path)
+        if index.get('version') != VERSION:
+            return cls(path)
+        return cls(path, index['images'])
+
+    @classmethod
+    def build(cls, path, image_paths, num_annotations=None, workers=16):
+        """ The index of `image_paths`, revalidated against the one saved at
+        `path`, which is updated when anything changed.
+
+        Args
+            path           : JSON file of the index.
+            image_paths    : Paths of the images.
+            num_annotations: Number of annotations of each image, by default
+                             those of the saved index.
+            workers        : Threads reading the headers.
+        """
+        old = cls.load(path).images
+        if num_annotations is None:
+            # the counts of the saved index, None for new images
+            num_annotations = [old[image_path][4] if image_path in old else None
+                               for image_path in image_paths]
+
+        def revalidate(image_path):
+            entry = old.get(image_path)
+            if entry is not None:
+                try:
+                    stat = os.stat(image_path)
+                except OSError:
+                    stat = None
+                if stat is not None and entry[2:4] == [stat.st_size, stat.st_mtime_ns]:
+                    return entry[:4], False
+            return _read_header(image_path), True
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(revalidate, image_paths))
+
+        index = cls(path)
+        for image_path, (entry, read), count in zip(image_paths, results, num_annotations):
+            index.images[image_path] = entry + [None if count is None else int(count)]
+            index.read += read
+
+        if index.images != old:
+            try:
+                index.save()
+            except OSError as e:
+                warnings.warn('can not save the image index {}: {}'.format(path, e))
+        return index
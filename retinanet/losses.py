@@ -1,212 +1,172 @@
+import math
+
 import numpy as np
 import torch
 import torch.nn as nn
-from .settings import NUM_VARIABLES, MAX_ANOT_ANCHOR_ANGLE_DISTANCE, MAX_ANOT_ANCHOR_POSITION_DISTANCE
-
-
-def __prepare(a, b):
-    # extend as cols
-    repetitions = b.shape[0]
-    at = torch.tile(a, (repetitions, 1))
-    at = at.transpose(-1, 0)
+import torch.nn.functional as F
+from .assignment import assign
+from .geometry import pairwise_distance, threshold_masks
+from .settings import NUM_VARIABLES, MAX_ANOT_ANCHOR_ANGLE_DISTANCE, MAX_ANOT_ANCHOR_POSITION_DISTANCE, POSITION_WEIGHT
 
-    # extend as rows
-    # bt = np.tile(b, (repetitions, 1))
-    repetitions = a.shape[0]
-    bt = torch.tile(b, (repetitions, 1))
-    return at, bt
 
-
-def __distance(ax, bx):
+def calc_distance(a, b):
     """
-    ax: (N) ndarray of float
-    bx: (K) ndarray of float
+    a: (N, 3) tensor of (x, y, alpha)
+    b: (K, 3) tensor of (x, y, alpha)
     Returns
     -------
-    (N, K) ndarray of distance between all x in ax, bx
+    (N, K) tensor of the combined position/angle distance between all a, b
     """
-    ax, bx = __prepare(ax, bx)
-    return torch.abs(ax - bx)
+    dxy, dalpha = pairwise_distance(a, b)
 
+    return POSITION_WEIGHT * dxy + dalpha
 
-def calc_distance(a, b):
-    ax = a[:, 0]
-    bx = b[:, 0]
 
-    ay = a[:, 1]
-    by = b[:, 1]
+# logits are clamped to the equivalent of probabilities in [1e-4, 1 - 1e-4]
+LOGIT_CLAMP = math.log((1.0 - 1e-4) / 1e-4)
 
-    aa = a[:, 2]
-    ba = b[:, 2]
 
-    dalpha = __distance(ax=aa, bx=ba)
-    dx = __distance(ax=ax, bx=bx)
-    dy = __distance(ax=ay, bx=by)
-    dxy = torch.sqrt(dx*dx + dy*dy)
+def sigmoid_focal_loss(
+    logits: torch.Tensor,
+    keep: torch.Tensor,
+    positive_batch: torch.Tensor,
+    positive_anchor: torch.Tensor,
+    positive_label: torch.Tensor,
+    alpha: float = 0.25,
+    gamma: float = 2.0
+) -> torch.Tensor:
+    """ Focal loss computed from logits, summed per image.
 
-    return 10 * dxy + dalpha
+    Every class of every kept anchor is first treated as a negative; the
+    (anchor, label) entries of the positives are then corrected with the
+    positive term, so no dense target tensor is ever built. Uses
+    -log(1 - p) = softplus(x) and -log(p) = softplus(-x).
 
+    Args
+        logits         : (B, N, C) classification logits.
+        keep           : (B, N) bool, anchors that are not ignored.
+        positive_batch : (P) image index of every positive anchor.
+        positive_anchor: (P) anchor index of every positive anchor.
+        positive_label : (P) assigned class of every positive anchor.
+    Returns
+        (B) tensor of the summed loss of every image.
+    """
+    logits = torch.clamp(logits, -LOGIT_CLAMP, LOGIT_CLAMP)
 
-class FocalLoss(nn.Module):
-    # def __init__(self):
-
-    def forward(self, classifications, regressions, anchors, annotations):
-        alpha = 0.25
-        gamma = 2.0
-        batch_size = classifications.shape[0]
-        classification_losses = []
-        regression_losses = []
-
-        anchor = anchors[0, :, :]
-
-        anchor_ctr_x = anchor[:, 0]
-        anchor_ctr_y = anchor[:, 1]
-        anchor_alpha = anchor[:, 2]
+    # (1 - alpha) * p ** gamma * -log(1 - p)
+    softplus = F.softplus(logits)
+    negative = torch.exp(gamma * (logits - softplus)) * softplus
+    loss = (1. - alpha) * (negative.sum(dim=2) * keep).sum(dim=1)
 
-        for j in range(batch_size):
+    x = logits[positive_batch, positive_anchor, positive_label]
+    softplus_x = F.softplus(x)
+    softplus_neg_x = F.softplus(-x)
+    # alpha * (1 - p) ** gamma * -log(p)
+    positive = alpha * torch.exp(-gamma * softplus_x) * softplus_neg_x
+    negative = (1. - alpha) * torch.exp(-gamma * softplus_neg_x) * softplus_x
 
-            classification = classifications[j, :, :]
-            regression = regressions[j, :, :]
+    return loss.index_add(0, positive_batch, positive - negative)
 
-            center_alpha_annotation = annotations[j, :, :]
-            center_alpha_annotation = center_alpha_annotation[
-                center_alpha_annotation[:, NUM_VARIABLES] != -1]
 
-            classification = torch.clamp(classification, 1e-4, 1.0 - 1e-4)
+def _sparse_targets(anchor_targets, num_anchors):
+    """ Targets from `dataloader.AnchorTargets`, batched by `collater`. """
+    positive, assigned, ignore = anchor_targets
+    batch_size = positive.shape[0]
 
-            if center_alpha_annotation.shape[0] == 0:
-                if torch.cuda.is_available():
-                    alpha_factor = torch.ones(
-                        classification.shape).cuda() * alpha
+    positive_batch, slot = (positive >= 0).nonzero(as_tuple=True)
+    positive_anchor = positive[positive_batch, slot].long()
+    annotation_index = assigned[positive_batch, slot].long()
 
-                    alpha_factor = 1. - alpha_factor
-                    focal_weight = classification
-                    focal_weight = alpha_factor * \
-                        torch.pow(focal_weight, gamma)
+    ignore_batch, slot = (ignore >= 0).nonzero(as_tuple=True)
+    keep = torch.ones((batch_size, num_anchors),
+                      dtype=torch.bool, device=positive.device)
+    keep[ignore_batch, ignore[ignore_batch, slot].long()] = False
 
-                    bce = -(torch.log(1.0 - classification))
+    num_positive_anchors = (positive >= 0).sum(dim=1)
+    return keep, positive_batch, positive_anchor, annotation_index, num_positive_anchors
 
-                    # cls_loss = focal_weight * torch.pow(bce, gamma)
-                    cls_loss = focal_weight * bce
-                    classification_losses.append(cls_loss.sum())
-                    regression_losses.append(torch.tensor(0).float())
 
-                else:
-                    alpha_factor = torch.ones(classification.shape) * alpha
+class FocalLoss(nn.Module):
+    # def __init__(self):
 
-                    alpha_factor = 1. - alpha_factor
-                    focal_weight = classification
-                    focal_weight = alpha_factor * \
-                        torch.pow(focal_weight, gamma)
+    def forward(self, classifications, regressions, anchors, annotations, anchor_targets=None):
+        """ classifications are logits, see `sigmoid_focal_loss`.
 
-                    bce = -(torch.log(1.0 - classification))
+        anchor_targets optionally holds the assignment precomputed by
+        `dataloader.AnchorTargets`, in which case it is not recomputed here.
+        """
+        alpha = 0.25
+        gamma = 2.0
+        batch_size = annotations.shape[0]
 
-                    # cls_loss = focal_weight * torch.pow(bce, gamma)
-                    cls_loss = focal_weight * bce
-                    classification_losses.append(cls_loss.sum())
-                    regression_losses.append(torch.tensor(0).float())
-
-                continue
-
-            # num_anchors x num_annotations
-            distance = calc_distance(anchors[0, :, :],
-                                     center_alpha_annotation[:, :NUM_VARIABLES])
-            distance_min, distance_argmin = torch.min(
-                distance, dim=1)  # num_anchors x 1
-
-            # compute the loss for classification
-            targets = torch.ones(classification.shape) * -1
-            if torch.cuda.is_available():
-                targets = targets.cuda()
-# -----------------------------------------------------------------------
-
-            targets[torch.ge(
-                distance_min, 13 * MAX_ANOT_ANCHOR_POSITION_DISTANCE), :] = 0
-
-            positive_indices = torch.le(
-                distance_min, 11 * MAX_ANOT_ANCHOR_POSITION_DISTANCE)
-
-            num_positive_anchors = positive_indices.sum()
-
-            # assigned_annotations = center_alpha_annotation[deltaphi_argmin, :] # no different in result
-            assigned_annotations = center_alpha_annotation[distance_argmin, :]
-
-            targets[positive_indices, :] = 0
-            targets[positive_indices,
-                    assigned_annotations[positive_indices, 3].long()] = 1
-# -------------------------------------------------------------------------
-
-            if torch.cuda.is_available():
-                alpha_factor = torch.ones(targets.shape).cuda() * alpha
-            else:
-                alpha_factor = torch.ones(targets.shape) * alpha
-
-            alpha_factor = torch.where(
-                torch.eq(targets, 1.), alpha_factor, 1. - alpha_factor)
-            focal_weight = torch.where(
-                torch.eq(targets, 1.), 1. - classification, classification)
-            focal_weight = alpha_factor * torch.pow(focal_weight, gamma)
-
-            bce = -(targets * torch.log(classification) +
-                    (1.0 - targets) * torch.log(1.0 - classification))
-
-            # cls_loss = focal_weight * torch.pow(bce, gamma)
-            cls_loss = focal_weight * bce
-
-            if torch.cuda.is_available():
-                cls_loss = torch.where(
-                    torch.ne(targets, -1.0), cls_loss, torch.zeros(cls_loss.shape).cuda())
-            else:
-                cls_loss = torch.where(
-                    torch.ne(targets, -1.0), cls_loss, torch.zeros(cls_loss.shape))
-
-            classification_losses.append(
-                cls_loss.sum()/torch.clamp(num_positive_anchors.float(), min=1.0))
-
-            # compute the loss for regression
-
-            if positive_indices.sum() > 0:
-                assigned_annotations = assigned_annotations[positive_indices, :]
-
-                anchor_ctr_x_pi = anchor_ctr_x[positive_indices]
-                anchor_ctr_y_pi = anchor_ctr_y[positive_indices]
-                anchor_alpha_pi = anchor_alpha[positive_indices]
-
-                gt_ctr_x = assigned_annotations[:, 0]
-                gt_ctr_y = assigned_annotations[:, 1]
-                gt_alpha = assigned_annotations[:, 2]
-
-                targets_dx = (gt_ctr_x - anchor_ctr_x_pi)
-                targets_dy = (gt_ctr_y - anchor_ctr_y_pi)
-                targets_dalpha = (gt_alpha - anchor_alpha_pi)
-
-                targets = torch.stack(
-                    (targets_dx, targets_dy, targets_dalpha))
-                targets = targets.t()
-                if torch.cuda.is_available():
-                    targets = targets / \
-                        torch.Tensor([[1, 1, 1]]).cuda()
-                else:
-                    targets = targets/torch.Tensor([[1, 1, 1]])
-                negative_indices = 1 + (~positive_indices)
-
-                regression_diff_xy = torch.abs(
-                    targets[:, :2] - regression[positive_indices, :2])
-
-                regression_diff_angle = 1 - torch.cos(
-                    targets[:, 2] - regression[positive_indices, 2])
-
-                regression_loss_xy = torch.where(
-                    torch.le(regression_diff_xy, 1.0 / 9.0),
-                    0.5 * 9.0 * torch.pow(regression_diff_xy, 2),
-                    regression_diff_xy - 0.5 / 9.0
-                )
-                regression_losses.append(
-                    regression_loss_xy.mean() + regression_diff_angle.mean())
-            else:
-                if torch.cuda.is_available():
-                    regression_losses.append(torch.tensor(0).float().cuda())
-                else:
-                    regression_losses.append(torch.tensor(0).float())
-
-        return torch.stack(classification_losses).mean(dim=0, keepdim=True), torch.stack(regression_losses).mean(dim=0, keepdim=True)
+        anchor = anchors[0, :, :]
+        # no-ops when the inputs are already on the device of the anchors
+        annotations = annotations.to(anchor.device, non_blocking=True)
+        if anchor_targets is not None:
+            anchor_targets = [targets.to(anchor.device, non_blocking=True) for targets in anchor_targets]
+
+        if anchor_targets is None:
+            keep, positive_batch, positive_anchor, annotation_index, num_positive_anchors = \
+                self.assign_targets(anchor, annotations)
+        else:
+            keep, positive_batch, positive_anchor, annotation_index, num_positive_anchors = \
+                _sparse_targets(anchor_targets, anchor.shape[0])
+
+        num_positive_anchors = torch.clamp(num_positive_anchors.float(), min=1.0)
+
+        # positives x (NUM_VARIABLES + 1)
+        assigned_annotations = annotations[positive_batch, annotation_index, :]
+
+        # compute the loss for classification
+        classification_losses = sigmoid_focal_loss(
+            classifications, keep,
+            positive_batch, positive_anchor,
+            assigned_annotations[:, NUM_VARIABLES].long(),
+            alpha=alpha, gamma=gamma) / num_positive_anchors
+
+        # compute the loss for regression
+
+        targets = assigned_annotations[:, :NUM_VARIABLES] - \
+            anchor[positive_anchor, :]
+        regression = regressions[positive_batch, positive_anchor, :]
+
+        regression_diff_xy = torch.abs(targets[:, :2] - regression[:, :2])
+
+        regression_diff_angle = 1 - torch.cos(targets[:, 2] - regression[:, 2])
+
+        regression_loss_xy = torch.where(
+            torch.le(regression_diff_xy, 1.0 / 9.0),
+            0.5 * 9.0 * torch.pow(regression_diff_xy, 2),
+            regression_diff_xy - 0.5 / 9.0
+        )
+
+        # per image means over the positive anchors, 0 when there are none
+        regression_loss_xy = regression_loss_xy.new_zeros(batch_size).index_add(
+            0, positive_batch, regression_loss_xy.sum(dim=1))
+        regression_diff_angle = regression_diff_angle.new_zeros(batch_size).index_add(
+            0, positive_batch, regression_diff_angle)
+        regression_losses = regression_loss_xy / (2 * num_positive_anchors) + \
+            regression_diff_angle / num_positive_anchors
+
+        return classification_losses.mean(dim=0, keepdim=True), regression_losses.mean(dim=0, keepdim=True)
+
+    def assign_targets(self, anchor, annotations):
+        # padded annotation rows from `collater` are marked with label -1
+        valid_annotations = annotations[:, :, NUM_VARIABLES] != -1  # batch x num_annotations
+
+        # exact for every anchor that can end up positive or ignored
+        distance_min, distance_argmin = assign(
+            anchor, annotations[:, :, :NUM_VARIABLES], valid=valid_annotations,
+            max_distance=13 * MAX_ANOT_ANCHOR_POSITION_DISTANCE,
+            position_weight=POSITION_WEIGHT)  # batch x num_anchors
+
+        positive_indices, negative_indices = threshold_masks(
+            distance_min,
+            11 * MAX_ANOT_ANCHOR_POSITION_DISTANCE,
+            13 * MAX_ANOT_ANCHOR_POSITION_DISTANCE)
+
+        positive_batch, positive_anchor = positive_indices.nonzero(as_tuple=True)
+        annotation_index = distance_argmin[positive_batch, positive_anchor]
+
+        return (positive_indices | negative_indices, positive_batch, positive_anchor,
+                annotation_index, positive_indices.sum(dim=1))
@@ -1,12 +1,17 @@
+import collections
+import math
+
 import torch.nn as nn
 import torch
-import math
 import torch.utils.model_zoo as model_zoo
-from torchvision.ops import nms
-from retinanet.utils import BasicBlock, Bottleneck, BBoxTransform, ClipBoxes
+from torch.nn.utils.fusion import fuse_conv_bn_eval
+from retinanet.utils import BasicBlock, Bottleneck, BBoxTransform
 from retinanet.anchors import Anchors
 from retinanet import losses
-from .settings import NUM_VARIABLES, ANGLE_SPLIT
+from retinanet.nms import point_nms
+from retinanet.postprocess import clip_to_sizes, limit_per_image, select_candidates, sort_by_image_and_score, \
+    split_detections
+from .settings import NUM_VARIABLES, ANGLE_SPLIT, MAX_ANOT_ANCHOR_ANGLE_DISTANCE, MAX_ANOT_ANCHOR_POSITION_DISTANCE
 
 model_urls = {
     'resnet18': 'https://download.pytorch.org/models/resnet18-5c106cde.pth',
@@ -17,6 +22,28 @@ model_urls = {
 }
 
 
+# backbone stages left out of truncated models
+TRUNCATED_STAGES = ('layer3', 'layer4')
+
+
+def _load_pretrained(model, arch):
+    """ Load the ImageNet weights of the backbone stages `model` builds.
+
+    The ImageNet classifier is dropped and the heads are not part of the
+    checkpoint; any other mismatch is an error.
+    """
+    state_dict = model_zoo.load_url(model_urls[arch], model_dir='.')
+    state_dict = collections.OrderedDict(
+        (key, value) for key, value in state_dict.items() if not key.startswith('fc.'))
+
+    missing_keys, unexpected_keys = model.load_state_dict(state_dict, strict=False)
+    missing_keys = [key for key in missing_keys
+                    if key.split('.')[0] not in ('regressionModel', 'classificationModel', 'heads')]
+    if missing_keys or unexpected_keys:
+        raise RuntimeError('{} weights do not match the backbone: missing {}, unexpected {}'.format(
+            arch, missing_keys, unexpected_keys))
+
+
 class PyramidFeatures(nn.Module):
     def __init__(self, C3_size, C4_size, C5_size, feature_size=256):
         super(PyramidFeatures, self).__init__()
@@ -159,7 +186,8 @@ class ClassificationModel(nn.Module):
         out = self.act4(out)
 
         out = self.output(out)
-        out = self.output_act(out)
+        # logits: sigmoid is applied at inference only, and only to the
+        # candidates that pass the score threshold (see `postprocess`)
 
         # out is B x C x W x H, with C = n_classes + n_anchors
         out1 = out.permute(0, 2, 3, 1)
@@ -172,9 +200,115 @@ class ClassificationModel(nn.Module):
         return out2.contiguous().view(x.shape[0], -1, self.num_classes)
 
 
-class ResNet(nn.Module):
+def split_fused_output(out, num_anchors, num_classes, padded_outputs):
+    """ (regression, classification) in the layouts of `RegressionModel` and
+    `ClassificationModel`, from the B x C x H x W output of `FusedHeads`.
+    """
+    out = out.permute(0, 2, 3, 1)
+    batch_size = out.shape[0]
+    regression = out[..., :num_anchors * NUM_VARIABLES]
+    classification = out[..., padded_outputs:padded_outputs + num_anchors * num_classes]
+    return regression.reshape(batch_size, -1, NUM_VARIABLES), \
+        classification.reshape(batch_size, -1, num_classes)
+
+
+class FusedHeads(nn.Module):
+    """ The regression and classification towers as one conv stack.
+
+    conv1 reads the features once for both towers, conv2 to conv4 are
+    grouped convolutions with the regression tower in the first group and
+    the classification tower in the second, and the output conv is grouped
+    too, each tower padded to `padded_outputs` channels. With
+    share_first_layer both towers start from a single conv1 and conv2 is a
+    plain convolution; that is a different model and has to be trained.
+    """
 
-    def __init__(self, num_classes, block, layers):
+    def __init__(self, num_features_in, num_anchors=ANGLE_SPLIT, num_classes=80, feature_size=256,
+                 share_first_layer=False):
+        super(FusedHeads, self).__init__()
+
+        self.num_anchors = num_anchors
+        self.num_classes = num_classes
+        self.share_first_layer = share_first_layer
+        self.padded_outputs = num_anchors * max(NUM_VARIABLES, num_classes)
+        width = 2 * feature_size
+
+        self.conv1 = nn.Conv2d(num_features_in, feature_size if share_first_layer else width,
+                               kernel_size=3, padding=1)
+        self.act1 = nn.ReLU()
+
+        self.conv2 = nn.Conv2d(self.conv1.out_channels, width,
+                               kernel_size=3, padding=1, groups=1 if share_first_layer else 2)
+        self.act2 = nn.ReLU()
+
+        self.conv3 = nn.Conv2d(width, width, kernel_size=3, padding=1, groups=2)
+        self.act3 = nn.ReLU()
+
+        self.conv4 = nn.Conv2d(width, width, kernel_size=3, padding=1, groups=2)
+        self.act4 = nn.ReLU()
+
+        self.output = nn.Conv2d(width, 2 * self.padded_outputs, kernel_size=3, padding=1, groups=2)
+
+    def forward(self, x):
+        out = self.act1(self.conv1(x))
+        out = self.act2(self.conv2(out))
+        out = self.act3(self.conv3(out))
+        out = self.act4(self.conv4(out))
+        out = self.output(out)
+        return split_fused_output(out, self.num_anchors, self.num_classes, self.padded_outputs)
+
+    def _pad(self, tensor):
+        padded = tensor.new_zeros((self.padded_outputs,) + tuple(tensor.shape[1:]))
+        padded[:tensor.shape[0]] = tensor
+        return padded
+
+    def weights_from_heads(self, regression, classification):
+        """ The state dict of this module from the state dicts of a
+        `RegressionModel` and a `ClassificationModel`. The outputs are the
+        same unless the first layer is shared, in which case both towers
+        start from the first layer of the classification tower.
+        """
+        state_dict = collections.OrderedDict()
+        for name in ('conv1', 'conv2', 'conv3', 'conv4'):
+            for param in ('weight', 'bias'):
+                key = '{}.{}'.format(name, param)
+                if name == 'conv1' and self.share_first_layer:
+                    state_dict[key] = classification[key]
+                else:
+                    state_dict[key] = torch.cat([regression[key], classification[key]])
+        for param in ('weight', 'bias'):
+            key = 'output.{}'.format(param)
+            state_dict[key] = torch.cat([self._pad(regression[key]), self._pad(classification[key])])
+        return state_dict
+
+
+class ResNet(nn.Module):
+    # inference options, see `set_inference_options`; class attributes so
+    # that models pickled before an option existed pick up its default
+    score_threshold = 0.05
+    per_class_top_k = None
+    top_k = None
+    nms_radius = MAX_ANOT_ANCHOR_POSITION_DISTANCE
+    nms_angle_threshold = MAX_ANOT_ANCHOR_ANGLE_DISTANCE
+    max_detections = None
+    # models pickled before truncation existed have every stage
+    truncated = False
+    # CPU inference mode, see `set_cpu_inference_mode`
+    channels_last = False
+    bfloat16 = False
+    # int8 inference through `quantized_trunk`, see `retinanet.quantization`
+    quantized = False
+    # see `fold_batchnorm`
+    batchnorm_folded = False
+    # one `FusedHeads` module instead of regressionModel and classificationModel
+    fused_heads = False
+
+    def __init__(self, num_classes, block, layers, truncated=True, fused_heads=False, share_first_layer=False):
+        """ truncated: only build the backbone stages that feed the heads,
+        conv1 to layer2; layer3 and layer4 are never run.
+        fused_heads: run both heads as one `FusedHeads` conv stack.
+        share_first_layer: with fused_heads, share the first head layer.
+        """
         self.inplanes = 64
         super(ResNet, self).__init__()
         self.conv1 = nn.Conv2d(3, 64, kernel_size=7,
@@ -184,19 +318,23 @@ class ResNet(nn.Module):
         self.maxpool = nn.MaxPool2d(kernel_size=3, stride=2, padding=1)
         self.layer1 = self._make_layer(block, 64, layers[0])
         self.layer2 = self._make_layer(block, 128, layers[1], stride=2)
-        self.layer3 = self._make_layer(block, 256, layers[2], stride=2)
-        self.layer4 = self._make_layer(block, 512, layers[3], stride=2)
-
-        self.regressionModel = RegressionModel(512)
-        self.classificationModel = ClassificationModel(
-            512, num_classes=num_classes)
+        self.truncated = truncated
+        if not truncated:
+            self.layer3 = self._make_layer(block, 256, layers[2], stride=2)
+            self.layer4 = self._make_layer(block, 512, layers[3], stride=2)
+
+        self.fused_heads = fused_heads
+        if fused_heads:
+            self.heads = FusedHeads(512, num_classes=num_classes, share_first_layer=share_first_layer)
+        else:
+            self.regressionModel = RegressionModel(512)
+            self.classificationModel = ClassificationModel(
+                512, num_classes=num_classes)
 
         self.anchors = Anchors()
 
         self.regressBoxes = BBoxTransform()
 
-        self.clipBoxes = ClipBoxes()
-
         self.focalLoss = losses.FocalLoss()
 
         for m in self.modules():
@@ -209,12 +347,18 @@ class ResNet(nn.Module):
 
         prior = 0.01
 
-        self.classificationModel.output.weight.data.fill_(0)
-        self.classificationModel.output.bias.data.fill_(
-            -math.log((1.0 - prior) / prior))
+        if fused_heads:
+            self.heads.output.weight.data.fill_(0)
+            self.heads.output.bias.data.fill_(0)
+            self.heads.output.bias.data[self.heads.padded_outputs:].fill_(
+                -math.log((1.0 - prior) / prior))
+        else:
+            self.classificationModel.output.weight.data.fill_(0)
+            self.classificationModel.output.bias.data.fill_(
+                -math.log((1.0 - prior) / prior))
 
-        self.regressionModel.output.weight.data.fill_(0)
-        self.regressionModel.output.bias.data.fill_(0)
+            self.regressionModel.output.weight.data.fill_(0)
+            self.regressionModel.output.bias.data.fill_(0)
 
         self.freeze_bn()
 
@@ -234,18 +378,128 @@ class ResNet(nn.Module):
 
         return nn.Sequential(*layers)
 
+    def set_inference_options(self, **options):
+        """ Set inference options on this model.
+
+        score_threshold    : Minimum score of a detection (0.05).
+        per_class_top_k    : Candidates kept per class and image before
+                             decoding, None for all (None).
+        top_k              : Candidates kept per image before decoding, None
+                             for all (None).
+        nms_radius         : NMS position distance, None disables NMS.
+        nms_angle_threshold: NMS angle distance.
+        max_detections     : Detections returned per image, None for all
+                             (None).
+        """
+        for name, value in options.items():
+            if name not in ('score_threshold', 'per_class_top_k', 'top_k',
+                            'nms_radius', 'nms_angle_threshold', 'max_detections'):
+                raise ValueError('unknown inference option: {}'.format(name))
+            setattr(self, name, value)
+        return self
+
+    def set_cpu_inference_mode(self, channels_last=True, bfloat16=False):
+        """ Run inference on channels_last tensors and, optionally, the
+        backbone and heads under CPU bfloat16 autocast. Decoding and
+        post-processing always run in float32.
+        """
+        if bfloat16 and self.quantized:
+            raise ValueError('bfloat16 autocast does not apply to a quantized model')
+        self.to(memory_format=torch.channels_last if channels_last else torch.contiguous_format)
+        self.channels_last = channels_last
+        self.bfloat16 = bfloat16
+        return self
+
+    def load_state_dict(self, state_dict, strict=True):
+        """ Weights of the stages a truncated model does not build are
+        dropped, so full checkpoints still load with strict=True. Checkpoints
+        with separate heads are converted for models with fused heads.
+        """
+        if self.truncated:
+            state_dict = collections.OrderedDict(
+                (key, value) for key, value in state_dict.items()
+                if key.split('.')[0] not in TRUNCATED_STAGES)
+        if self.fused_heads and any(key.startswith('regressionModel.') for key in state_dict):
+            heads = {name: collections.OrderedDict(
+                (key[len(name) + 1:], value) for key, value in state_dict.items()
+                if key.split('.')[0] == name) for name in ('regressionModel', 'classificationModel')}
+            state_dict = collections.OrderedDict(
+                (key, value) for key, value in state_dict.items() if key.split('.')[0] not in heads)
+            state_dict.update(
+                ('heads.' + key, value) for key, value in self.heads.weights_from_heads(
+                    heads['regressionModel'], heads['classificationModel']).items())
+        return super(ResNet, self).load_state_dict(state_dict, strict=strict)
+
     def freeze_bn(self):
         '''Freeze BatchNorm layers.'''
         for layer in self.modules():
             if isinstance(layer, nn.BatchNorm2d):
                 layer.eval()
 
-    def forward(self, inputs):
-
-        if self.training:
-            img_batch, annotations = inputs
-        else:
-            img_batch = inputs
+    def fuse_heads(self):
+        """ Replace regressionModel and classificationModel by a `FusedHeads`
+        module with the same weights; the outputs do not change.
+        """
+        if self.fused_heads:
+            return self
+        if self.quantized:
+            raise ValueError('the heads of a quantized model can not be fused')
+
+        weight = self.regressionModel.conv1.weight
+        heads = FusedHeads(weight.shape[1],
+                           num_anchors=self.classificationModel.num_anchors,
+                           num_classes=self.classificationModel.num_classes,
+                           feature_size=weight.shape[0])
+        heads.to(device=weight.device, dtype=weight.dtype)
+        heads.load_state_dict(heads.weights_from_heads(
+            self.regressionModel.state_dict(), self.classificationModel.state_dict()))
+        heads.train(self.training)
+
+        del self.regressionModel
+        del self.classificationModel
+        self.heads = heads
+        self.fused_heads = True
+        if self.channels_last:
+            self.to(memory_format=torch.channels_last)
+        return self
+
+    def fold_batchnorm(self):
+        """ Fold every BatchNorm into the convolution before it: the stem,
+        conv1/bn1 to conv3/bn3 of every block and the downsample pairs.
+
+        BatchNorms are frozen (see `freeze_bn`), so each one is an affine op
+        its convolution absorbs. The model is put in eval mode and gives the
+        same outputs up to float rounding; it is meant for inference and can
+        no longer load checkpoints that have BatchNorm weights.
+        """
+        if self.quantized:
+            raise ValueError('quantized models already have their BatchNorms folded')
+        self.training = False
+        self.eval()
+
+        pairs = [(self, 'conv1', 'bn1')]
+        for module in list(self.modules()):
+            if isinstance(module, (BasicBlock, Bottleneck)):
+                pairs += [(module, 'conv' + i, 'bn' + i) for i in '123' if hasattr(module, 'conv' + i)]
+                if module.downsample is not None:
+                    pairs.append((module.downsample, '0', '1'))
+
+        for parent, conv, bn in pairs:
+            if isinstance(getattr(parent, bn), nn.BatchNorm2d):
+                setattr(parent, conv, fuse_conv_bn_eval(getattr(parent, conv), getattr(parent, bn)))
+                setattr(parent, bn, nn.Identity())
+
+        if self.channels_last:
+            self.to(memory_format=torch.channels_last)
+        self.batchnorm_folded = True
+        return self
+
+    def _forward_heads(self, img_batch):
+        if self.channels_last:
+            img_batch = img_batch.contiguous(memory_format=torch.channels_last)
+
+        if self.quantized:
+            return self.quantized_trunk(img_batch)
 
         x = self.conv1(img_batch)
         x = self.bn1(x)
@@ -257,57 +511,90 @@ class ResNet(nn.Module):
         # x3 = self.layer3(x2)
         # x4 = self.layer4(x3)
 
+        if self.fused_heads:
+            return self.heads(x2)
+
         regression = self.regressionModel(x2)
         classification = self.classificationModel(x2)
+        return regression, classification
+
+    def forward(self, inputs):
+        """ Training: inputs is [img_batch, annotations(, anchor_targets)] and
+        the (classification, regression) losses are returned.
+
+        Inference: inputs is either a single image batch, for which
+        [scores, labels, points] is returned, or a padded batch and the
+        (rows, cols) of every image in it, as `collater` builds them in
+        'img' and 'sizes', for which a list of per-image
+        [scores, labels, points] is returned.
+        """
+
+        if self.training:
+            if self.quantized:
+                raise RuntimeError('a quantized model can only run inference')
+            # optional third element: `anchor_targets` from `collater`
+            img_batch, annotations = inputs[:2]
+            anchor_targets = inputs[2] if len(inputs) > 2 else None
+        elif isinstance(inputs, (list, tuple)):
+            img_batch, image_sizes = inputs
+            image_sizes = torch.as_tensor(image_sizes, device=img_batch.device)
+            single_image = False
+        else:
+            img_batch, image_sizes = inputs, None
+            single_image = True
+            if img_batch.shape[0] != 1:
+                raise ValueError(
+                    'pass (img_batch, image_sizes) to run inference on more than one image')
+
+        if self.training or not self.bfloat16:
+            regression, classification = self._forward_heads(img_batch)
+        else:
+            with torch.cpu.amp.autocast(dtype=torch.bfloat16):
+                regression, classification = self._forward_heads(img_batch)
+            regression, classification = regression.float(), classification.float()
         anchors = self.anchors(img_batch)
 
         if self.training:
-            return self.focalLoss(classification, regression, anchors, annotations)
+            return self.focalLoss(classification, regression, anchors, annotations, anchor_targets)
         else:
-            transformed_anchors = self.regressBoxes(anchors, regression)
-            transformed_anchors = self.clipBoxes(
-                transformed_anchors, img_batch)
-
-            finalResult = [[], [], []]
-
-            finalScores = torch.Tensor([])
-            finalAnchorBoxesIndexes = torch.Tensor([]).long()
-            finalAnchorBoxesCoordinates = torch.Tensor([])
-            if torch.cuda.is_available():
-                finalScores = finalScores.cuda()
-                finalAnchorBoxesIndexes = finalAnchorBoxesIndexes.cuda()
-                finalAnchorBoxesCoordinates = finalAnchorBoxesCoordinates.cuda()
-
-            for i in range(classification.shape[2]):
-                scores = torch.squeeze(classification[:, :, i])
-                scores_over_thresh = (scores > 0.05)
-                if scores_over_thresh.sum() == 0:
-                    # no boxes to NMS, just continue
-                    continue
-
-                scores = scores[scores_over_thresh]
-                anchorBoxes = torch.squeeze(transformed_anchors)
-                anchorBoxes = anchorBoxes[scores_over_thresh]
-                # anchors_nms_idx = nms(anchorBoxes, scores, 0.5)
-                anchors_nms_idx = torch.arange(0, anchorBoxes.shape[0])
-
-                finalResult[0].extend(scores[anchors_nms_idx])
-                finalResult[1].extend(torch.tensor(
-                    [i] * anchors_nms_idx.shape[0]))
-                finalResult[2].extend(anchorBoxes[anchors_nms_idx])
-
-                finalScores = torch.cat((finalScores, scores[anchors_nms_idx]))
-                finalAnchorBoxesIndexesValue = torch.tensor(
-                    [i] * anchors_nms_idx.shape[0])
-                if torch.cuda.is_available():
-                    finalAnchorBoxesIndexesValue = finalAnchorBoxesIndexesValue.cuda()
-
-                finalAnchorBoxesIndexes = torch.cat(
-                    (finalAnchorBoxesIndexes, finalAnchorBoxesIndexesValue))
-                finalAnchorBoxesCoordinates = torch.cat(
-                    (finalAnchorBoxesCoordinates, anchorBoxes[anchors_nms_idx]))
-
-            return [finalScores, finalAnchorBoxesIndexes, finalAnchorBoxesCoordinates]
+            if image_sizes is None:
+                image_sizes = torch.tensor(
+                    [list(img_batch.shape[2:])], device=img_batch.device).expand(img_batch.shape[0], 2)
+            # anchors in the padding of smaller images
+            valid = (anchors[:, :, 0] < image_sizes[:, 1:2]) & \
+                (anchors[:, :, 1] < image_sizes[:, 0:1])
+
+            batch_index, anchor_index, labels, scores = select_candidates(
+                classification, score_threshold=self.score_threshold, valid=valid,
+                per_class_top_k=self.per_class_top_k, top_k=self.top_k)
+
+            # decode and clip the candidates only
+            points = self.regressBoxes(
+                anchors[:, anchor_index, :], regression[batch_index, anchor_index].unsqueeze(0))[0]
+            points = clip_to_sizes(batch_index, points, image_sizes)
+
+            order = None
+            if self.nms_radius:
+                order = point_nms(points, scores,
+                                  groups=batch_index * classification.shape[2] + labels,
+                                  radius=self.nms_radius,
+                                  angle_threshold=self.nms_angle_threshold)
+            keep = sort_by_image_and_score(batch_index, scores, order)
+            batch_index, scores, labels, points = \
+                batch_index[keep], scores[keep], labels[keep], points[keep]
+
+            if self.max_detections is not None:
+                keep = limit_per_image(
+                    img_batch.shape[0], batch_index, self.max_detections)
+                batch_index, scores, labels, points = \
+                    batch_index[keep], scores[keep], labels[keep], points[keep]
+
+            detections = split_detections(
+                img_batch.shape[0], batch_index, scores, labels, points)
+
+            if single_image:
+                return detections[0]
+            return detections
 
 
 def resnet18(num_classes, pretrained=False, **kwargs):
@@ -317,8 +604,7 @@ def resnet18(num_classes, pretrained=False, **kwargs):
     """
     model = ResNet(num_classes, BasicBlock, [2, 2, 2, 2], **kwargs)
     if pretrained:
-        model.load_state_dict(model_zoo.load_url(
-            model_urls['resnet18'], model_dir='.'), strict=False)
+        _load_pretrained(model, 'resnet18')
     return model
 
 
@@ -329,8 +615,7 @@ def resnet34(num_classes, pretrained=False, **kwargs):
     """
     model = ResNet(num_classes, BasicBlock, [3, 4, 6, 3], **kwargs)
     if pretrained:
-        model.load_state_dict(model_zoo.load_url(
-            model_urls['resnet34'], model_dir='.'), strict=False)
+        _load_pretrained(model, 'resnet34')
     return model
 
 
@@ -341,8 +626,7 @@ def resnet50(num_classes, pretrained=False, **kwargs):
     """
     model = ResNet(num_classes, Bottleneck, [3, 4, 6, 3], **kwargs)
     if pretrained:
-        model.load_state_dict(model_zoo.load_url(
-            model_urls['resnet50'], model_dir='.'), strict=False)
+        _load_pretrained(model, 'resnet50')
     return model
 
 
@@ -353,8 +637,7 @@ def resnet101(num_classes, pretrained=False, **kwargs):
     """
     model = ResNet(num_classes, Bottleneck, [3, 4, 23, 3], **kwargs)
     if pretrained:
-        model.load_state_dict(model_zoo.load_url(
-            model_urls['resnet101'], model_dir='.'), strict=False)
+        _load_pretrained(model, 'resnet101')
     return model
 
 
@@ -365,6 +648,5 @@ def resnet152(num_classes, pretrained=False, **kwargs):
     """
     model = ResNet(num_classes, Bottleneck, [3, 8, 36, 3], **kwargs)
     if pretrained:
-        model.load_state_dict(model_zoo.load_url(
-            model_urls['resnet152'], model_dir='.'), strict=False)
+        _load_pretrained(model, 'resnet152')
     return model
@@ -0,0 +1,101 @@
+""" Non-maximum suppression for (x, y, alpha) point detections.
+
+`torchvision.ops.nms` only understands axis-aligned boxes. Here a detection
+suppresses a lower scoring one of the same group (class, image, ...) when
+they are within `radius` pixels and `angle_threshold` degrees of each
+other, which are the matching rules of `csv_eval.evaluate`.
+
+Neighbouring pairs are found through a spatial hash with cells of `radius`
+pixels, so the cost is near-linear in the number of candidates. Greedy
+suppression is then resolved in a few vectorized rounds: a detection is
+kept once every higher scoring neighbour is suppressed, and suppressed as
+soon as one of them is kept. The result equals sequential greedy NMS.
+"""
+import torch
+
+from .settings import MAX_ANOT_ANCHOR_ANGLE_DISTANCE, MAX_ANOT_ANCHOR_POSITION_DISTANCE
+
+_NEIGHBOURS = [(dy, dx) for dy in (-1, 0, 1) for dx in (-1, 0, 1)]
+
+
+def _neighbour_pairs(points, groups, radius, angle_threshold):
+    """ (i, j) pairs of the same group within radius and angle_threshold, i != j. """
+    # widen the cells a little so rounding never hides a pair
+    cell_size = radius * 1.001
+    col = torch.floor((points[:, 0] - points[:, 0].min()) / cell_size).long() + 1
+    row = torch.floor((points[:, 1] - points[:, 1].min()) / cell_size).long() + 1
+    num_cols = int(col.max()) + 2
+    num_cells = num_cols * (int(row.max()) + 2)
+
+    keys = groups * num_cells + row * num_cols + col
+    sorted_keys, order = torch.sort(keys)
+    max_per_cell = int(torch.unique_consecutive(sorted_keys, return_counts=True)[1].max())
+
+    neighbour_keys = torch.stack([
+        keys + dy * num_cols + dx for dy, dx in _NEIGHBOURS], dim=1)  # (D, 9)
+    first = torch.searchsorted(sorted_keys, neighbour_keys)
+    last = torch.searchsorted(sorted_keys, neighbour_keys, right=True)
+
+    candidates = first.unsqueeze(-1) + torch.arange(max_per_cell, device=points.device)
+    in_cell = (candidates < last.unsqueeze(-1)).flatten(start_dim=1)
+    candidates = order[candidates.clamp(max=order.shape[0] - 1)].flatten(start_dim=1)
+
+    i, slot = in_cell.nonzero(as_tuple=True)
+    j = candidates[i, slot]
+
+    dx = points[i, 0] - points[j, 0]
+    dy = points[i, 1] - points[j, 1]
+    dxy = torch.sqrt(dx * dx + dy * dy)
+    dalpha = torch.abs(points[i, 2] - points[j, 2])
+    close = (i != j) & (dxy <= radius) & (dalpha <= angle_threshold)
+    return i[close], j[close]
+
+
+def point_nms(
+    points,
+    scores,
+    groups=None,
+    radius=MAX_ANOT_ANCHOR_POSITION_DISTANCE,
+    angle_threshold=MAX_ANOT_ANCHOR_ANGLE_DISTANCE
+):
+    """ Greedy NMS of (x, y, alpha) detections, batched over groups.
+
+    Args
+        points         : (D, 3) tensor of (x, y, alpha).
+        scores         : (D) tensor of scores.
+        groups         : Optional (D) integer tensor, e.g. labels. Detections
+                         only suppress detections of their own group.
+        radius         : Position distance, in pixels, under which detections
+                         are duplicates.
+        angle_threshold: Angle distance, in degrees, under which detections
+                         are duplicates.
+    Returns
+        (K) long tensor of the kept indices, sorted by decreasing score.
+    """
+    num_detections = points.shape[0]
+    if num_detections == 0:
+        return torch.zeros((0,), dtype=torch.long, device=points.device)
+    if groups is None:
+        groups = torch.zeros((num_detections,), dtype=torch.long, device=points.device)
+
+    order = torch.argsort(scores, descending=True)
+    rank = torch.empty_like(order)
+    rank[order] = torch.arange(num_detections, device=points.device)
+
+    i, j = _neighbour_pairs(points, groups.long(), radius, angle_threshold)
+    # i may suppress j
+    higher = rank[i] < rank[j]
+    suppressor, suppressed = i[higher], j[higher]
+
+    # 0: undecided, 1: kept, -1: suppressed
+    state = torch.zeros((num_detections,), dtype=torch.int8, device=points.device)
+    while bool((state == 0).any()):
+        hit = torch.zeros((num_detections,), dtype=torch.bool, device=points.device)
+        hit[suppressed[state[suppressor] == 1]] = True
+        state[(state == 0) & hit] = -1
+
+        blocked = torch.zeros((num_detections,), dtype=torch.bool, device=points.device)
+        blocked[suppressed[state[suppressor] == 0]] = True
+        state[(state == 0) & ~blocked] = 1
+
+    return order[state[order] == 1]
@@ -13,6 +13,8 @@ import skimage.transform
 from PIL import Image
 from torch.utils.data import Dataset
 
+from .image_cache import cached_image
+
 
 def get_labels(metadata_dir, version='v4'):
     if version == 'v4' or version == 'challenge2018':
@@ -160,6 +162,11 @@ def generate_images_annotations_json(main_dir, metadata_dir, subset, cls_index,
 class OidDataset(Dataset):
     """Oid dataset."""
 
+    # optional `image_cache.ImageCache` of the decoded images
+    image_cache = None
+    # load_image returns uint8 images, see `dataloader.CSVDataset`
+    uint8_images = False
+
     def __init__(self, main_dir, subset, version='v4', annotation_cache_dir='.', transform=None):
         if version == 'v4':
             metadata = '2018_04'
@@ -212,9 +219,8 @@ class OidDataset(Dataset):
         path = os.path.join(self.base_dir, self.id_to_image_id[image_index] + '.jpg')
         return path
 
-    def load_image(self, image_index):
-        path = self.image_path(image_index)
-        img = skimage.io.imread(path)
+    def decode_image(self, image_index):
+        img = skimage.io.imread(self.image_path(image_index))
 
         if len(img.shape) == 1:
             img = img[0]
@@ -222,6 +228,14 @@ class OidDataset(Dataset):
         if len(img.shape) == 2:
             img = skimage.color.gray2rgb(img)
 
+        return img
+
+    def load_image(self, image_index):
+        path = self.image_path(image_index)
+        img = cached_image(self, image_index)
+        if self.uint8_images:
+            return img
+
         try:
             return img.astype(np.float32) / 255.0
         except Exception:
@@ -251,6 +265,10 @@ class OidDataset(Dataset):
 
         return boxes
 
+    def image_size(self, image_index):
+        img_annotations = self.annotations[self.id_to_image_id[image_index]]
+        return img_annotations['h'], img_annotations['w']
+
     def image_aspect_ratio(self, image_index):
         img_annotations = self.annotations[self.id_to_image_id[image_index]]
         height, width = img_annotations['h'], img_annotations['w']
@@ -0,0 +1,100 @@
+""" Inference post-processing: turns head outputs into detections.
+
+Candidates are selected on the logits first (score threshold, per-class and
+per-image top-k); only the survivors are decoded, clipped, suppressed and
+sorted.
+"""
+import math
+
+import torch
+
+
+def logit(probability):
+    return math.log(probability / (1.0 - probability))
+
+
+def select_candidates(classification, score_threshold=0.05, valid=None, per_class_top_k=None, top_k=None):
+    """ Threshold and top-k all classes of all images at once.
+
+    Args
+        classification : (B, N, C) classification logits.
+        score_threshold: Minimum sigmoid score of a candidate.
+        valid          : Optional (B, N) bool mask of the anchors that may
+                         produce candidates.
+        per_class_top_k: Optional maximum number of candidates per class and
+                         image.
+        top_k          : Optional maximum number of candidates per image.
+    Returns
+        batch_index (D), anchor_index (D), labels (D) and scores (D), with
+        batch_index sorted. Sigmoid only runs on the D candidates.
+    """
+    batch_size, num_anchors, num_classes = classification.shape
+
+    # scores > threshold <=> logits > logit(threshold)
+    logits = classification.permute(0, 2, 1)  # B x C x N
+    candidates = logits > logit(score_threshold)
+    if valid is not None:
+        candidates &= valid.unsqueeze(1)
+
+    if not per_class_top_k and not top_k:
+        batch_index, labels, anchor_index = candidates.nonzero(as_tuple=True)
+        scores = torch.sigmoid(logits[batch_index, labels, anchor_index])
+        return batch_index, anchor_index, labels, scores
+
+    logits = logits.masked_fill(~candidates, float('-inf'))
+    if per_class_top_k and per_class_top_k < num_anchors:
+        logits, anchor_index = logits.topk(per_class_top_k, dim=2)
+    else:
+        anchor_index = torch.arange(num_anchors, device=logits.device).expand_as(logits)
+    labels = torch.arange(num_classes, device=logits.device).view(1, -1, 1).expand_as(anchor_index)
+
+    logits = logits.reshape(batch_size, -1)
+    anchor_index = anchor_index.reshape(batch_size, -1)
+    labels = labels.reshape(batch_size, -1)
+    if top_k and top_k < logits.shape[1]:
+        logits, selected = logits.topk(top_k, dim=1)
+        anchor_index = anchor_index.gather(1, selected)
+        labels = labels.gather(1, selected)
+
+    batch_index, slot = torch.isfinite(logits).nonzero(as_tuple=True)
+    scores = torch.sigmoid(logits[batch_index, slot])
+    return batch_index, anchor_index[batch_index, slot], labels[batch_index, slot], scores
+
+
+def clip_to_sizes(batch_index, points, image_sizes):
+    """ Clip points to the (rows, cols) of their own image, not the padded batch. """
+    sizes = image_sizes.to(points)[batch_index]
+    x = torch.min(points[:, 0].clamp(min=0), sizes[:, 1])
+    y = torch.min(points[:, 1].clamp(min=0), sizes[:, 0])
+    return torch.stack([x, y, points[:, 2]], dim=1)
+
+
+def sort_by_image_and_score(batch_index, scores, order=None):
+    """ Indices sorting detections by image and by decreasing score within
+    each image. `order` optionally restricts them to a subset already
+    sorted by decreasing score, e.g. the output of `nms.point_nms`.
+    """
+    if order is None:
+        order = torch.argsort(scores, descending=True)
+    rank = torch.arange(order.shape[0], device=order.device)
+    return order[torch.argsort(batch_index[order] * order.shape[0] + rank)]
+
+
+def limit_per_image(batch_size, batch_index, max_detections):
+    """ Mask keeping the first max_detections detections of every image.
+    batch_index must be sorted.
+    """
+    counts = torch.bincount(batch_index, minlength=batch_size)
+    starts = torch.cumsum(counts, dim=0) - counts
+    rank = torch.arange(batch_index.shape[0], device=batch_index.device) - starts[batch_index]
+    return rank < max_detections
+
+
+def split_detections(batch_size, batch_index, *detections):
+    """ Per image [scores, labels, points] lists from batched detections.
+
+    batch_index must be sorted.
+    """
+    counts = torch.bincount(batch_index, minlength=batch_size).tolist()
+    per_image = [torch.split(tensor, counts) for tensor in detections]
+    return [[tensors[i] for tensors in per_image] for i in range(batch_size)]
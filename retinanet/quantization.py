@@ -0,0 +1,163 @@
+""" Post-training static int8 quantization.
+
+The backbone stages that feed the heads (conv1 to layer2) and the
+classification / regression conv stacks are fused (conv + bn + relu),
+calibrated on sample images and converted to int8 modules. The heads are
+dequantized before their outputs are reshaped, so anchors, decoding and
+post-processing stay in float32.
+
+Quantized models are CPU only. They are saved with `torch.save` and loaded
+with `torch.load` like any other model of this repository.
+"""
+import copy
+import random
+
+import torch
+import torch.nn as nn
+
+from .dataloader import collater
+from .model import split_fused_output
+from .settings import NUM_VARIABLES
+
+# modules of a ResNet replaced by the quantized trunk
+_FLOAT_MODULES = ('conv1', 'bn1', 'relu', 'maxpool', 'layer1', 'layer2', 'layer3', 'layer4',
+                  'regressionModel', 'classificationModel', 'heads')
+
+
+def _fuse(*modules):
+    """ conv, conv + bn, conv + relu or conv + bn + relu as one fused module.
+    BatchNorms already folded by `ResNet.fold_batchnorm` are skipped.
+    """
+    modules = [module for module in modules if not isinstance(module, nn.Identity)]
+    if len(modules) == 1:
+        return modules[0]
+    # fusion needs all modules in one mode; new activations start in training
+    sequence = nn.Sequential(*modules).train(modules[0].training)
+    return torch.quantization.fuse_modules(sequence, [[str(i) for i in range(len(modules))]])
+
+
+class _QuantizableBlock(nn.Module):
+    """ A BasicBlock or Bottleneck with fused convolutions and a quantizable
+    residual add.
+    """
+
+    def __init__(self, block):
+        super(_QuantizableBlock, self).__init__()
+        convs = [name for name in ('conv1', 'conv2', 'conv3') if hasattr(block, name)]
+        # every conv but the last is followed by a relu
+        self.body = nn.Sequential(*[
+            _fuse(getattr(block, name), getattr(block, 'bn' + name[-1]), nn.ReLU())
+            if name != convs[-1] else
+            _fuse(getattr(block, name), getattr(block, 'bn' + name[-1]))
+            for name in convs])
+        self.downsample = None
+        if block.downsample is not None:
+            self.downsample = _fuse(*block.downsample)
+        self.skip_add = nn.quantized.FloatFunctional()
+
+    def forward(self, x):
+        residual = x if self.downsample is None else self.downsample(x)
+        return self.skip_add.add_relu(self.body(x), residual)
+
+
+def _fuse_head(head):
+    return nn.Sequential(
+        _fuse(head.conv1, head.act1),
+        _fuse(head.conv2, head.act2),
+        _fuse(head.conv3, head.act3),
+        _fuse(head.conv4, head.act4),
+        head.output)
+
+
+class QuantizedTrunk(nn.Module):
+    """ conv1 to layer2 and both head conv stacks of a ResNet, between a
+    quantize and a dequantize stub. Returns the (regression, classification)
+    outputs of `RegressionModel` and `ClassificationModel`, in float32.
+    Fused heads (see `ResNet.fuse_heads`) stay fused.
+    """
+
+    def __init__(self, model):
+        super(QuantizedTrunk, self).__init__()
+
+        self.quant = torch.quantization.QuantStub()
+        self.stem = nn.Sequential(_fuse(model.conv1, model.bn1, nn.ReLU()), model.maxpool)
+        self.layer1 = nn.Sequential(*[_QuantizableBlock(block) for block in model.layer1])
+        self.layer2 = nn.Sequential(*[_QuantizableBlock(block) for block in model.layer2])
+        self.fused_outputs = None
+        if model.fused_heads:
+            self.fused_outputs = (model.heads.num_anchors, model.heads.num_classes,
+                                  model.heads.padded_outputs)
+            self.heads = _fuse_head(model.heads)
+        else:
+            self.num_classes = model.classificationModel.num_classes
+            self.regression = _fuse_head(model.regressionModel)
+            self.classification = _fuse_head(model.classificationModel)
+        self.dequant = torch.quantization.DeQuantStub()
+
+    def forward(self, img_batch):
+        x = self.quant(img_batch)
+        x = self.layer2(self.layer1(self.stem(x)))
+
+        if self.fused_outputs is not None:
+            return split_fused_output(self.dequant(self.heads(x)), *self.fused_outputs)
+
+        regression = self.dequant(self.regression(x))
+        classification = self.dequant(self.classification(x))
+
+        # B x C x H x W to the (B, H * W * num_anchors, ...) layout of the heads
+        batch_size = img_batch.shape[0]
+        regression = regression.permute(0, 2, 3, 1).reshape(batch_size, -1, NUM_VARIABLES)
+        classification = classification.permute(0, 2, 3, 1).reshape(batch_size, -1, self.num_classes)
+        return regression, classification
+
+
+def calibration_batches(dataset, num_images=100, batch_size=1, seed=0):
+    """ Padded image batches of a random sample of `num_images` images of
+    `dataset`, as `collater` builds them.
+    """
+    indices = list(range(len(dataset)))
+    random.Random(seed).shuffle(indices)
+    indices = indices[:num_images]
+    for start in range(0, len(indices), batch_size):
+        yield collater([dataset[index] for index in indices[start:start + batch_size]])['img'].float()
+
+
+def quantize(model, calibration_images, backend='fbgemm'):
+    """ An int8 copy of a trained ResNet; `model` is left untouched.
+
+    Args
+        model             : A ResNet, optionally wrapped in DataParallel.
+        calibration_images: Iterable of (B, 3, H, W) float image batches
+                            the activation ranges are observed on, e.g.
+                            `calibration_batches(dataset)`.
+        backend           : Quantized engine, 'fbgemm' (x86) or 'qnnpack'
+                            (ARM).
+    Returns
+        The quantized ResNet, on the CPU and in eval mode.
+    """
+    if backend not in torch.backends.quantized.supported_engines:
+        raise ValueError('quantized engine {} is not supported by this build of torch'.format(backend))
+    torch.backends.quantized.engine = backend
+
+    model = copy.deepcopy(getattr(model, 'module', model)).cpu()
+    model.training = False
+    model.eval()
+    model.bfloat16 = False
+
+    trunk = QuantizedTrunk(model)
+    trunk.eval()
+    trunk.qconfig = torch.quantization.get_default_qconfig(backend)
+    torch.quantization.prepare(trunk, inplace=True)
+
+    with torch.no_grad():
+        for img_batch in calibration_images:
+            trunk(img_batch.cpu())
+
+    torch.quantization.convert(trunk, inplace=True)
+
+    for name in _FLOAT_MODULES:
+        if hasattr(model, name):
+            delattr(model, name)
+    model.quantized_trunk = trunk
+    model.quantized = True
+    return model
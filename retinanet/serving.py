@@ -0,0 +1,187 @@
+""" Local HTTP inference server with dynamic micro-batching.
+
+Handler threads decode the posted image bytes and submit them to a
+`MicroBatcher`. One worker thread groups pending requests with the same
+padded size into batches of up to `max_batch_size`. A batch runs as soon
+as it is full or once its oldest request has waited `max_wait` seconds.
+The server only binds to loopback addresses.
+
+    POST /detect    body: encoded image (jpg, png, ...), returns JSON detections
+    GET  /health
+"""
+import collections
+import ipaddress
+import json
+import queue
+import socket
+import threading
+import time
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import cv2
+import numpy as np
+import torch
+
+from .device import DeviceContext
+from .streaming import preprocess
+
+_Request = collections.namedtuple('_Request', ['key', 'image', 'arrived', 'future'])
+
+
+def padded_size(image):
+    """ (rows, cols) of `image` padded to a multiple of 32, its batch key. """
+    rows, cols = image.shape[:2]
+    return (rows + 31) // 32 * 32, (cols + 31) // 32 * 32
+
+
+class MicroBatcher(object):
+    """ Groups concurrent single-image requests into batches.
+
+    Args
+        model         : A ResNet in eval mode, on `device`.
+        max_batch_size: Maximum images per forward pass.
+        max_wait      : Seconds the oldest pending request may wait for a
+                        batch to fill up.
+        device        : Device the model runs on.
+    """
+
+    def __init__(self, model, max_batch_size=8, max_wait=0.01, device=None):
+        self.model = model
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.device = DeviceContext.of(model).device if device is None else torch.device(device)
+
+        self.batch_sizes = collections.Counter()
+        self._requests = queue.Queue()
+        self._pending = []
+        self._worker = threading.Thread(target=self._run, name='micro-batcher', daemon=True)
+        self._worker.start()
+
+    def submit(self, image):
+        """ Future of the [scores, labels, points] numpy detections of a BGR
+        uint8 image.
+        """
+        future = Future()
+        self._requests.put(_Request(padded_size(image), image, time.perf_counter(), future))
+        return future
+
+    def close(self):
+        self._requests.put(None)
+        self._worker.join()
+
+    def _next_batch(self):
+        """ Requests of the next batch, [] once closed. """
+        if not self._pending:
+            request = self._requests.get()
+            if request is None:
+                return []
+            self._pending.append(request)
+
+        key = self._pending[0].key
+        deadline = self._pending[0].arrived + self.max_wait
+        matching = sum(request.key == key for request in self._pending)
+        while matching < self.max_batch_size:
+            timeout = deadline - time.perf_counter()
+            if timeout <= 0:
+                break
+            try:
+                request = self._requests.get(timeout=timeout)
+            except queue.Empty:
+                break
+            if request is None:
+                # serve what is pending, then stop
+                self._requests.put(None)
+                break
+            self._pending.append(request)
+            matching += request.key == key
+
+        batch = [request for request in self._pending if request.key == key][:self.max_batch_size]
+        batched = set(map(id, batch))
+        self._pending = [request for request in self._pending if id(request) not in batched]
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if not batch:
+                break
+            batch = [request for request in batch if request.future.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            self.batch_sizes[len(batch)] += 1
+            try:
+                img_batch, sizes = preprocess([request.image for request in batch], self.device)
+                with torch.no_grad():
+                    detections = self.model((img_batch, sizes))
+                for request, image_detections in zip(batch, detections):
+                    request.future.set_result([tensor.cpu().numpy() for tensor in image_detections])
+            except Exception as error:
+                for request in batch:
+                    if not request.future.done():
+                        request.future.set_exception(error)
+
+
+class _Handler(BaseHTTPRequestHandler):
+
+    def _reply(self, status, body):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path != '/health':
+            return self._reply(404, {'error': 'unknown path {}'.format(self.path)})
+        self._reply(200, {'status': 'ok', 'batch_sizes': dict(self.server.batcher.batch_sizes)})
+
+    def do_POST(self):
+        if self.path != '/detect':
+            return self._reply(404, {'error': 'unknown path {}'.format(self.path)})
+        start = time.perf_counter()
+        length = int(self.headers.get('Content-Length', 0))
+        image = cv2.imdecode(np.frombuffer(self.rfile.read(length), dtype=np.uint8), cv2.IMREAD_COLOR)
+        if image is None:
+            return self._reply(400, {'error': 'the body is not an image'})
+
+        try:
+            scores, labels, points = self.server.batcher.submit(image).result()
+        except Exception as error:
+            return self._reply(500, {'error': str(error)})
+
+        keep = scores > self.server.score_threshold
+        class_names = self.server.class_names
+        self._reply(200, {
+            'detections': [{
+                'score': float(score),
+                'label': class_names.get(int(label), int(label)) if class_names else int(label),
+                'x': float(x), 'y': float(y), 'alpha': float(alpha),
+            } for score, label, (x, y, alpha) in zip(scores[keep], labels[keep], points[keep])],
+            'latency_ms': (time.perf_counter() - start) * 1000,
+        })
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            BaseHTTPRequestHandler.log_message(self, format, *args)
+
+
+class InferenceServer(ThreadingHTTPServer):
+    """ Serves a `MicroBatcher` over HTTP on a loopback address.
+
+    class_names optionally maps label ids to the names returned in the
+    detections.
+    """
+    daemon_threads = True
+
+    def __init__(self, batcher, host='127.0.0.1', port=8080, score_threshold=0.05, class_names=None,
+                 verbose=False):
+        address = ipaddress.ip_address(socket.gethostbyname(host))
+        if not address.is_loopback:
+            raise ValueError('the inference server only binds to loopback addresses, not {}'.format(host))
+        self.batcher = batcher
+        self.score_threshold = score_threshold
+        self.class_names = class_names
+        self.verbose = verbose
+        ThreadingHTTPServer.__init__(self, (str(address), port), _Handler)
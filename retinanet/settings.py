@@ -3,4 +3,5 @@ ANGLE_SPLIT = 16
 STRIDE = 8
 MAX_ANOT_ANCHOR_POSITION_DISTANCE = 8
 MAX_ANOT_ANCHOR_ANGLE_DISTANCE = (360.0/ANGLE_SPLIT) / 1.8
+POSITION_WEIGHT = 10
 X, Y, ALPHA, LABEL, SCORE, TRUTH = 0, 1, 2, 3, 4, 5
@@ -0,0 +1,308 @@
+""" Streaming inference over `cv2.VideoCapture` sources (video files or
+camera indices).
+
+Three stages run concurrently:
+
+    decode thread -> frame queue -> inference (batches) -> result queue -> writer thread
+
+The frame queue is bounded. When inference falls behind, the decode thread
+either drops the oldest queued frame (live sources) or waits (files, with
+drop_frames=False). Every stage records its throughput and latency, see
+`VideoPipeline.report`.
+"""
+import collections
+import queue
+import threading
+import time
+
+import cv2
+import numpy as np
+import torch
+
+from .device import DeviceContext
+from .utils import normalize_batch
+
+# latencies kept per stage for the percentiles
+LATENCY_WINDOW = 1000
+
+_END = object()
+
+Frame = collections.namedtuple('Frame', ['index', 'captured', 'image'])
+
+
+class StageStats(object):
+    """ Frames, busy time and per-frame latency of one pipeline stage. """
+
+    def __init__(self, name):
+        self.name = name
+        self.frames = 0
+        self.busy = 0.0
+        self.first = None
+        self.last = None
+        self.latencies = collections.deque(maxlen=LATENCY_WINDOW)
+
+    def record(self, start, stop, latencies):
+        if self.first is None:
+            self.first = start
+        self.last = stop
+        self.frames += len(latencies)
+        self.busy += stop - start
+        self.latencies.extend(latencies)
+
+    def summary(self):
+        elapsed = (self.last - self.first) if self.frames else 0.0
+        latencies = np.array(self.latencies) * 1000
+        return {
+            'frames': self.frames,
+            'fps': self.frames / elapsed if elapsed > 0 else float('nan'),
+            'busy_fps': self.frames / self.busy if self.busy > 0 else float('nan'),
+            'latency_ms': float(latencies.mean()) if latencies.size else float('nan'),
+            'latency_p95_ms': float(np.percentile(latencies, 95)) if latencies.size else float('nan'),
+        }
+
+
+def preprocess(images, device):
+    """ A padded, normalized (B, 3, H, W) float batch and the (B, 2) sizes
+    from BGR uint8 images, converted on `device`. Images may differ in size;
+    the batch is padded to the largest one, rounded up to a multiple of 32.
+    """
+    sizes = [image.shape[:2] for image in images]
+    rows = max(size[0] for size in sizes)
+    cols = max(size[1] for size in sizes)
+
+    img_batch = torch.zeros((len(images), 3, (rows + 31) // 32 * 32, (cols + 31) // 32 * 32),
+                            dtype=torch.uint8, device=device)
+    for i, image in enumerate(images):
+        # BGR -> RGB, HWC -> CHW
+        img_batch[i, :, :image.shape[0], :image.shape[1]] = \
+            torch.from_numpy(image).to(device).flip(2).permute(2, 0, 1)
+
+    sizes = torch.tensor(sizes, device=device)
+    return normalize_batch(img_batch, sizes), sizes
+
+
+class VideoWriterSink(object):
+    """ Writes frames with their detections drawn on them to a video file. """
+
+    def __init__(self, path, fps=25.0, fourcc='mp4v'):
+        self.path = path
+        self.fps = fps
+        self.fourcc = cv2.VideoWriter_fourcc(*fourcc)
+        self.writer = None
+
+    def __call__(self, index, image, scores, labels, points):
+        if self.writer is None:
+            rows, cols = image.shape[:2]
+            self.writer = cv2.VideoWriter(self.path, self.fourcc, self.fps, (cols, rows))
+        for x, y, alpha in points.tolist():
+            center = (int(x), int(y))
+            end = (int(x + 10 * np.cos(np.radians(alpha))), int(y + 10 * np.sin(np.radians(alpha))))
+            cv2.circle(image, center, 5, color=(0, 0, 255), thickness=-1)
+            cv2.line(image, center, end, color=(0, 0, 255), thickness=2)
+        self.writer.write(image)
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.release()
+
+
+class VideoPipeline(object):
+    """ Runs a ResNet over a video stream.
+
+    Args
+        model          : A ResNet in eval mode, on `device`.
+        source         : Video file path or camera index.
+        batch_size     : Maximum frames per forward pass; batches take the
+                         frames that are queued, they never wait to fill up.
+        queue_size     : Capacity of the frame and result queues.
+        drop_frames    : Drop the oldest queued frame instead of waiting
+                         when inference falls behind.
+        sink           : Optional callable(index, image, scores, labels,
+                         points) run on the writer thread for every frame,
+                         with numpy detections above score_threshold.
+        score_threshold: Minimum score of the detections passed to sink.
+        max_frames     : Optional number of frames to decode.
+        device         : Device the frames are converted on, the model's.
+    """
+
+    def __init__(self, model, source, batch_size=4, queue_size=8, drop_frames=True, sink=None,
+                 score_threshold=0.5, max_frames=None, device=None):
+        self.model = model
+        self.source = source
+        self.batch_size = batch_size
+        self.drop_frames = drop_frames
+        self.sink = sink
+        self.score_threshold = score_threshold
+        self.max_frames = max_frames
+        self.device = DeviceContext.of(model).device if device is None else torch.device(device)
+
+        self.frames = queue.Queue(maxsize=queue_size)
+        self.results = queue.Queue(maxsize=queue_size)
+        self.dropped = 0
+        self.stats = collections.OrderedDict(
+            (name, StageStats(name)) for name in ('decode', 'inference', 'write', 'end_to_end'))
+        self._stop = threading.Event()
+        self._errors = []
+
+    def _put(self, channel, item):
+        """ Blocking put that gives up once the pipeline stops. """
+        while not self._stop.is_set():
+            try:
+                channel.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _get(self, channel):
+        """ Blocking get that returns the end marker once the pipeline stops
+        and the queue is empty.
+        """
+        while True:
+            try:
+                return channel.get(timeout=0.1)
+            except queue.Empty:
+                if self._stop.is_set():
+                    return _END
+
+    def _put_dropping(self, frame):
+        """ Put that makes room by dropping the oldest queued frame. """
+        while True:
+            try:
+                self.frames.put_nowait(frame)
+                return
+            except queue.Full:
+                try:
+                    self.frames.get_nowait()
+                    self.dropped += 1
+                except queue.Empty:
+                    pass
+
+    def _decode(self):
+        capture = cv2.VideoCapture(self.source)
+        try:
+            if not capture.isOpened():
+                raise IOError('can not open video source {}'.format(self.source))
+            index = 0
+            while not self._stop.is_set() and (self.max_frames is None or index < self.max_frames):
+                start = time.perf_counter()
+                ok, image = capture.read()
+                if not ok:
+                    break
+                stop = time.perf_counter()
+                self.stats['decode'].record(start, stop, [stop - start])
+
+                frame = Frame(index, stop, image)
+                if self.drop_frames:
+                    self._put_dropping(frame)
+                elif not self._put(self.frames, frame):
+                    break
+                index += 1
+        except Exception as error:
+            self._errors.append(error)
+            self._stop.set()
+        finally:
+            capture.release()
+            self._put(self.frames, _END)
+
+    def _next_batch(self):
+        """ The queued frames, up to batch_size, waiting for the first one.
+        The second value tells whether the stream ended.
+        """
+        frame = self._get(self.frames)
+        if frame is _END:
+            return [], True
+        batch = [frame]
+        while len(batch) < self.batch_size:
+            try:
+                frame = self.frames.get_nowait()
+            except queue.Empty:
+                break
+            if frame is _END:
+                return batch, True
+            batch.append(frame)
+        return batch, False
+
+    def _infer(self):
+        ended = False
+        while not ended and not self._stop.is_set():
+            batch, ended = self._next_batch()
+            if not batch:
+                break
+
+            start = time.perf_counter()
+            img_batch, sizes = preprocess([frame.image for frame in batch], self.device)
+            with torch.no_grad():
+                detections = self.model((img_batch, sizes))
+            # the copy to the host waits for the device
+            detections = [[tensor.cpu() for tensor in image_detections] for image_detections in detections]
+            stop = time.perf_counter()
+            self.stats['inference'].record(start, stop, [stop - frame.captured for frame in batch])
+
+            if not self._put(self.results, (batch, detections)):
+                break
+
+    def _write(self):
+        try:
+            while True:
+                item = self._get(self.results)
+                if item is _END:
+                    break
+                batch, detections = item
+
+                start = time.perf_counter()
+                for frame, (scores, labels, points) in zip(batch, detections):
+                    keep = scores > self.score_threshold
+                    if self.sink is not None:
+                        self.sink(frame.index, frame.image,
+                                  scores[keep].numpy(), labels[keep].numpy(), points[keep].numpy())
+                stop = time.perf_counter()
+                self.stats['write'].record(start, stop, [(stop - start) / len(batch)] * len(batch))
+                self.stats['end_to_end'].record(
+                    batch[0].captured, stop, [stop - frame.captured for frame in batch])
+        except Exception as error:
+            self._errors.append(error)
+            self._stop.set()
+
+    def run(self):
+        """ Process the whole stream, or until interrupted, and return the
+        report.
+        """
+        decoder = threading.Thread(target=self._decode, name='decode', daemon=True)
+        writer = threading.Thread(target=self._write, name='write', daemon=True)
+        decoder.start()
+        writer.start()
+        try:
+            self._infer()
+        except BaseException:
+            self._stop.set()
+            raise
+        finally:
+            # the writer drains the results before it stops
+            self._put(self.results, _END)
+            self._stop.set()
+            decoder.join()
+            writer.join()
+
+        if self._errors:
+            raise self._errors[0]
+        return self.report()
+
+    def report(self):
+        report = collections.OrderedDict(
+            (name, stats.summary()) for name, stats in self.stats.items())
+        report['dropped'] = self.dropped
+        return report
+
+
+def format_report(report):
+    lines = ['{:<12} | {:>7} | {:>9} | {:>9} | {:>12} | {:>12}'.format(
+        'stage', 'frames', 'fps', 'busy fps', 'latency ms', 'p95 ms')]
+    for name, stage in report.items():
+        if name == 'dropped':
+            continue
+        lines.append('{:<12} | {:7d} | {:9.2f} | {:9.2f} | {:12.2f} | {:12.2f}'.format(
+            name, stage['frames'], stage['fps'], stage['busy_fps'],
+            stage['latency_ms'], stage['latency_p95_ms']))
+    lines.append('dropped frames: {}'.format(report['dropped']))
+    return '\n'.join(lines)
@@ -0,0 +1,100 @@
+""" Tiled inference for images too large to run in one forward pass.
+
+The image is cut into overlapping `tile_size` x `tile_size` tiles that run
+through the model in batches of `batch_size`, so activation memory depends
+on the tile size and batch size, not on the image size. Detections are
+mapped back to image coordinates. A tile only keeps the detections of its
+core, the tile minus half the overlap on every side shared with another
+tile, and point NMS merges the duplicates left on the core borders.
+"""
+import torch
+
+from .nms import point_nms
+
+# tiles must be a multiple of the network's total stride
+TILE_MULTIPLE = 32
+
+
+def tile_origins(length, tile_size, overlap):
+    """ Start offsets of the tiles covering [0, length) along one axis; the
+    last tile ends at length when length is larger than a tile.
+    """
+    if tile_size <= overlap:
+        raise ValueError('tile_size must be larger than overlap')
+    if length <= tile_size:
+        return [0]
+    step = tile_size - overlap
+    origins = list(range(0, length - tile_size, step))
+    origins.append(length - tile_size)
+    return origins
+
+
+def _core(origin, origins, tile_size, overlap):
+    """ [start, stop) of the region a tile keeps detections in; unbounded
+    on the image borders.
+    """
+    start = float('-inf') if origin == origins[0] else origin + overlap // 2
+    stop = float('inf') if origin == origins[-1] else origin + tile_size - (overlap - overlap // 2)
+    return start, stop
+
+
+def tiled_detect(model, image, image_size=None, tile_size=512, overlap=64, batch_size=4, device=None):
+    """ Detections of a ResNet on a large image, computed tile by tile.
+
+    Args
+        model     : A ResNet in eval mode.
+        image     : (3, H, W) image tensor, of any dtype; only the tiles are
+                    converted to float32 and moved to `device`.
+        image_size: Optional (rows, cols) of the image inside a padded
+                    `image`; tiles that are only padding are skipped.
+        tile_size : Tile side, in pixels, a multiple of 32.
+        overlap   : Pixels shared by neighbouring tiles; should be larger
+                    than the objects to detect.
+        batch_size: Tiles per forward pass.
+        device    : Device the model runs on, the image's by default.
+    Returns
+        [scores, labels, points] of the whole image, sorted by decreasing
+        score, with points in image coordinates.
+    """
+    if tile_size % TILE_MULTIPLE:
+        raise ValueError('tile_size must be a multiple of {}'.format(TILE_MULTIPLE))
+    rows, cols = image.shape[1:] if image_size is None else (int(image_size[0]), int(image_size[1]))
+    device = image.device if device is None else device
+
+    row_origins = tile_origins(rows, tile_size, overlap)
+    col_origins = tile_origins(cols, tile_size, overlap)
+    tiles = [(y, x) for y in row_origins for x in col_origins]
+
+    scores, labels, points = [], [], []
+    for start in range(0, len(tiles), batch_size):
+        batch_tiles = tiles[start:start + batch_size]
+        tile_batch = torch.zeros((len(batch_tiles), 3, tile_size, tile_size), dtype=torch.float32, device=device)
+        sizes = []
+        for i, (y, x) in enumerate(batch_tiles):
+            crop = image[:, y:min(y + tile_size, rows), x:min(x + tile_size, cols)]
+            tile_batch[i, :, :crop.shape[1], :crop.shape[2]] = crop.to(device=device, dtype=torch.float32)
+            sizes.append(list(crop.shape[1:]))
+
+        with torch.no_grad():
+            detections = model((tile_batch, torch.tensor(sizes, device=device)))
+
+        for (y, x), (tile_scores, tile_labels, tile_points) in zip(batch_tiles, detections):
+            tile_points = tile_points + torch.tensor([x, y, 0], dtype=tile_points.dtype, device=tile_points.device)
+            x_start, x_stop = _core(x, col_origins, tile_size, overlap)
+            y_start, y_stop = _core(y, row_origins, tile_size, overlap)
+            keep = (tile_points[:, 0] >= x_start) & (tile_points[:, 0] < x_stop) & \
+                (tile_points[:, 1] >= y_start) & (tile_points[:, 1] < y_stop)
+            scores.append(tile_scores[keep])
+            labels.append(tile_labels[keep])
+            points.append(tile_points[keep])
+
+    scores, labels, points = torch.cat(scores), torch.cat(labels), torch.cat(points)
+
+    if model.nms_radius:
+        order = point_nms(points, scores, groups=labels,
+                          radius=model.nms_radius, angle_threshold=model.nms_angle_threshold)
+    else:
+        order = torch.argsort(scores, descending=True)
+    if model.max_detections is not None:
+        order = order[:model.max_detections]
+    return [scores[order], labels[order], points[order]]
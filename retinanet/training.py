@@ -0,0 +1,88 @@
+""" Training step and loss logging that do not synchronize with the device.
+
+Reading a loss on the host (`float(loss)`, `bool(loss == 0)`) waits for
+the device to finish every queued kernel. `train_step` never reads its
+losses back; `LossLog` keeps them on the device and reads a whole interval
+of them back in a single transfer.
+"""
+import collections
+
+import numpy as np
+import torch
+
+
+def train_step(model, optimizer, inputs, max_grad_norm=0.1, skip_zero_loss=False):
+    """ One optimization step.
+
+    Batches without any positive or kept anchor have a zero loss and zero
+    gradients. By default they are not skipped, since that would need the
+    loss on the host: the optimizer still steps, and Adam's momentum still
+    moves the weights. skip_zero_loss skips them, as training did before,
+    at the cost of one synchronization per step.
+
+    Returns
+        The detached (classification_loss, regression_loss), still on the
+        device.
+    """
+    optimizer.zero_grad()
+
+    classification_loss, regression_loss = model(inputs)
+    classification_loss = classification_loss.mean()
+    regression_loss = regression_loss.mean()
+
+    loss = classification_loss + regression_loss
+    if skip_zero_loss and bool(loss == 0):
+        return classification_loss.detach(), regression_loss.detach()
+
+    loss.backward()
+    torch.nn.utils.clip_grad_norm_(model.parameters(), max_grad_norm)
+    optimizer.step()
+
+    return classification_loss.detach(), regression_loss.detach()
+
+
+class LossLog(object):
+    """ Buffers the losses of every step and reads them back, and prints
+    them, every `interval` steps.
+
+    Zero losses (batches without positive or kept anchors) are left out of
+    the running and epoch means, as before.
+    """
+
+    def __init__(self, interval=20, history=500):
+        self.interval = interval
+        self.history = collections.deque(maxlen=history)
+        self.epoch_losses = []
+        self._pending = []
+
+    def append(self, epoch_num, iter_num, classification_loss, regression_loss):
+        self._pending.append((epoch_num, iter_num, torch.stack([classification_loss, regression_loss])))
+        if len(self._pending) >= self.interval:
+            self.flush()
+
+    def flush(self):
+        if not self._pending:
+            return
+        # one transfer for the whole interval
+        values = torch.stack([losses for _, _, losses in self._pending]).tolist()
+        epoch_num, iter_num = self._pending[-1][:2]
+        self._pending = []
+
+        for classification_loss, regression_loss in values:
+            loss = classification_loss + regression_loss
+            if loss != 0:
+                self.history.append(loss)
+                self.epoch_losses.append(loss)
+
+        classification_loss, regression_loss = values[-1]
+        print(
+            'Epoch: {} | Iteration: {} | Classification loss: {:1.5f} | Regression loss: {:1.5f} | Running loss: {:1.5f}'.format(
+                epoch_num, iter_num, classification_loss, regression_loss,
+                np.mean(self.history) if self.history else float('nan')))
+
+    def end_epoch(self):
+        """ Mean loss of the epoch; starts the next one. """
+        self.flush()
+        mean = np.mean(self.epoch_losses) if self.epoch_losses else float('nan')
+        self.epoch_losses = []
+        return mean
@@ -1,6 +1,27 @@
 import torch
 import torch.nn as nn
-import numpy as np
+
+
+# `Normalizer` statistics, for RGB images in [0, 1]
+IMAGE_MEAN = (0.485, 0.456, 0.406)
+IMAGE_STD = (0.229, 0.224, 0.225)
+
+
+def normalize_batch(img_batch, sizes=None):
+    """ Normalize a (B, 3, H, W) uint8 batch as `Normalizer` does its images.
+
+    Padding beyond the (B, 2) `sizes` (rows, cols) stays 0, as when padding
+    normalized images.
+    """
+    mean = torch.tensor(IMAGE_MEAN, device=img_batch.device).view(1, 3, 1, 1)
+    std = torch.tensor(IMAGE_STD, device=img_batch.device).view(1, 3, 1, 1)
+    img_batch = (img_batch.float() / 255 - mean) / std
+
+    if sizes is not None:
+        rows = torch.arange(img_batch.shape[2], device=img_batch.device) < sizes[:, :1]
+        cols = torch.arange(img_batch.shape[3], device=img_batch.device) < sizes[:, 1:]
+        img_batch.masked_fill_(~(rows[:, None, :, None] & cols[:, None, None, :]), 0)
+    return img_batch
 
 
 def conv3x3(in_planes, out_planes, stride=1):
@@ -84,25 +105,18 @@ class BBoxTransform(nn.Module):
 
     def __init__(self, mean=None, std=None):
         super(BBoxTransform, self).__init__()
-        if mean is None:
-            if torch.cuda.is_available():
-                self.mean = torch.from_numpy(
-                    np.array([0, 0, 0]).astype(np.float32)).cuda()
-            else:
-                self.mean = torch.from_numpy(
-                    np.array([0, 0, 0]).astype(np.float32))
-
-        else:
-            self.mean = mean
-        if std is None:
-            if torch.cuda.is_available():
-                self.std = torch.from_numpy(
-                    np.array([1, 1, 1]).astype(np.float32)).cuda()
-            else:
-                self.std = torch.from_numpy(
-                    np.array([1, 1, 1]).astype(np.float32))
-        else:
-            self.std = std
+        # buffers follow the model to its device; not saved in state dicts
+        self.register_buffer('mean', torch.as_tensor(
+            [0, 0, 0] if mean is None else mean, dtype=torch.float32), persistent=False)
+        self.register_buffer('std', torch.as_tensor(
+            [1, 1, 1] if std is None else std, dtype=torch.float32), persistent=False)
+
+    def __setstate__(self, state):
+        super(BBoxTransform, self).__setstate__(state)
+        # models pickled when mean and std were plain attributes
+        for name in ('mean', 'std'):
+            if name in self.__dict__:
+                self.register_buffer(name, self.__dict__.pop(name), persistent=False)
 
     def forward(self, center_alphas, deltas):
 
@@ -123,6 +137,8 @@ class BBoxTransform(nn.Module):
         return pred_boxes
 
 
+# unused, `postprocess.clip_to_sizes` clips the detections; kept so that
+# models pickled with a clipBoxes module still load
 class ClipBoxes(nn.Module):
 
     def __init__(self, width=None, height=None):
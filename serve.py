@@ -0,0 +1,53 @@
+import argparse
+import csv
+
+import torch
+
+from retinanet.device import DeviceContext
+from retinanet.serving import InferenceServer, MicroBatcher
+
+
+def load_class_names(class_list):
+    with open(class_list, 'r') as f:
+        return {int(class_id): class_name for class_name, class_id in csv.reader(f, delimiter=',')}
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description='Serve a trained RetinaNet network on localhost.')
+
+    parser.add_argument('--model_path', help='Path to model', type=str)
+    parser.add_argument('--class_list', help='Optional CSV file listing class names (see README)', type=str)
+    parser.add_argument('--host', help='Loopback address to bind', type=str, default='127.0.0.1')
+    parser.add_argument('--port', help='Port to listen on', type=int, default=8080)
+    parser.add_argument('--max_batch_size', help='Maximum images per forward pass', type=int, default=8)
+    parser.add_argument('--max_wait_ms', help='Milliseconds a request may wait for its batch to fill',
+                        type=float, default=10.0)
+    parser.add_argument('--score_threshold', help='Minimum score of the returned detections',
+                        type=float, default=0.05)
+    parser.add_argument('--verbose', help='Log every request', action='store_true')
+    parser = parser.parse_args(args)
+
+    model = torch.load(parser.model_path, map_location='cpu')
+    model = getattr(model, 'module', model)
+    # quantized models run on the CPU only
+    model = DeviceContext.for_model(model).place(model)
+    model.training = False
+    model.eval()
+
+    batcher = MicroBatcher(model, max_batch_size=parser.max_batch_size, max_wait=parser.max_wait_ms / 1000)
+    server = InferenceServer(batcher, host=parser.host, port=parser.port,
+                             score_threshold=parser.score_threshold,
+                             class_names=load_class_names(parser.class_list) if parser.class_list else None,
+                             verbose=parser.verbose)
+    print('Serving on http://{}:{}/detect'.format(*server.server_address))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        batcher.close()
+
+
+if __name__ == '__main__':
+    main()
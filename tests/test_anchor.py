@@ -1,6 +1,8 @@
 import unittest
 import numpy as np
-from retinanet.anchor_utils import generate_anchors
+import torch
+from retinanet.anchor_utils import generate_anchors, anchors_for_shape
+from retinanet.anchors import Anchors
 
 class TestAnchor(unittest.TestCase):
     """ Test Anchor's functions functionality
@@ -25,6 +27,27 @@ class TestAnchor(unittest.TestCase):
         self.assertEqual(np.sum(result_anchors[:, :-1]), np.sum(anchors[:, :-1]))
         self.assertTrue(np.all(result_anchors[:, -1] == anchors[:, -1]))
 
+    def test_anchors_cache(self):
+        """ test that cached torch anchors match the numpy grid and are reused
+        """
+        anchors_module = Anchors(cache_size=2)
+        image = torch.zeros((1, 3, 64, 96))
+
+        anchors = anchors_module(image)
+        expected = anchors_for_shape(
+            (64, 96), angle_split=16, num_variables=3, stride=8)
+
+        self.assertEqual(anchors.shape, (1,) + expected.shape)
+        self.assertTrue(np.all(anchors[0].numpy() == expected.astype(np.float32)))
+
+        self.assertIs(anchors_module(image), anchors)
+        self.assertEqual(anchors_module.cache.hits, 1)
+        self.assertEqual(anchors_module.cache.misses, 1)
+
+        anchors_module(torch.zeros((1, 3, 32, 32)))
+        anchors_module(torch.zeros((1, 3, 32, 64)))
+        self.assertEqual(len(anchors_module.cache), 2)
+
 
 if __name__ == '__main__':
     unittest.main()
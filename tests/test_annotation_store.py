@@ -0,0 +1,71 @@
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+from retinanet.annotation_store import AnnotationStore
+from retinanet.dataloader import CSVDataset
+
+
+class TestAnnotationStore(unittest.TestCase):
+    """ Test annotation_store's functions functionality
+    """
+
+    def test_append(self):
+        """ test that rows stay grouped by image, in order, across appends
+        """
+        store = AnnotationStore()
+        store.append(['a', 'b', 'c'], ['a', 'c', 'a'], [[1, 1, 1, 0], [3, 3, 3, 1], [2, 2, 2, 0]])
+        np.testing.assert_array_equal(store.offsets, [0, 2, 2, 3])
+        np.testing.assert_array_equal(store[0][:, 0], [1, 2])
+        self.assertEqual(store[1].shape, (0, 4))
+        self.assertEqual(store[1].dtype, np.float32)
+
+        # rows of the last and of a new image are appended
+        store.append(['d'], ['c', 'd'], [[4, 4, 4, 1], [5, 5, 5, 1]])
+        np.testing.assert_array_equal(store.values[:, 0], [1, 2, 3, 4, 5])
+
+        # rows of earlier images are merged in
+        store.append([], ['b', 'a'], [[6, 6, 6, 0], [7, 7, 7, 0]])
+        np.testing.assert_array_equal(store.values[:, 0], [1, 2, 7, 6, 3, 4, 5])
+        np.testing.assert_array_equal(store.num_annotations(), [3, 1, 2, 1])
+        self.assertEqual(store.names, ['a', 'b', 'c', 'd'])
+
+        # views are read-only and share the store's memory
+        with self.assertRaises(ValueError):
+            store[0][0, 0] = 0
+        self.assertTrue(np.shares_memory(store[2], store.values))
+
+    def test_csv_dataset(self):
+        """ test the parsing of the CSV file and of the rows appended to it
+        """
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        classes = os.path.join(directory, 'classes.csv')
+        annotations = os.path.join(directory, 'annotations.csv')
+        with open(classes, 'w') as file:
+            file.write('tree,0\nbush,1\n')
+        with open(annotations, 'w') as file:
+            file.write('img1,10,20,90,tree\nimg2,,,,\nimg1,30.7,40,180,bush\n')
+
+        dataset = CSVDataset(annotations, classes, directory)
+        self.assertEqual(len(dataset), 2)
+        np.testing.assert_array_equal(dataset.load_annotations(0), [[10, 20, 90, 0], [30, 40, 180, 1]])
+        self.assertEqual(dataset.load_annotations(1).shape, (0, 4))
+
+        with open(annotations, 'a') as file:
+            file.write('img2,5,6,7,tree\nimg3,1,2,3,bush\nimg3,4,5')
+        self.assertEqual(dataset.update_annotations(), 2)
+        self.assertEqual(dataset.image_names[2], os.path.join(directory, 'img3.jpg'))
+        np.testing.assert_array_equal(dataset.load_annotations(1), [[5, 6, 7, 0]])
+
+        # the incomplete row is read once it ends
+        with open(annotations, 'a') as file:
+            file.write(',6,bush\n')
+        self.assertEqual(dataset.update_annotations(), 1)
+        np.testing.assert_array_equal(dataset.load_annotations(2), [[1, 2, 3, 1], [4, 5, 6, 1]])
+
+        with open(annotations, 'a') as file:
+            file.write('img4,1,2,3,rock\n')
+        with self.assertRaisesRegex(ValueError, 'line 7: unknown class name'):
+            dataset.update_annotations()
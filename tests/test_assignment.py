@@ -0,0 +1,41 @@
+import unittest
+import numpy as np
+import torch
+from retinanet.anchor_utils import anchors_for_shape
+from retinanet.assignment import assign
+from retinanet.geometry import nearest
+
+
+class TestAssignment(unittest.TestCase):
+    """ Test assignment's functions functionality
+    """
+
+    def test_assign_matches_nearest(self):
+        """ test that spatial hash assignment is exact within max_distance
+        """
+        anchors = torch.from_numpy(anchors_for_shape(
+            (96, 128), angle_split=16, num_variables=3, stride=8).astype(np.float32))
+        rng = np.random.RandomState(0)
+        annotations = torch.from_numpy(np.stack([
+            rng.uniform(0, 128, (2, 40)),
+            rng.uniform(0, 96, (2, 40)),
+            rng.uniform(0, 360, (2, 40))], axis=2).astype(np.float32))
+        # duplicated points must resolve to the lowest index, like argmin
+        annotations[0, 5] = annotations[0, 2]
+        valid = torch.ones((2, 40), dtype=torch.bool)
+        valid[1, 20:] = False
+
+        expected_min, expected_argmin = nearest(
+            anchors, annotations, valid=valid, position_weight=10)
+        distance_min, distance_argmin = assign(
+            anchors, annotations, valid=valid, max_distance=104, position_weight=10)
+
+        close = expected_min < 104
+        self.assertTrue(close.any())
+        self.assertTrue(torch.equal(distance_min[close], expected_min[close]))
+        self.assertTrue(torch.equal(distance_argmin[close], expected_argmin[close]))
+        self.assertTrue(torch.all(distance_min[~close] >= 104))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,23 +1,44 @@
 import unittest
 import numpy as np
-from retinanet.csv_eval import compute_distance, __prepare as prepare
+import torch
+from retinanet.csv_eval import _get_detections, compute_distance
+from retinanet.settings import NUM_VARIABLES
+
+
+class ThresholdModel(object):
+    """ Returns sorted detections above its score_threshold """
+    score_threshold = 0.05
+    max_detections = None
+
+    def __init__(self):
+        self.seen = []
+
+    def eval(self):
+        pass
+
+    def set_inference_options(self, **options):
+        for name, value in options.items():
+            setattr(self, name, value)
+
+    def __call__(self, inputs):
+        img_batch, _ = inputs
+        self.seen.append((self.score_threshold, self.max_detections))
+        scores = torch.tensor([0.5, 0.02])
+        keep = scores > self.score_threshold
+        return [[scores[keep], torch.zeros(int(keep.sum()), dtype=torch.long), torch.zeros(int(keep.sum()), 3)]
+                for _ in range(img_batch.shape[0])]
+
+
+class OneClassDataset(list):
+
+    def num_classes(self):
+        return 1
 
 
 class TestCSVEval(unittest.TestCase):
     """ Test Anchor's functions functionality
     """
 
-    def test_prepare(self):
-        data = {
-            'a': np.array([2.1]),  # a: (N)
-            'b': np.array([1.1, 1.2, 1.3, 1.4])  # b: (k)
-        }
-
-        a, b = prepare(data['a'], data['b'])  # prepare: (N, k)
-        assert a.shape == b.shape
-        assert a.shape[0] == data['a'].shape[0]
-        assert a.shape[1] == data['b'].shape[0]
-
     def test_compute_distance(self):
         """ test compute distance
         """
@@ -37,3 +58,14 @@ class TestCSVEval(unittest.TestCase):
         assigned_annotation = np.argmin(dangles, axis=1)
         min_dangel = dangles[0, assigned_annotation]
         assert assigned_annotation == [1]
+
+    def test_get_detections_options(self):
+        """ test that the evaluation thresholds are passed to the model and restored
+        """
+        model = ThresholdModel()
+        dataset = [{'img': torch.zeros(32, 32, 3), 'annot': torch.zeros(0, 4), 'scale': 1}] * 2
+        detections = _get_detections(OneClassDataset(dataset), model, score_threshold=0.01, max_detections=300)
+
+        self.assertEqual(model.seen, [(0.01, 300)])
+        self.assertEqual((model.score_threshold, model.max_detections), (0.05, None))
+        np.testing.assert_array_equal(detections[1][0][:, NUM_VARIABLES], [0.5, 0.02])
@@ -0,0 +1,92 @@
+import random
+import unittest
+import numpy as np
+import torch
+from retinanet.dataloader import BatchCollater, Normalizer, Resizer, SizeBucketSampler, collater
+from retinanet.device import DeviceContext
+
+
+class SizedImages(object):
+    """ Dataset of the sizes of blank images """
+
+    def __init__(self, sizes):
+        self.sizes = sizes
+
+    def __len__(self):
+        return len(self.sizes)
+
+    def __getitem__(self, idx):
+        return Resizer()({'img': np.zeros(self.sizes[idx] + (3,), dtype=np.uint8),
+                          'annot': np.zeros((0, 4), dtype=np.float32)})
+
+    def image_size(self, image_index):
+        return self.sizes[image_index]
+
+
+class TestDataloader(unittest.TestCase):
+    """ Test dataloader's functions functionality
+    """
+
+    def test_uint8_batches(self):
+        """ test that normalizing uint8 batches matches `Normalizer`
+        """
+        random = np.random.RandomState(0)
+        images = [random.randint(0, 256, shape, dtype=np.uint8) for shape in ((40, 70, 3), (50, 30, 3))]
+        annot = np.array([[10, 20, 30, 0]], dtype=np.float32)
+
+        float_batch = collater([Resizer()(Normalizer()({'img': image.astype(np.float32) / 255.0, 'annot': annot}))
+                                for image in images])
+        uint8_batch = collater([Resizer()({'img': image, 'annot': annot}) for image in images])
+        self.assertEqual(uint8_batch['img'].dtype, torch.uint8)
+        self.assertEqual(uint8_batch['img'].shape, float_batch['img'].shape)
+
+        img, annotations = DeviceContext('cpu').training_inputs(uint8_batch)
+        self.assertEqual(img.dtype, torch.float32)
+        torch.testing.assert_allclose(img, float_batch['img'], rtol=0, atol=1e-5)
+        torch.testing.assert_allclose(annotations, float_batch['annot'])
+
+    def test_resizer_padding(self):
+        """ test that images are padded to the next multiple of 32 only
+        """
+        for rows, padded in ((64, 64), (65, 96), (95, 96)):
+            sample = Resizer()({'img': np.zeros((rows, 32, 3), dtype=np.uint8),
+                                'annot': np.zeros((0, 4), dtype=np.float32)})
+            self.assertEqual(tuple(sample['img'].shape), (padded, 32, 3))
+            self.assertEqual(sample['size'], (rows, 32))
+
+    def test_size_buckets(self):
+        """ test that batches hold images of one bucket, padded to its shape
+        """
+        random.seed(0)
+        sizes = [(64, 64)] * 5 + [(60, 90)] * 3 + [(100, 64), (120, 200), (200, 200)]
+        dataset = SizedImages(sizes)
+        sampler = SizeBucketSampler(dataset, batch_size=2, drop_last=False, max_sizes=2)
+        self.assertLessEqual(len({rows for rows, _ in sampler.shapes}), 2)
+        self.assertLessEqual(len({cols for _, cols in sampler.shapes}), 2)
+
+        batches = list(sampler)
+        self.assertEqual(len(batches), len(sampler))
+        self.assertEqual(sorted(sum(batches, [])), list(range(len(sizes))))
+        for batch in batches:
+            shapes = {shape for shape, indices in sampler.buckets.items() if set(batch) <= set(indices)}
+            self.assertEqual(len(shapes), 1)
+            img = collater([dataset[i] for i in batch], shapes=sampler.shapes)['img']
+            self.assertEqual(tuple(img.shape[2:]), shapes.pop())
+        self.assertGreater(sampler.padding_waste, 0)
+        self.assertLess(sampler.padding_waste, 1)
+
+    def test_batch_buffers(self):
+        """ test that reused batch buffers give the batches of `collater`
+        """
+        random = np.random.RandomState(0)
+        collate = BatchCollater(shapes=[(64, 64)], ring_size=2)
+        for step, sizes in enumerate([((64, 64), (64, 64)), ((30, 40), (64, 20)), ((10, 10), (5, 60))] * 2):
+            data = [Resizer()({'img': random.randint(0, 256, size + (3,), dtype=np.uint8),
+                               'annot': np.ones((step % 3, 4), dtype=np.float32)}) for size in sizes]
+            expected, batch = collater(data, shapes=[(64, 64)]), collate(data)
+            self.assertTrue(batch['img'].is_contiguous())
+            self.assertTrue(batch['img'].is_shared())
+            torch.testing.assert_allclose(batch['img'], expected['img'])
+            torch.testing.assert_allclose(batch['annot'], expected['annot'])
+        # two image buffers, and two annotation buffers each grown once
+        self.assertEqual(collate.buffers.allocations, 6)
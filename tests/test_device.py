@@ -0,0 +1,84 @@
+import io
+import contextlib
+import unittest
+from unittest import mock
+import torch
+from retinanet import model
+from retinanet.device import DeviceContext
+from retinanet.training import LossLog, train_step
+
+
+class ScaledLoss(torch.nn.Module):
+    """ Losses of weight * inputs, zero for zero inputs """
+
+    def __init__(self):
+        super(ScaledLoss, self).__init__()
+        self.weight = torch.nn.Parameter(torch.ones(1))
+
+    def forward(self, inputs):
+        loss = (self.weight * inputs).sum()
+        return loss, loss
+
+
+class TestDevice(unittest.TestCase):
+    """ Test device's functions functionality
+    """
+
+    def test_default_device(self):
+        """ test that the context picks cuda only when it is available
+        """
+        with mock.patch('torch.cuda.is_available', return_value=True):
+            self.assertEqual(DeviceContext().device, torch.device('cuda'))
+            self.assertTrue(DeviceContext().is_cuda)
+        with mock.patch('torch.cuda.is_available', return_value=False):
+            self.assertEqual(DeviceContext().device, torch.device('cpu'))
+
+    def test_no_device_checks_in_hot_paths(self):
+        """ test that the model, loss and anchors never query cuda availability
+        """
+        torch.manual_seed(0)
+        context = DeviceContext('cpu')
+        annot = torch.tensor([[[20.0, 30.0, 45.0, 0.0], [-1.0, -1.0, -1.0, -1.0]],
+                              [[50.0, 10.0, 90.0, 1.0], [10.0, 10.0, 10.0, 1.0]]])
+        inputs = context.training_inputs({'img': torch.rand(2, 3, 64, 96), 'annot': annot})
+
+        with mock.patch('torch.cuda.is_available', side_effect=AssertionError('device check in a hot path')):
+            retinanet = context.place(model.resnet50(num_classes=2))
+            self.assertEqual(DeviceContext.of(retinanet).device, torch.device('cpu'))
+
+            retinanet.train()
+            retinanet.freeze_bn()
+            optimizer = torch.optim.Adam(retinanet.parameters(), lr=1e-5)
+            classification_loss, regression_loss = train_step(retinanet, optimizer, inputs)
+            self.assertFalse(classification_loss.requires_grad)
+
+            retinanet.eval()
+            with torch.no_grad():
+                detections = retinanet((inputs[0], torch.tensor([[64, 96], [40, 96]])))
+            self.assertEqual(len(detections), 2)
+            self.assertEqual(retinanet.regressBoxes.mean.device, torch.device('cpu'))
+
+    def test_loss_log_interval(self):
+        """ test that losses are read back once per interval, zero losses left out
+        """
+        log = LossLog(interval=3)
+        with contextlib.redirect_stdout(io.StringIO()) as output:
+            for i, loss in enumerate([1.0, 0.0, 2.0, 4.0]):
+                log.append(0, i, torch.tensor(loss), torch.tensor(loss))
+                self.assertEqual(len(output.getvalue().splitlines()), 1 if i >= 2 else 0)
+            self.assertEqual(list(log.history), [2.0, 4.0])
+            self.assertEqual(log.end_epoch(), 5.0)
+        self.assertEqual(list(log.history), [2.0, 4.0, 8.0])
+        self.assertEqual(log.epoch_losses, [])
+
+    def test_zero_loss_step(self):
+        """ test that zero-loss steps still move the weights, unless skipped
+        """
+        for skip_zero_loss, moved in ((False, True), (True, False)):
+            model = ScaledLoss()
+            optimizer = torch.optim.Adam(model.parameters(), lr=0.1)
+            train_step(model, optimizer, torch.ones(2))
+            before = model.weight.detach().clone()
+            losses = train_step(model, optimizer, torch.zeros(2), skip_zero_loss=skip_zero_loss)
+            self.assertEqual(float(losses[0]), 0)
+            self.assertEqual(not torch.equal(model.weight.detach(), before), moved)
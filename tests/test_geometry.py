@@ -0,0 +1,56 @@
+import unittest
+import numpy as np
+import torch
+from retinanet.geometry import nearest, pairwise_distance
+
+
+class TestGeometry(unittest.TestCase):
+    """ Test geometry's functions functionality
+    """
+
+    def setUp(self):
+        rng = np.random.RandomState(0)
+        self.a = rng.uniform(0, 100, (50, 3)).astype(np.float32)
+        self.b = rng.uniform(0, 100, (7, 3)).astype(np.float32)
+
+    def test_nearest_numpy(self):
+        """ test chunked nearest against the full distance matrix
+        """
+        dxy, dalpha = pairwise_distance(self.a, self.b)
+        distance = 10 * dxy + dalpha
+
+        distance_min, distance_argmin = nearest(
+            self.a, self.b, position_weight=10, memory_budget=1)
+
+        self.assertTrue(np.allclose(distance_min, distance.min(axis=1)))
+        self.assertTrue(np.all(distance_argmin == distance.argmin(axis=1)))
+
+    def test_nearest_torch_batched(self):
+        """ test that invalid annotations are never assigned
+        """
+        a = torch.from_numpy(self.a)
+        b = torch.from_numpy(self.b).unsqueeze(0).repeat(2, 1, 1)
+        valid = torch.ones((2, 7), dtype=torch.bool)
+        valid[1, 3:] = False
+        valid[1, :] = valid[1, :] & (torch.arange(7) != 1)
+
+        distance_min, distance_argmin = nearest(
+            a, b, valid=valid, position_weight=10, memory_budget=1024)
+
+        dxy, dalpha = pairwise_distance(a, torch.from_numpy(self.b))
+        distance = 10 * dxy + dalpha
+        expected_min, expected_argmin = torch.min(distance, dim=1)
+        self.assertTrue(torch.equal(distance_min[0], expected_min))
+        self.assertTrue(torch.equal(distance_argmin[0], expected_argmin))
+
+        distance[:, 1] = float('inf')
+        expected_min, _ = torch.min(distance[:, :3], dim=1)
+        self.assertTrue(torch.equal(distance_min[1], expected_min))
+        self.assertTrue(torch.all((distance_argmin[1] == 0) | (distance_argmin[1] == 2)))
+
+        distance_min, _ = nearest(a, b, valid=torch.zeros((2, 7), dtype=torch.bool))
+        self.assertTrue(torch.all(torch.isinf(distance_min)))
+
+
+if __name__ == '__main__':
+    unittest.main()
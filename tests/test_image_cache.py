@@ -0,0 +1,96 @@
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+from retinanet.image_cache import ImageCache, cached_image
+
+
+class RawImages(object):
+    """ Dataset of raw 2x3x3 uint8 images that counts its decodes """
+    image_cache = None
+
+    def __init__(self, paths):
+        self.paths = paths
+        self.decoded = 0
+
+    def __len__(self):
+        return len(self.paths)
+
+    def image_path(self, image_index):
+        return self.paths[image_index]
+
+    def decode_image(self, image_index):
+        self.decoded += 1
+        with open(self.paths[image_index], 'rb') as file:
+            return np.frombuffer(file.read(), dtype=np.uint8).reshape(2, 3, 3)
+
+
+class TestImageCache(unittest.TestCase):
+    """ Test image_cache's functions functionality
+    """
+
+    def test_build_and_invalidate(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        paths = [os.path.join(directory, '{}.raw'.format(i)) for i in range(3)]
+        for i, path in enumerate(paths):
+            with open(path, 'wb') as file:
+                file.write(bytes([i] * 18))
+
+        dataset = RawImages(paths)
+        dataset.image_cache = ImageCache.build(dataset, os.path.join(directory, 'cache'), verbose=False)
+        self.assertEqual(dataset.decoded, 3)
+
+        image = cached_image(dataset, 1)
+        self.assertEqual(dataset.decoded, 3)
+        np.testing.assert_array_equal(image, np.ones((2, 3, 3)))
+        self.assertFalse(image.flags.writeable)
+
+        # a changed file is decoded again, until the cache is rebuilt
+        with open(paths[2], 'wb') as file:
+            file.write(bytes([7] * 18))
+        os.utime(paths[2], ns=(0, 0))
+        np.testing.assert_array_equal(cached_image(dataset, 2), np.full((2, 3, 3), 7))
+        self.assertEqual(dataset.decoded, 4)
+
+        dataset.image_cache = ImageCache.build(dataset, os.path.join(directory, 'cache'), verbose=False)
+        self.assertEqual(dataset.decoded, 5)
+        # the changed image is appended, the others stay where they are
+        self.assertEqual(os.path.getsize(os.path.join(directory, 'cache.bin')), 4 * 18)
+        np.testing.assert_array_equal(cached_image(dataset, 2), np.full((2, 3, 3), 7))
+        np.testing.assert_array_equal(cached_image(dataset, 0), np.zeros((2, 3, 3)))
+        self.assertEqual(dataset.decoded, 5)
+
+        # nothing is written when every image is up to date
+        os.utime(os.path.join(directory, 'cache.json'), ns=(0, 0))
+        os.utime(os.path.join(directory, 'cache.bin'), ns=(0, 0))
+        ImageCache.build(dataset, os.path.join(directory, 'cache'), verbose=False)
+        self.assertEqual(dataset.decoded, 5)
+        self.assertEqual(os.stat(os.path.join(directory, 'cache.json')).st_mtime_ns, 0)
+        self.assertEqual(os.stat(os.path.join(directory, 'cache.bin')).st_mtime_ns, 0)
+
+    def test_compaction(self):
+        """ test that a mostly unused data file is rewritten with the used images only
+        """
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        paths = [os.path.join(directory, '{}.raw'.format(i)) for i in range(2)]
+        for i, path in enumerate(paths):
+            with open(path, 'wb') as file:
+                file.write(bytes([i] * 18))
+        cache = os.path.join(directory, 'cache')
+        dataset = RawImages(paths)
+        ImageCache.build(dataset, cache, verbose=False)
+
+        # one changed image out of two: half of the file would be unused
+        with open(paths[0], 'wb') as file:
+            file.write(bytes([9] * 18))
+        os.utime(paths[0], ns=(0, 0))
+        dataset.image_cache = ImageCache.build(dataset, cache, verbose=False, max_garbage=0.25)
+        self.assertEqual(dataset.decoded, 3)
+        self.assertEqual(os.path.getsize(cache + '.bin'), 2 * 18)
+        self.assertFalse(os.path.exists(cache + '.bin.tmp'))
+        np.testing.assert_array_equal(cached_image(dataset, 0), np.full((2, 3, 3), 9))
+        np.testing.assert_array_equal(cached_image(dataset, 1), np.ones((2, 3, 3)))
+        self.assertEqual(dataset.decoded, 3)
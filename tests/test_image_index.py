@@ -0,0 +1,43 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from PIL import Image
+from retinanet.image_index import ImageIndex
+
+
+class TestImageIndex(unittest.TestCase):
+    """ Test image_index's functions functionality
+    """
+
+    def test_build_and_revalidate(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        paths = [os.path.join(directory, '{}.png'.format(i)) for i in range(3)]
+        for i, path in enumerate(paths):
+            Image.new('RGB', (10 + i, 20)).save(path)
+        index_path = os.path.join(directory, 'annotations.csv.images.json')
+
+        index = ImageIndex.build(index_path, paths, [1, 0, 2], workers=2)
+        self.assertEqual(index.read, 3)
+        self.assertEqual(index.size(paths[2]), (20, 12))
+        with open(index_path) as file:
+            self.assertEqual(json.load(file)['images'][paths[0]][4], 1)
+
+        # only changed files are read again
+        Image.new('RGB', (30, 40)).save(paths[1])
+        os.utime(paths[1], ns=(0, 0))
+        index = ImageIndex.build(index_path, paths, workers=2)
+        self.assertEqual(index.read, 1)
+        self.assertEqual(index.size(paths[1]), (40, 30))
+        self.assertEqual(ImageIndex.load(index_path).size(paths[1]), (40, 30))
+        # annotation counts are kept when none are given
+        self.assertEqual([index.images[path][4] for path in paths], [1, 0, 2])
+
+        index = ImageIndex.build(index_path, paths[:2], workers=2)
+        self.assertEqual(index.read, 0)
+
+        # images read on demand are not indexed
+        self.assertEqual(index.size(paths[2]), (20, 12))
+        self.assertNotIn(paths[2], index)
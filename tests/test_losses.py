@@ -0,0 +1,79 @@
+import unittest
+import torch
+from retinanet.anchors import Anchors
+from retinanet.losses import FocalLoss, calc_distance
+from retinanet.settings import MAX_ANOT_ANCHOR_POSITION_DISTANCE, NUM_VARIABLES
+
+
+def per_image_focal_loss(classifications, regressions, anchors, annotations, alpha=0.25, gamma=2.0):
+    """ The loss computed one image at a time, on probabilities, as before
+    it was batched.
+    """
+    anchor = anchors[0, :, :]
+    classification_losses, regression_losses = [], []
+    for j in range(classifications.shape[0]):
+        classification = torch.clamp(torch.sigmoid(classifications[j]), 1e-4, 1.0 - 1e-4)
+        regression = regressions[j]
+        annotation = annotations[j][annotations[j, :, NUM_VARIABLES] != -1]
+
+        if annotation.shape[0] == 0:
+            focal_weight = (1. - alpha) * torch.pow(classification, gamma)
+            classification_losses.append((focal_weight * -torch.log(1.0 - classification)).sum())
+            regression_losses.append(torch.tensor(0.))
+            continue
+
+        distance_min, distance_argmin = torch.min(calc_distance(anchor, annotation[:, :NUM_VARIABLES]), dim=1)
+        targets = torch.ones(classification.shape) * -1
+        targets[distance_min >= 13 * MAX_ANOT_ANCHOR_POSITION_DISTANCE, :] = 0
+        positive_indices = distance_min <= 11 * MAX_ANOT_ANCHOR_POSITION_DISTANCE
+        num_positive_anchors = positive_indices.sum()
+        assigned_annotations = annotation[distance_argmin, :]
+        targets[positive_indices, :] = 0
+        targets[positive_indices, assigned_annotations[positive_indices, NUM_VARIABLES].long()] = 1
+
+        alpha_factor = torch.where(targets == 1., torch.tensor(alpha), torch.tensor(1. - alpha))
+        focal_weight = alpha_factor * torch.pow(
+            torch.where(targets == 1., 1. - classification, classification), gamma)
+        bce = -(targets * torch.log(classification) + (1.0 - targets) * torch.log(1.0 - classification))
+        cls_loss = torch.where(targets != -1., focal_weight * bce, torch.zeros(bce.shape))
+        classification_losses.append(cls_loss.sum() / torch.clamp(num_positive_anchors.float(), min=1.0))
+
+        if num_positive_anchors == 0:
+            regression_losses.append(torch.tensor(0.))
+            continue
+        targets = assigned_annotations[positive_indices, :NUM_VARIABLES] - anchor[positive_indices]
+        diff_xy = torch.abs(targets[:, :2] - regression[positive_indices, :2])
+        diff_angle = 1 - torch.cos(targets[:, 2] - regression[positive_indices, 2])
+        loss_xy = torch.where(diff_xy <= 1.0 / 9.0, 0.5 * 9.0 * diff_xy ** 2, diff_xy - 0.5 / 9.0)
+        regression_losses.append(loss_xy.mean() + diff_angle.mean())
+
+    return (torch.stack(classification_losses).mean(dim=0, keepdim=True),
+            torch.stack(regression_losses).mean(dim=0, keepdim=True))
+
+
+class TestLosses(unittest.TestCase):
+    """ Test losses's functions functionality
+    """
+
+    def test_batched_focal_loss(self):
+        """ test that the batched loss matches the per-image loop
+        """
+        torch.manual_seed(0)
+        anchors = Anchors()(torch.zeros(1, 3, 64, 96))
+        num_anchors = anchors.shape[1]
+        classifications = torch.randn(3, num_anchors, 2) - 2
+        regressions = torch.randn(3, num_anchors, NUM_VARIABLES)
+        # -1 padded rows, and a last image without annotations
+        annotations = torch.tensor([
+            [[20.0, 30.0, 45.0, 0.0], [70.0, 10.0, 270.0, 1.0], [-1.0, -1.0, -1.0, -1.0]],
+            [[50.0, 40.0, 180.0, 1.0], [-1.0, -1.0, -1.0, -1.0], [-1.0, -1.0, -1.0, -1.0]],
+            [[-1.0, -1.0, -1.0, -1.0], [-1.0, -1.0, -1.0, -1.0], [-1.0, -1.0, -1.0, -1.0]],
+        ])
+
+        classification_loss, regression_loss = FocalLoss()(classifications, regressions, anchors, annotations)
+        expected_classification, expected_regression = per_image_focal_loss(
+            classifications, regressions, anchors, annotations)
+
+        self.assertGreater(float(expected_regression), 0)
+        torch.testing.assert_allclose(classification_loss, expected_classification, rtol=1e-5, atol=1e-6)
+        torch.testing.assert_allclose(regression_loss, expected_regression, rtol=1e-5, atol=1e-6)
@@ -0,0 +1,61 @@
+import unittest
+import torch
+import torch.nn as nn
+from retinanet import model
+
+
+class TestModel(unittest.TestCase):
+    """ Test model's functions functionality
+    """
+
+    def test_fold_batchnorm(self):
+        """ test that folding the BatchNorms keeps the outputs
+        """
+        torch.manual_seed(0)
+        retinanet = model.resnet50(num_classes=2)
+        # non-trivial frozen statistics and affine parameters
+        for module in retinanet.modules():
+            if isinstance(module, nn.BatchNorm2d):
+                module.running_mean.uniform_(-0.5, 0.5)
+                module.running_var.uniform_(0.5, 2.0)
+                module.weight.data.uniform_(0.5, 1.5)
+                module.bias.data.uniform_(-0.5, 0.5)
+        retinanet.eval()
+
+        img_batch = torch.rand(2, 3, 64, 96)
+        with torch.no_grad():
+            regression, classification = retinanet._forward_heads(img_batch)
+            retinanet.fold_batchnorm()
+            folded_regression, folded_classification = retinanet._forward_heads(img_batch)
+
+        self.assertFalse(any(isinstance(module, nn.BatchNorm2d) for module in retinanet.modules()))
+        self.assertTrue(torch.allclose(folded_regression, regression, rtol=1e-4, atol=1e-4))
+        self.assertTrue(torch.allclose(folded_classification, classification, rtol=1e-4, atol=1e-4))
+
+    def test_fuse_heads(self):
+        """ test that fused heads keep the outputs and load unfused checkpoints
+        """
+        torch.manual_seed(0)
+        retinanet = model.resnet50(num_classes=3)
+        # non-trivial output layers, they are zero-initialized
+        for head in (retinanet.regressionModel, retinanet.classificationModel):
+            head.output.weight.data.normal_(0, 0.01)
+        retinanet.eval()
+        checkpoint = retinanet.state_dict()
+
+        img_batch = torch.rand(2, 3, 64, 96)
+        with torch.no_grad():
+            regression, classification = retinanet._forward_heads(img_batch)
+            retinanet.fuse_heads()
+            fused_regression, fused_classification = retinanet._forward_heads(img_batch)
+
+        self.assertTrue(torch.allclose(fused_regression, regression, rtol=1e-4, atol=1e-5))
+        self.assertTrue(torch.allclose(fused_classification, classification, rtol=1e-4, atol=1e-5))
+
+        fused = model.resnet50(num_classes=3, fused_heads=True)
+        fused.load_state_dict(checkpoint)
+        fused.eval()
+        with torch.no_grad():
+            loaded_regression, loaded_classification = fused._forward_heads(img_batch)
+        self.assertTrue(torch.allclose(loaded_regression, regression, rtol=1e-4, atol=1e-5))
+        self.assertTrue(torch.allclose(loaded_classification, classification, rtol=1e-4, atol=1e-5))
@@ -0,0 +1,48 @@
+import unittest
+import numpy as np
+import torch
+from retinanet.nms import point_nms
+
+
+def greedy_nms(points, scores, groups, radius, angle_threshold):
+    keep = []
+    for i in np.argsort(-scores, kind='stable'):
+        duplicate = False
+        for k in keep:
+            dxy = np.hypot(*(points[i, :2] - points[k, :2]))
+            dalpha = abs(points[i, 2] - points[k, 2])
+            if groups[i] == groups[k] and dxy <= radius and dalpha <= angle_threshold:
+                duplicate = True
+                break
+        if not duplicate:
+            keep.append(i)
+    return keep
+
+
+class TestNMS(unittest.TestCase):
+    """ Test nms's functions functionality
+    """
+
+    def test_point_nms_matches_greedy(self):
+        """ test that point nms equals sequential greedy nms
+        """
+        rng = np.random.RandomState(0)
+        points = np.stack([rng.uniform(0, 60, 300),
+                           rng.uniform(0, 60, 300),
+                           rng.uniform(0, 90, 300)], axis=1).astype(np.float32)
+        scores = rng.permutation(300).astype(np.float32)
+        groups = rng.randint(0, 2, 300)
+
+        expected = greedy_nms(points, scores, groups, 8, 12.5)
+        keep = point_nms(torch.from_numpy(points), torch.from_numpy(scores),
+                         groups=torch.from_numpy(groups), radius=8, angle_threshold=12.5)
+
+        self.assertEqual(keep.tolist(), expected)
+
+    def test_point_nms_empty(self):
+        keep = point_nms(torch.zeros((0, 3)), torch.zeros((0,)))
+        self.assertEqual(keep.shape[0], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
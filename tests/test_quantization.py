@@ -0,0 +1,59 @@
+import io
+import unittest
+import torch
+import torch.nn as nn
+from retinanet import model
+from retinanet.quantization import quantize
+
+
+@unittest.skipIf('fbgemm' not in torch.backends.quantized.supported_engines,
+                 'fbgemm quantized engine not available')
+class TestQuantization(unittest.TestCase):
+    """ Test quantization's functions functionality
+    """
+
+    def setUp(self):
+        torch.manual_seed(0)
+        self.model = model.resnet50(num_classes=2)
+        self.model.eval()
+        self.images = [torch.rand(2, 3, 64, 96) for _ in range(2)]
+
+    def test_quantized_heads_layout(self):
+        """ test that the int8 trunk returns the head layouts of the float model
+        """
+        quantized = quantize(self.model, self.images)
+        self.assertTrue(quantized.quantized)
+        self.assertFalse(self.model.quantized)
+
+        with torch.no_grad():
+            regression, classification = self.model._forward_heads(self.images[0])
+            q_regression, q_classification = quantized._forward_heads(self.images[0])
+
+        self.assertEqual(q_regression.shape, regression.shape)
+        self.assertEqual(q_classification.shape, classification.shape)
+        self.assertEqual(q_classification.dtype, torch.float32)
+
+    def test_quantized_model_pickles(self):
+        """ test that a saved quantized model loads and runs inference
+        """
+        buffer = io.BytesIO()
+        torch.save(quantize(self.model, self.images), buffer)
+        buffer.seek(0)
+        loaded = torch.load(buffer)
+
+        with torch.no_grad():
+            detections = loaded((self.images[0], torch.tensor([[64, 96], [40, 96]])))
+        self.assertEqual(len(detections), 2)
+
+    def test_quantize_unfolded_batchnorm(self):
+        """ test that models with real BatchNorms, folded or not, quantize
+        """
+        self.assertIsInstance(self.model.bn1, nn.BatchNorm2d)
+        self.assertIsInstance(self.model.layer1[0].bn1, nn.BatchNorm2d)
+        quantized = quantize(self.model, self.images)
+
+        folded = quantize(self.model.fold_batchnorm(), self.images)
+        with torch.no_grad():
+            regression, _ = quantized._forward_heads(self.images[0])
+            folded_regression, _ = folded._forward_heads(self.images[0])
+        self.assertEqual(folded_regression.shape, regression.shape)
@@ -0,0 +1,68 @@
+import json
+import threading
+import unittest
+import urllib.request
+import cv2
+import numpy as np
+import torch
+from retinanet.serving import InferenceServer, MicroBatcher
+
+
+class CornerModel(object):
+    """ Detects one point in the corner of every image, records its batches """
+    quantized = False
+
+    def __init__(self):
+        self.batches = []
+
+    def __call__(self, inputs):
+        img_batch, sizes = inputs
+        self.batches.append(tuple(img_batch.shape))
+        return [[torch.tensor([0.9]), torch.tensor([1]), torch.tensor([[float(cols), float(rows), 0.0]])]
+                for rows, cols in sizes.tolist()]
+
+
+class TestServing(unittest.TestCase):
+    """ Test serving's functions functionality
+    """
+
+    def test_micro_batching(self):
+        """ test that concurrent requests are batched by padded size
+        """
+        model = CornerModel()
+        batcher = MicroBatcher(model, max_batch_size=4, max_wait=0.2, device='cpu')
+        images = [np.zeros((50, 80, 3), dtype=np.uint8)] * 6 + [np.zeros((100, 80, 3), dtype=np.uint8)] * 2
+        futures = [batcher.submit(image) for image in images]
+        results = [future.result(timeout=10) for future in futures]
+        batcher.close()
+
+        self.assertEqual([tuple(points[0, :2]) for _, _, points in results],
+                         [(80, 50)] * 6 + [(80, 100)] * 2)
+        self.assertEqual(sorted(model.batches), [(2, 3, 64, 96), (2, 3, 128, 96), (4, 3, 64, 96)])
+
+    def test_server(self):
+        """ test that the server returns JSON detections of posted images
+        """
+        batcher = MicroBatcher(CornerModel(), max_batch_size=4, max_wait=0.01, device='cpu')
+        server = InferenceServer(batcher, port=0, class_names={1: 'seed'})
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        try:
+            body = cv2.imencode('.png', np.zeros((50, 80, 3), dtype=np.uint8))[1].tobytes()
+            url = 'http://{}:{}/detect'.format(*server.server_address)
+            with urllib.request.urlopen(urllib.request.Request(url, data=body)) as response:
+                detections = json.loads(response.read().decode('utf-8'))['detections']
+        finally:
+            server.shutdown()
+            server.server_close()
+            batcher.close()
+
+        self.assertEqual(len(detections), 1)
+        self.assertEqual(detections[0]['label'], 'seed')
+        self.assertEqual((detections[0]['x'], detections[0]['y']), (80, 50))
+
+    def test_loopback_only(self):
+        """ test that the server refuses non-loopback addresses
+        """
+        with self.assertRaises(ValueError):
+            InferenceServer(None, host='0.0.0.0', port=0)
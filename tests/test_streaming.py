@@ -0,0 +1,65 @@
+import os
+import shutil
+import tempfile
+import unittest
+import cv2
+import numpy as np
+import torch
+from retinanet.streaming import VideoPipeline, preprocess
+
+
+class EmptyModel(object):
+    """ Detects nothing, records the batches it runs """
+    quantized = False
+
+    def __init__(self):
+        self.batches = []
+
+    def __call__(self, inputs):
+        img_batch, sizes = inputs
+        self.batches.append(tuple(img_batch.shape))
+        return [[torch.zeros((0,)), torch.zeros((0,), dtype=torch.long), torch.zeros((0, 3))]
+                for _ in range(img_batch.shape[0])]
+
+
+class TestStreaming(unittest.TestCase):
+    """ Test streaming's functions functionality
+    """
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'video.avi')
+        writer = cv2.VideoWriter(self.path, cv2.VideoWriter_fourcc(*'MJPG'), 25.0, (80, 50))
+        for i in range(12):
+            writer.write(np.full((50, 80, 3), 20 * i, dtype=np.uint8))
+        writer.release()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_preprocess(self):
+        """ test that frames are padded to a multiple of 32 and normalized
+        """
+        frame = np.zeros((50, 80, 3), dtype=np.uint8)
+        frame[..., 0] = 255  # blue
+        img_batch, sizes = preprocess([frame, frame], torch.device('cpu'))
+        self.assertEqual(tuple(img_batch.shape), (2, 3, 64, 96))
+        self.assertEqual(sizes.tolist(), [[50, 80], [50, 80]])
+        self.assertAlmostEqual(float(img_batch[0, 2, 0, 0]), (1 - 0.406) / 0.225, places=4)
+        self.assertEqual(float(img_batch[0, 0, 60, 90]), 0)
+
+    def test_video_file(self):
+        """ test that every frame of a video file is processed once, in order
+        """
+        written = []
+        model = EmptyModel()
+        pipeline = VideoPipeline(model, self.path, batch_size=4, queue_size=2, drop_frames=False,
+                                 sink=lambda index, image, *detections: written.append(index),
+                                 device='cpu')
+        report = pipeline.run()
+
+        self.assertEqual(written, list(range(12)))
+        self.assertEqual(report['dropped'], 0)
+        self.assertEqual(report['inference']['frames'], 12)
+        self.assertEqual(report['end_to_end']['frames'], 12)
+        self.assertTrue(all(shape[0] <= 4 for shape in model.batches))
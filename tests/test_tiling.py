@@ -0,0 +1,54 @@
+import unittest
+import torch
+from retinanet.tiling import tile_origins, tiled_detect
+
+
+class BrightPixels(object):
+    """ Detects every pixel brighter than 0.5 of the image part of a tile """
+    nms_radius = 8
+    nms_angle_threshold = 12.5
+    max_detections = None
+
+    def __init__(self):
+        self.tiles = []
+
+    def __call__(self, inputs):
+        tile_batch, sizes = inputs
+        self.tiles.append(tile_batch.shape)
+        detections = []
+        for tile, (rows, cols) in zip(tile_batch, sizes.tolist()):
+            y, x = (tile[0, :rows, :cols] > 0.5).nonzero(as_tuple=True)
+            points = torch.stack([x, y, torch.zeros_like(x)], dim=1).float()
+            detections.append([tile[0, y, x], torch.zeros_like(x), points])
+        return detections
+
+
+class TestTiling(unittest.TestCase):
+    """ Test tiling's functions functionality
+    """
+
+    def test_tile_origins(self):
+        """ test that tiles cover the whole axis with the requested overlap
+        """
+        self.assertEqual(tile_origins(100, 128, 32), [0])
+        self.assertEqual(tile_origins(300, 128, 32), [0, 96, 172])
+        self.assertEqual(tile_origins(224, 128, 32), [0, 96])
+
+    def test_tiled_detect(self):
+        """ test that tiled detections are in image coordinates and found once
+        """
+        image = torch.zeros((3, 300, 200))
+        expected = [(10, 20), (95, 100), (110, 100), (199, 299), (150, 160)]
+        for i, (x, y) in enumerate(expected):
+            image[0, y, x] = 0.6 + 0.05 * i
+        # padding below the image is never run
+        padded = torch.cat([image, torch.ones((3, 200, 200))], dim=1)
+
+        model = BrightPixels()
+        scores, labels, points = tiled_detect(model, padded, image_size=(300, 200),
+                                              tile_size=128, overlap=32, batch_size=4)
+
+        self.assertEqual(sorted(tuple(point[:2].long().tolist()) for point in points), sorted(expected))
+        self.assertTrue(torch.all(scores[:-1] >= scores[1:]))
+        # 3 x 2 tiles in two batches
+        self.assertEqual([shape[0] for shape in model.tiles], [4, 2])
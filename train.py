@@ -1,18 +1,21 @@
 import argparse
-import collections
-
-import numpy as np
+import functools
+import os
 
 import torch
 import torch.optim as optim
 from torchvision import transforms
 
 from retinanet import model
-from retinanet.dataloader import CocoDataset, CSVDataset, collater, Resizer, AspectRatioBasedSampler, Augmenter, Normalizer
+from retinanet.dataloader import CocoDataset, CSVDataset, collater, Resizer, AspectRatioBasedSampler, Augmenter, Normalizer, \
+    AnchorTargets, BatchCollater, SizeBucketSampler
 from torch.utils.data import DataLoader
 
 from retinanet import coco_eval
 from retinanet import csv_eval
+from retinanet.device import DeviceContext
+from retinanet.image_cache import ImageCache
+from retinanet.training import LossLog, train_step
 
 assert torch.__version__.split('.')[0] == '1'
 
@@ -42,9 +45,35 @@ def main(args=None):
     parser.add_argument('--images_dir', help='image files direction', type=str)
     parser.add_argument('--epochs', help='Number of epochs',
                         type=int, default=100)
+    parser.add_argument('--batch_size', help='Number of images per batch',
+                        type=int, default=1)
+    parser.add_argument('--worker_targets', help='Assign anchors to annotations in the DataLoader workers',
+                        action='store_true')
+    parser.add_argument('--fused_heads', help='Run both heads as one grouped conv stack',
+                        action='store_true')
+    parser.add_argument('--share_first_layer', help='Share the first layer of the fused heads',
+                        action='store_true')
+    parser.add_argument('--log_interval', help='Iterations between two loss readbacks and prints',
+                        type=int, default=20)
+    parser.add_argument('--skip_zero_loss', help='Skip the optimizer step of zero-loss batches, as before; '
+                        'synchronizes with the device on every step', action='store_true')
+    parser.add_argument('--uint8_images', help='Keep training images uint8 until the batch is on the device, '
+                        'normalize it there', action='store_true')
+    parser.add_argument('--size_buckets', help='Batch images of one of a few padded shapes, with at most this '
+                        'many different rows and cols (0: batch by aspect ratio)', type=int, default=0)
+    parser.add_argument('--batch_buffers', help='Collate training batches into reused shared memory buffers',
+                        action='store_true')
+    parser.add_argument('--image_cache_dir', help='Decode the images once into memory-mapped caches in this '
+                        'directory, reused and updated by later runs')
 
     parser = parser.parse_args(args)
 
+    train_transforms = [Augmenter(), Resizer()]
+    if not parser.uint8_images:
+        train_transforms.insert(0, Normalizer())
+    if parser.worker_targets:
+        train_transforms.append(AnchorTargets())
+
     # Create the data loaders
     if parser.dataset == 'coco':
 
@@ -52,7 +81,7 @@ def main(args=None):
             raise ValueError('Must provide --coco_path when training on COCO,')
 
         dataset_train = CocoDataset(parser.coco_path, set_name='train2017',
-                                    transform=transforms.Compose([Normalizer(), Augmenter(), Resizer()]))
+                                    transform=transforms.Compose(train_transforms))
         dataset_val = CocoDataset(parser.coco_path, set_name='val2017',
                                   transform=transforms.Compose([Normalizer(), Resizer()]))
 
@@ -66,7 +95,7 @@ def main(args=None):
                 'Must provide --csv_classes when training on COCO,')
 
         dataset_train = CSVDataset(train_file=parser.csv_train, class_list=parser.csv_classes,
-                                   transform=transforms.Compose([Normalizer(), Augmenter(), Resizer()]), images_dir=parser.images_dir, image_extension=parser.ext)
+                                   transform=transforms.Compose(train_transforms), images_dir=parser.images_dir, image_extension=parser.ext)
 
         if parser.csv_val is None:
             dataset_val = None
@@ -79,10 +108,33 @@ def main(args=None):
         raise ValueError(
             'Dataset type not understood (must be csv or coco), exiting.')
 
-    sampler = AspectRatioBasedSampler(
-        dataset_train, batch_size=1, drop_last=False)
+    dataset_train.uint8_images = parser.uint8_images
+
+    if parser.image_cache_dir is not None:
+        os.makedirs(parser.image_cache_dir, exist_ok=True)
+        for name, dataset in (('train', dataset_train), ('val', dataset_val)):
+            if dataset is not None:
+                dataset.image_cache = ImageCache.build(
+                    dataset, os.path.join(parser.image_cache_dir, '{}_{}'.format(parser.dataset, name)))
+
+    context = DeviceContext()
+
+    shapes = None
+    if parser.size_buckets:
+        sampler = SizeBucketSampler(
+            dataset_train, batch_size=parser.batch_size, drop_last=False, max_sizes=parser.size_buckets)
+        shapes = sampler.shapes
+        print('Padded training shapes: {}'.format(shapes))
+    else:
+        sampler = AspectRatioBasedSampler(
+            dataset_train, batch_size=parser.batch_size, drop_last=False)
+    if parser.batch_buffers:
+        collate_fn = BatchCollater(shapes=shapes)
+    else:
+        collate_fn = functools.partial(collater, shapes=shapes)
     dataloader_train = DataLoader(
-        dataset_train, num_workers=3, collate_fn=collater, batch_sampler=sampler)
+        dataset_train, num_workers=3, collate_fn=collate_fn, batch_sampler=sampler,
+        pin_memory=context.is_cuda)
 
     if dataset_val is not None:
         sampler_val = AspectRatioBasedSampler(
@@ -93,33 +145,29 @@ def main(args=None):
     # Create the model
     if parser.depth == 18:
         retinanet = model.resnet18(
-            num_classes=dataset_train.num_classes(), pretrained=True)
+            num_classes=dataset_train.num_classes(), pretrained=True,
+            fused_heads=parser.fused_heads, share_first_layer=parser.share_first_layer)
     elif parser.depth == 34:
         retinanet = model.resnet34(
-            num_classes=dataset_train.num_classes(), pretrained=True)
+            num_classes=dataset_train.num_classes(), pretrained=True,
+            fused_heads=parser.fused_heads, share_first_layer=parser.share_first_layer)
     elif parser.depth == 50:
         retinanet = model.resnet50(
-            num_classes=dataset_train.num_classes(), pretrained=True)
+            num_classes=dataset_train.num_classes(), pretrained=True,
+            fused_heads=parser.fused_heads, share_first_layer=parser.share_first_layer)
     elif parser.depth == 101:
         retinanet = model.resnet101(
-            num_classes=dataset_train.num_classes(), pretrained=True)
+            num_classes=dataset_train.num_classes(), pretrained=True,
+            fused_heads=parser.fused_heads, share_first_layer=parser.share_first_layer)
     elif parser.depth == 152:
         retinanet = model.resnet152(
-            num_classes=dataset_train.num_classes(), pretrained=True)
+            num_classes=dataset_train.num_classes(), pretrained=True,
+            fused_heads=parser.fused_heads, share_first_layer=parser.share_first_layer)
     else:
         raise ValueError(
             'Unsupported model depth, must be one of 18, 34, 50, 101, 152')
 
-    use_gpu = True
-
-    if use_gpu:
-        if torch.cuda.is_available():
-            retinanet = retinanet.cuda()
-
-    if torch.cuda.is_available():
-        retinanet = torch.nn.DataParallel(retinanet).cuda()
-    else:
-        retinanet = torch.nn.DataParallel(retinanet)
+    retinanet = torch.nn.DataParallel(context.place(retinanet))
 
     retinanet.training = True
 
@@ -128,7 +176,7 @@ def main(args=None):
     scheduler = optim.lr_scheduler.ReduceLROnPlateau(
         optimizer, patience=3, verbose=True)
 
-    loss_hist = collections.deque(maxlen=500)
+    loss_log = LossLog(interval=parser.log_interval)
 
     retinanet.train()
     retinanet.module.freeze_bn()
@@ -140,46 +188,20 @@ def main(args=None):
         retinanet.train()
         retinanet.module.freeze_bn()
 
-        epoch_loss = []
-
         for iter_num, data in enumerate(dataloader_train):
             try:
-                optimizer.zero_grad()
-                if torch.cuda.is_available():
-                    classification_loss, regression_loss = retinanet(
-                        [data['img'].cuda().float(), data['annot']])
-                else:
-                    classification_loss, regression_loss = retinanet(
-                        [data['img'].float(), data['annot']])
-
-                classification_loss = classification_loss.mean()
-                regression_loss = regression_loss.mean()
-
-                loss = classification_loss + regression_loss
-
-                if bool(loss == 0):
-                    continue
-
-                loss.backward()
-
-                torch.nn.utils.clip_grad_norm_(retinanet.parameters(), 0.1)
-
-                optimizer.step()
-
-                loss_hist.append(float(loss))
-
-                epoch_loss.append(float(loss))
-
-                print(
-                    'Epoch: {} | Iteration: {} | Classification loss: {:1.5f} | Regression loss: {:1.5f} | Running loss: {:1.5f}'.format(
-                        epoch_num, iter_num, float(classification_loss), float(regression_loss), np.mean(loss_hist)))
-
-                del classification_loss
-                del regression_loss
+                # no host synchronization: losses are read back every log_interval iterations
+                classification_loss, regression_loss = train_step(
+                    retinanet, optimizer, context.training_inputs(data), skip_zero_loss=parser.skip_zero_loss)
+                loss_log.append(epoch_num, iter_num, classification_loss, regression_loss)
             except Exception as e:
                 print(e)
                 continue
 
+        epoch_loss = loss_log.end_epoch()
+        if parser.size_buckets:
+            print('Epoch: {} | Padding waste: {:.1%}'.format(epoch_num, sampler.padding_waste))
+
         if parser.dataset == 'coco':
 
             print('Evaluating dataset')
@@ -190,9 +212,9 @@ def main(args=None):
 
             print('Evaluating dataset')
 
-            mAP = csv_eval.evaluate(dataset_val, retinanet)
+            mAP = csv_eval.evaluate(dataset_val, retinanet, batch_size=parser.batch_size)
 
-        scheduler.step(np.mean(epoch_loss))
+        scheduler.step(epoch_loss)
 
         torch.save(retinanet.module, '{}_retinanet_{}.pt'.format(
             parser.dataset, epoch_num))
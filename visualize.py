@@ -16,6 +16,7 @@ from torchvision import datasets, models, transforms
 
 from retinanet.dataloader import CocoDataset, CSVDataset, collater, Resizer, AspectRatioBasedSampler, Augmenter, \
 	UnNormalizer, Normalizer
+from retinanet.device import DeviceContext
 
 
 assert torch.__version__.split('.')[0] == '1'
@@ -47,16 +48,9 @@ def main(args=None):
 
 	retinanet = torch.load(parser.model)
 
-	use_gpu = True
-
-	if use_gpu:
-		if torch.cuda.is_available():
-			retinanet = retinanet.cuda()
-
-	if torch.cuda.is_available():
-		retinanet = torch.nn.DataParallel(retinanet).cuda()
-	else:
-		retinanet = torch.nn.DataParallel(retinanet)
+	# quantized models run on the CPU only
+	context = DeviceContext.for_model(retinanet)
+	retinanet = torch.nn.DataParallel(context.place(retinanet))
 
 	retinanet.eval()
 
@@ -72,10 +66,7 @@ def main(args=None):
 
 		with torch.no_grad():
 			st = time.time()
-			if torch.cuda.is_available():
-				scores, classification, transformed_anchors = retinanet(data['img'].cuda().float())
-			else:
-				scores, classification, transformed_anchors = retinanet(data['img'].float())
+			scores, classification, transformed_anchors = retinanet(context.to(data['img']))
 			print('Elapsed time: {}'.format(time.time()-st))
 			idxs = np.where(scores.cpu()>0.5)
 			img = np.array(255 * unnormalize(data['img'][0, :, :, :])).copy()
@@ -1,6 +1,6 @@
 from retinanet.dataloader import CocoDataset, CSVDataset, collater, Resizer, AspectRatioBasedSampler, Augmenter, \
     UnNormalizer, Normalizer
-from retinanet.losses import calc_distance
+from retinanet.geometry import nearest, threshold_masks
 from retinanet.anchors import Anchors
 from utils.visutils import write_angle, draw_line
 import matplotlib.pyplot as plt
@@ -67,28 +67,28 @@ def main(args=None):
         image = (dataset.load_image(i) * 255).astype(np.int32)
         anots = dataset.load_annotations(i)
 
-        distance = calc_distance(torch.tensor(anchors[0, :, :]),
-                                 torch.tensor(anots[:, :NUM_VARIABLES]))
-        distance_min, distance_argmin = torch.min(
-            distance, dim=1)  # num_anchors x 1
+        distance_min, distance_argmin = nearest(
+            anchors[0, :, :].cpu(), torch.tensor(anots[:, :NUM_VARIABLES], dtype=torch.float32),
+            position_weight=POSITION_WEIGHT)  # num_anchors x 1
 
         targets = torch.ones((anchors.shape[1], 1)) * -1
-        targets[torch.ge(
-            distance_min, 13 * MAX_ANOT_ANCHOR_POSITION_DISTANCE), :] = 0
 
-        positive_indices = torch.le(
-            distance_min, 11 * MAX_ANOT_ANCHOR_POSITION_DISTANCE)
+        positive_indices, negative_indices = threshold_masks(
+            distance_min,
+            11 * MAX_ANOT_ANCHOR_POSITION_DISTANCE,
+            13 * MAX_ANOT_ANCHOR_POSITION_DISTANCE)
+        targets[negative_indices, :] = 0
 
         num_positive_anchors = positive_indices.sum()
 
         # assigned_annotations = center_alpha_annotation[deltaphi_argmin, :] # no different in result
-        assigned_annotations = anots[distance_argmin, :]
+        assigned_annotations = anots[distance_argmin.numpy(), :]
 
         targets[positive_indices, :] = 0
         targets[positive_indices,
-                assigned_annotations[positive_indices, 3]] = 1
+                torch.from_numpy(assigned_annotations[positive_indices.numpy(), 3]).long()] = 1
 
-        _anchors = anchors[0, :, :]
+        _anchors = anchors[0, :, :].cpu()
         for anchor in _anchors[targets.squeeze() == 1]:
             x, y, alpha = anchor[0], anchor[1], 90 - anchor[2]
             image = draw_line(
@@ -6,6 +6,9 @@ import csv
 import cv2
 import argparse
 
+from retinanet.device import DeviceContext
+from retinanet.tiling import tiled_detect
+
 
 def load_classes(csv_reader):
     result = {}
@@ -44,7 +47,8 @@ def draw_caption(image, box, caption):
     cv2.putText(image, caption, (b[0], b[1] - 10), cv2.FONT_HERSHEY_PLAIN, 1, (255, 255, 255), 1)
 
 
-def detect_image(image_path, model_path, class_list):
+def detect_image(image_path, model_path, class_list, channels_last=False, bfloat16=False, fold_bn=False,
+                 tile_size=None, tile_overlap=64, tile_batch_size=4):
 
     with open(class_list, 'r') as f:
         classes = load_classes(csv.reader(f, delimiter=','))
@@ -53,13 +57,18 @@ def detect_image(image_path, model_path, class_list):
     for key, value in classes.items():
         labels[value] = key
 
-    model = torch.load(model_path)
+    model = torch.load(model_path, map_location='cpu')
 
-    if torch.cuda.is_available():
-        model = model.cuda()
+    # quantized models run on the CPU only
+    context = DeviceContext.for_model(model)
+    model = context.place(model)
 
     model.training = False
     model.eval()
+    if fold_bn:
+        model.fold_batchnorm()
+    if channels_last or bfloat16:
+        model.set_cpu_inference_mode(channels_last=channels_last, bfloat16=bfloat16)
 
     for img_name in os.listdir(image_path):
 
@@ -70,25 +79,29 @@ def detect_image(image_path, model_path, class_list):
 
         rows, cols, cns = image.shape
 
-        pad_w = 32 - rows % 32
-        pad_h = 32 - cols % 32
+        if tile_size:
+            # only the tiles are padded and converted to float
+            image = torch.from_numpy(image).permute(2, 0, 1)
+        else:
+            pad_w = 32 - rows % 32
+            pad_h = 32 - cols % 32
 
-        new_image = np.zeros((rows + pad_w, cols + pad_h, cns)).astype(np.float32)
-        new_image[:rows, :cols, :] = image.astype(np.float32)
-        image = new_image.astype(np.float32)
+            # padded NHWC buffer, viewed as NCHW: already channels_last, no transpose copy
+            new_image = torch.zeros((1, rows + pad_w, cols + pad_h, cns), dtype=torch.float32)
+            new_image[0, :rows, :cols, :] = torch.from_numpy(image)
+            image = new_image.permute(0, 3, 1, 2)
 
-        image = np.expand_dims(image, 0)
-        image = np.transpose(image, (0, 3, 1, 2))
         with torch.no_grad():
 
-            image = torch.from_numpy(image)
-            if torch.cuda.is_available():
-                image = image.cuda()
-
             st = time.time()
 
             print(image.shape)
-            scores, classification, transformed_anchors = model(image.cuda().float())
+            if tile_size:
+                scores, classification, transformed_anchors = tiled_detect(
+                    model, image, tile_size=tile_size, overlap=tile_overlap, batch_size=tile_batch_size,
+                    device=context.device)
+            else:
+                scores, classification, transformed_anchors = model(context.to(image))
             print('Elapsed time: {}'.format(time.time() - st))
             idxs = np.where(scores.cpu() > 0.5)
 
@@ -119,7 +132,16 @@ if __name__ == '__main__':
     parser.add_argument('--image_dir', help='Path to directory containing images')
     parser.add_argument('--model_path', help='Path to model')
     parser.add_argument('--class_list', help='Path to CSV file listing class names (see README)')
+    parser.add_argument('--channels_last', help='Run the model on channels_last tensors', action='store_true')
+    parser.add_argument('--bf16', help='Run the backbone and heads under CPU bfloat16 autocast', action='store_true')
+    parser.add_argument('--fold_bn', help='Fold the BatchNorms into the convolutions', action='store_true')
+    parser.add_argument('--tile_size', help='Run the images tile by tile, tile side in pixels (multiple of 32)',
+                        type=int, default=None)
+    parser.add_argument('--tile_overlap', help='Overlap of neighbouring tiles in pixels', type=int, default=64)
+    parser.add_argument('--tile_batch_size', help='Tiles per forward pass', type=int, default=4)
 
     parser = parser.parse_args()
 
-    detect_image(parser.image_dir, parser.model_path, parser.class_list)
+    detect_image(parser.image_dir, parser.model_path, parser.class_list,
+                 channels_last=parser.channels_last, bfloat16=parser.bf16, fold_bn=parser.fold_bn,
+                 tile_size=parser.tile_size, tile_overlap=parser.tile_overlap, tile_batch_size=parser.tile_batch_size)